@@ -0,0 +1,240 @@
+"""
+<Program>
+  benchmark_parser.py
+
+<Purpose>
+  Benchmark for the strace parser. It reads the strace traces in
+  ../Linux/Ubuntu12.04LTS and the strace traces packed in
+  ../../program_traces into memory, and times parse_trace on each of them.
+  The lines per second parsed are printed for each trace and in total.
+
+  It then times parse_syscall, which builds the intermediate representation
+  of each action, and prints the actions per second for each syscall type. 
+  The arguments given to parse_syscall are recorded while the traces are 
+  parsed.
+
+  If the directory of another copy of the parser is given (eg the parser of
+  an older revision, exported with git archive), it is timed on the same
+  traces and arguments as well, so that the two can be compared.
+
+    python benchmark_parser.py [baseline_parser_dir]
+"""
+
+import glob
+import os
+import sys
+import tarfile
+import time
+
+PARSER_MODULES = ["parser_intermediate_representation", "parser_helper_calls",
+                  "parser_strace_calls"]
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+
+def load_parser(parser_dir):
+  """
+  Imports the strace parser found in parser_dir. Parser modules already
+  imported from another directory are put aside first, so that more than one
+  copy of the parser can be loaded.
+  """
+  for module_name in PARSER_MODULES:
+    sys.modules.pop(module_name, None)
+
+  sys.path.insert(0, parser_dir)
+  try:
+    import parser_strace_calls
+  finally:
+    sys.path.pop(0)
+
+  return parser_strace_calls
+
+
+
+def read_traces():
+  """
+  Returns a list of (trace_name, lines) tuples.
+  """
+  traces = []
+  trace_files = glob.glob(os.path.join(BENCHMARK_DIR, "..", "Linux",
+                                       "Ubuntu12.04LTS", "*.strace"))
+  for trace_file in sorted(trace_files):
+    traces.append((os.path.basename(trace_file),
+                   open(trace_file, "r").readlines()))
+
+  # the program traces are read straight from their archives.
+  archives = glob.glob(os.path.join(BENCHMARK_DIR, "..", "..",
+                                    "program_traces", "*.tar.gz"))
+  for archive in sorted(archives):
+    tar = tarfile.open(archive, "r:gz")
+    for member in tar.getmembers():
+      if member.isfile() and member.name.find(".strace") != -1:
+        traces.append((member.name, tar.extractfile(member).readlines()))
+    tar.close()
+
+  return traces
+
+
+
+class CountingLines(object):
+  """
+  Iterates over lines and counts the lines handed out, so that the lines 
+  parsed are known even if the parser stops early.
+  """
+
+  def __init__(self, lines):
+    self.lines = lines
+    self.count = 0
+
+
+  def __iter__(self):
+    for line in self.lines:
+      self.count += 1
+      yield line
+
+
+
+def time_parser(description, parser, traces):
+  """
+  Times the parser on each trace. The parser does not support every line of
+  the program traces yet and stops at the first line it cannot parse, so in
+  that case it is started again on the rest of the trace. The number of such
+  lines is printed as well.
+  """
+  print description
+  total_lines = 0
+  total_elapsed = 0.0
+  for trace_name, lines in traces:
+    counting_lines = CountingLines(lines)
+    remaining_lines = iter(counting_lines)
+    unsupported = 0
+    start = time.time()
+    while True:
+      try:
+        parser.parse_trace(remaining_lines)
+        break
+      except Exception:
+        unsupported += 1
+    elapsed = time.time() - start
+
+    total_lines += counting_lines.count
+    total_elapsed += elapsed
+    print "  %-36s %8d lines %10.0f lines/sec %6d unsupported" % (trace_name,
+        counting_lines.count, counting_lines.count / elapsed, unsupported)
+
+  print "  %-36s %8d lines %10.0f lines/sec" % ("total", total_lines,
+                                               total_lines / total_elapsed)
+  print
+  return total_lines / total_elapsed
+
+
+
+def record_syscall_inputs(parser, traces):
+  """
+  Parses the traces and returns a dictionary that maps each syscall name to 
+  the list of (args, result) tuples parse_syscall was called with. Calls that
+  raised an exception are left out.
+  """
+  syscall_inputs = {}
+  parse_syscall = parser.parse_syscall
+
+  def recording_parse_syscall(syscall_name, args, result):
+    args_copy = list(args)
+    action = parse_syscall(syscall_name, args, result)
+    syscall_inputs.setdefault(syscall_name, []).append((args_copy, result))
+    return action
+
+  parser.parse_syscall = recording_parse_syscall
+  try:
+    for trace_name, lines in traces:
+      remaining_lines = iter(lines)
+      while True:
+        try:
+          parser.parse_trace(remaining_lines)
+          break
+        except Exception:
+          pass
+  finally:
+    parser.parse_syscall = parse_syscall
+
+  return syscall_inputs
+
+
+
+def time_parse_syscall(parser, syscall_inputs):
+  """
+  Returns a dictionary that maps each syscall name to the actions per second
+  parse_syscall builds for it, and the actions per second over all inputs.
+  Syscalls with few inputs are parsed repeatedly.
+  """
+  rates = {}
+  total_actions = 0
+  total_elapsed = 0.0
+  for syscall_name in syscall_inputs:
+    inputs = syscall_inputs[syscall_name]
+    repetitions = max(1, 20000 // len(inputs))
+
+    start = time.time()
+    for repetition in xrange(repetitions):
+      for args, result in inputs:
+        # parse_syscall may change args, so it is given a copy.
+        parser.parse_syscall(syscall_name, list(args), result)
+    elapsed = time.time() - start
+
+    rates[syscall_name] = repetitions * len(inputs) / elapsed
+    total_actions += len(inputs)
+    total_elapsed += elapsed / repetitions
+
+  return rates, total_actions / total_elapsed
+
+
+
+def print_syscall_rates(syscall_inputs, rates, baseline_rates=None):
+  header = "  %-16s %8s %14s" % ("syscall", "actions", "actions/sec")
+  if baseline_rates != None:
+    header += " %14s %8s" % ("baseline", "speedup")
+  print header
+
+  for syscall_name in sorted(syscall_inputs):
+    row = "  %-16s %8d %14.0f" % (syscall_name, 
+                                  len(syscall_inputs[syscall_name]),
+                                  rates[syscall_name])
+    if baseline_rates != None:
+      row += " %14.0f %7.2fx" % (baseline_rates[syscall_name],
+                                 rates[syscall_name] / 
+                                 baseline_rates[syscall_name])
+    print row
+  print
+
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 2:
+    raise Exception("usage: python benchmark_parser.py [baseline_parser_dir]")
+
+  traces = read_traces()
+
+  parser = load_parser(BENCHMARK_DIR)
+  rate = time_parser("parser in " + BENCHMARK_DIR, parser, traces)
+  syscall_inputs = record_syscall_inputs(parser, traces)
+  syscall_rates, syscall_rate = time_parse_syscall(parser, syscall_inputs)
+
+  if len(sys.argv) == 2:
+    baseline_dir = os.path.abspath(sys.argv[1])
+    baseline_parser = load_parser(baseline_dir)
+    baseline_rate = time_parser("parser in " + baseline_dir, baseline_parser,
+                                traces)
+    baseline_syscall_rates, baseline_syscall_rate = time_parse_syscall(
+        baseline_parser, syscall_inputs)
+    print "speedup: %.2fx" % (rate / baseline_rate)
+    print
+
+    print "parse_syscall"
+    print_syscall_rates(syscall_inputs, syscall_rates, baseline_syscall_rates)
+    print "parse_syscall speedup: %.2fx" % (syscall_rate / 
+                                            baseline_syscall_rate)
+  else:
+    print "parse_syscall"
+    print_syscall_rates(syscall_inputs, syscall_rates)
+    print "parse_syscall: %.0f actions/sec" % syscall_rate
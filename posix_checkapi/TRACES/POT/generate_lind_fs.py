@@ -10,9 +10,9 @@
 
 <Purpose>
   This module is responsible for generating a lind file system based on the 
-  information gathered from a trace. It provides a single public function which 
-  takes as argument a tuple with all the parsed system call actions and creates 
-  a set of files that make up the lind file system. The function returns nothing
+  information gathered from a trace. Its main public function takes as argument
+  an iterable with all the parsed system call actions and creates a set of 
+  files that make up the lind file system. The function returns nothing
   
   Example of using this module:
 
@@ -21,7 +21,15 @@
     
     fh = open(TRACE_FILE_NAME, "r")
     actions = parser_strace_calls.parse_trace(fh)
-    generate_lind_fs.generate_fs(actions)
+    generate_lind_fs.generate_fs(actions, TRACE_FILE_NAME)
+
+  iter_generate_fs does the same work but yields every action back once it has
+  been examined, so that it can sit between a streaming parser and a consumer
+  without the whole trace being held in memory:
+
+    actions = parser_strace_calls.iter_trace(fh)
+    for action in generate_lind_fs.iter_generate_fs(actions, TRACE_FILE_NAME):
+      ...
 
 <Remarks>
   generate_fs calls lind_test_server._blank_fs_init() which removes
@@ -31,18 +39,70 @@
 import os
 import sys
 
+import lind_blob_store
 import lind_test_server
+import parser_helper_calls
 from lind_fs_constants import *
 
 DEBUG = False
 
+# Size of the chunks in which files are copied into the lind fs.
+LIND_COPY_CHUNK_SIZE = 1024 * 1024
+
+# a list of system calls that include a filepath in their arguments. We only
+# care about these system calls so only the actions representing of these
+# system calls will be examined.
+SYSCALLS_WITH_PATH = ['open', 'creat', 'statfs', 'access', 'stat', 'link', 
+                      'unlink', 'chdir', 'rmdir', 'mkdir']
+
+
+"""
+This is the main public function of this module. It takes as argument an 
+iterable of trace actions and generates a lind fs based on the information it 
+can gather from these actions and the posix fs.
+"""
+def generate_fs(actions, trace_path=None, execve_line=None, syscalls=None,
+                blob_store=None, lazy=False):
+  for action in iter_generate_fs(actions, trace_path, execve_line, syscalls,
+                                 blob_store, lazy):
+    pass
+
 
 """
-This is the only public function of this module. It takes as argument a tuple of
-trace actions and generates a lind fs based on the information it can gather
-from these actions and the posix fs.
+Generator version of generate_fs. Each action is yielded back after it has been
+used to build the lind fs. The lind fs is confirmed once the actions are
+exhausted, so the generator must be consumed completely.
+
+The first line of the trace, which holds the execve syscall, can be given as
+execve_line instead of trace_path, so that traces read from a stream (see
+trace_input.py) do not have to be opened twice.
+
+syscalls is the selection of system calls the actions were parsed with (see 
+parser_helper_calls.select_syscalls). If it leaves out every system call that
+takes a file path, eg syscalls="net", the lind fs is not needed: no lind fs 
+files are created and the actions are yielded back untouched.
+
+If blob_store is given (a lind_blob_store.BlobStore), the contents of the 
+files are not copied into the lind fs data files. Once all the actions are 
+read, they are added to the blob store by a pool of worker processes instead,
+and the lind.blobs manifest records the blob of each data file (see 
+lind_blob_store.py). The lind fs metadata, including the file sizes, is the 
+same either way.
+
+If lazy is True, the contents of the files are neither copied nor read. The
+lind fs only holds their metadata, and the inode of each file holds a content
+reference to the host file (under the 'contentref' key, see 
+lind_blob_store.index_key) instead of a data file. The model reads the 
+contents in from a blob store or a snapshot of the host file system only when
+the trace first uses them (see wrapped_lind_fs_calls.load_fs).
 """
-def generate_fs(actions, trace_path):
+def iter_generate_fs(actions, trace_path=None, execve_line=None, 
+                     syscalls=None, blob_store=None, lazy=False):
+  if not needs_lind_fs(syscalls):
+    for action in actions:
+      yield action
+    return
+
   # Relative paths found in actions are related to this HOME_PATH. It is initially
   # set to an empty string which ultimately translates to the current directory.
   home_path = ''
@@ -52,10 +112,11 @@ def generate_fs(actions, trace_path):
   # benchmarks. The reason to do this is because actions referring to files 
   # using relative paths, might refere to these files relative to the HOME
   # variable defined in the execve syscall.
-  fh = open(trace_path, "r")
-  # the execve syscall is the first action of the trace file
-  execve_line = fh.readline()
-  fh.close()
+  if execve_line == None:
+    fh = open(trace_path, "r")
+    # the execve syscall is the first action of the trace file
+    execve_line = fh.readline()
+    fh.close()
   
   # If the 'HOME' variable is defined in the execve line, the HOME_PATH
   # variable will be set to the path of 'HOME'.
@@ -97,12 +158,12 @@ def generate_fs(actions, trace_path):
   # successfully.
   seen_paths = {}
 
-  # a list of system calls that include a filepath in their arguments. We only
-  # care about these system calls so only the actions representing of these
-  # system calls will be examined.
-  syscalls_with_path = ['open', 'creat', 'statfs', 'access', 'stat', 'link', 
-                        'unlink', 'chdir', 'rmdir', 'mkdir']
-  
+  # in blob store and lazy mode, maps the name of the data file of each file
+  # copied into the lind fs to the host file it was copied from.
+  deferred_files = None
+  if blob_store != None or lazy:
+    deferred_files = {}
+
   for action in actions:
     # the general format of an action is the following:
     # (syscall_name, (arguments tuple), (return tuple))
@@ -130,7 +191,7 @@ def generate_fs(actions, trace_path):
     # remove the _syscall part from the syscall name
     syscall_name = syscall_name[:syscall_name.find("_syscall")]
 
-    if syscall_name in syscalls_with_path:
+    if syscall_name in SYSCALLS_WITH_PATH:
 
       # TODO: I should consider O_CREAT O_EXECL and O_TRUNC flags.
 
@@ -159,7 +220,8 @@ def generate_fs(actions, trace_path):
       if path not in seen_paths:
         # if the syscall was successful, copy file/dir into the lind fs.
         if syscall_result != (-1, 'ENOENT'):
-          path, path_added = _copy_path_into_lind(path, home_path, o_creat)
+          path, path_added = _copy_path_into_lind(path, home_path, o_creat,
+                                                  deferred_files, lazy)
           
           # remember this path was seen and whether it was added to the lind fs.
           seen_paths[path] = path_added
@@ -177,7 +239,9 @@ def generate_fs(actions, trace_path):
           # if we got an exists error, the file must have been there
           # already, so we add it in the lind fs.
           if syscall_result == (-1, 'EEXIST'):
-            path2, path_added = _copy_path_into_lind(path2, home_path, o_creat)
+            path2, path_added = _copy_path_into_lind(path2, home_path, 
+                                                     o_creat, deferred_files,
+                                                     lazy)
             
             # remember this path was seen and whether it was added to the lind fs.
             seen_paths[path2] = path_added
@@ -198,7 +262,7 @@ def generate_fs(actions, trace_path):
         home_path = os.path.normpath(home_path)
         lind_test_server.chdir_syscall(home_path)
 
-      
+    yield action
   
   if DEBUG:
     print
@@ -235,12 +299,36 @@ def generate_fs(actions, trace_path):
       if abs_seen_path in all_lind_paths:
         raise Exception("Unexpected file '" + abs_seen_path + "' in Lind fs")
 
+  if lazy:
+    # the data files are empty. The contents stay on the host.
+    for data_name in deferred_files:
+      os.remove(data_name)
+  elif blob_store != None:
+    _store_blobs(blob_store, deferred_files)
+
+
+"""
+Returns whether traces restricted to syscalls (see 
+parser_helper_calls.select_syscalls) need a lind fs, ie whether any of the 
+selected system calls takes a file path.
+"""
+def needs_lind_fs(syscalls):
+  syscalls = parser_helper_calls.select_syscalls(syscalls)
+  if syscalls == None:
+    return True
+
+  for syscall_name in SYSCALLS_WITH_PATH:
+    if syscall_name in syscalls:
+      return True
+  return False
+
 
 """
 Check if the file/dir exists. If it exists copy it to the lind fs. If not raise 
 an exception.
 """
-def _copy_path_into_lind(path, home_path, o_creat):
+def _copy_path_into_lind(path, home_path, o_creat, deferred_files=None,
+                         lazy=False):
   path = os.path.join(home_path, path)
   path = os.path.normpath(path)
 
@@ -255,7 +343,7 @@ def _copy_path_into_lind(path, home_path, o_creat):
 
   # path exists! Copy it to the lind fs.
   if os.path.isfile(path):
-    _cp_file_into_lind(path)
+    _cp_file_into_lind(path, deferred_files=deferred_files, lazy=lazy)
   else:
     _cp_dir_into_lind(path)
 
@@ -267,6 +355,27 @@ def _copy_path_into_lind(path, home_path, o_creat):
 
 
 
+"""
+Adds the contents of the files copied into the lind fs to blob_store and 
+writes the lind.blobs manifest. deferred_files maps the name of the data file
+of each file to the host file it was copied from. The data files themselves 
+are empty, and are removed.
+"""
+def _store_blobs(blob_store, deferred_files):
+  blobs = blob_store.add_files(deferred_files.values())
+
+  manifest = {}
+  for data_name in deferred_files:
+    manifest[data_name] = blobs[deferred_files[data_name]]
+    os.remove(data_name)
+
+  lind_blob_store.write_manifest(lind_blob_store.MANIFEST_NAME, manifest)
+
+
+
+
+
+
 """
 The rest of this program was adjusted from lind_fs_utils.py
 
@@ -293,7 +402,8 @@ def _mirror_stat_data(posixfn, lindfn):
   #lind_test_server.chgrp_syscall(lindfn, statdata[5])
 
 
-def _cp_file_into_lind(fullfilename, rootpath='.', createmissingdirs=True):
+def _cp_file_into_lind(fullfilename, rootpath='.', createmissingdirs=True,
+                       deferred_files=None, lazy=False):
   """
    <Purpose>
       Copies a file from POSIX into the Lind FS.   It takes the abs path to 
@@ -310,6 +420,14 @@ def _cp_file_into_lind(fullfilename, rootpath='.', createmissingdirs=True):
    
       createmissingdirs:  Should missing dirs in the path be created?
 
+      deferred_files: If given, the contents of the file are not copied. The 
+          file is created with the size of the POSIX file, and its data file
+          name is mapped to the POSIX path in deferred_files, so that the 
+          contents can be added to a blob store later (see _store_blobs).
+
+      lazy: If True, deferred_files must be given, and the inode of the file 
+          also gets a reference to the POSIX file, its 'contentref'.
+
    <Exceptions>
       IOError: If the file does not exist, the directory can't be created
           (for example, if there is a file of the same name), or 
@@ -374,17 +492,31 @@ def _cp_file_into_lind(fullfilename, rootpath='.', createmissingdirs=True):
 
 
   # Okay, I have made the path now.   Only one thing remains, adding the file
-  posixfo = open(posixfn)
-  filecontents = posixfo.read()
-  posixfo.close()
 
   # make the new file, truncating any existing contents...
   lindfd = lind_test_server.open_syscall(normalizedlindfn, 
                 O_CREAT|O_EXCL|O_TRUNC|O_WRONLY, S_IRWXA)
 
-  # should write all at once...
-  datalen = lind_test_server.write_syscall(lindfd, filecontents)
-  assert(datalen == len(filecontents))
+  if deferred_files != None:
+    # only record the size. The contents go to the blob store, or stay on the
+    # host in lazy mode.
+    inode = lind_test_server.filedescriptortable[lindfd]['inode']
+    inodetable = lind_test_server.filesystemmetadata['inodetable']
+    inodetable[inode]['size'] = os.path.getsize(posixfn)
+    if lazy:
+      inodetable[inode]['contentref'] = lind_blob_store.index_key(posixfn)
+    deferred_files[lind_test_server.FILEDATAPREFIX + str(inode)] = posixfn
+
+  else:
+    # copy the file chunk by chunk, so that it is never held in memory whole.
+    posixfo = open(posixfn)
+    while True:
+      filecontents = posixfo.read(LIND_COPY_CHUNK_SIZE)
+      if not filecontents:
+        break
+      datalen = lind_test_server.write_syscall(lindfd, filecontents)
+      assert(datalen == len(filecontents))
+    posixfo.close()
 
   lind_test_server.close_syscall(lindfd)
 
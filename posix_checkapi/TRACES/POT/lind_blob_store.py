@@ -0,0 +1,332 @@
+"""
+<Program>
+  lind_blob_store.py
+
+<Started>
+  October 2026
+
+<Purpose>
+  A content-addressed store for the contents of the files copied into lind
+  file systems. Traces of the same programs keep referencing the same shared
+  libraries and configuration files, so instead of storing a copy of every
+  file in every trace bundle, generate_lind_fs can store each file once in a
+  blob store, and the bundle then only references the blobs in its
+  lind.blobs manifest (see generate_lind_fs.iter_generate_fs).
+
+  Each blob is named after the sha256 digest of its contents and lives in
+  root/<first two hex digits>/<digest>. Blobs are written to a temporary file
+  and renamed into place, so several processes can add files to the same
+  store at the same time. Files are always copied in chunks of
+  BLOB_CHUNK_SIZE bytes, never read whole into memory.
+
+  The store also keeps an index of the host files it has stored, keyed by
+  their path, size, modification time and inode, so that files that did not
+  change are not hashed again when they show up in another trace.
+
+  Example of using this module:
+
+    import lind_blob_store
+
+    store = lind_blob_store.BlobStore("/srv/lind_blobs")
+    blobs = store.add_files(["/etc/passwd", "/lib/libc.so.6"])
+    digest, size = blobs["/etc/passwd"]
+
+    # later, eg when a bundle is unpacked.
+    store.copy_blob(digest, "linddata.7")
+
+  A manifest holds one "data_file digest size" line for each lind fs data
+  file whose contents are kept in a blob store:
+
+    manifest = {"linddata.7": (digest, size)}
+    lind_blob_store.write_manifest("lind.blobs", manifest)
+    lind_blob_store.materialize_manifest("lind.blobs", store)
+
+  Lind file systems generated lazily do not hold the contents of their files
+  at all. Each file only holds a content reference, the index key of the host
+  file it stands for, and read_contents finds the contents when the file is
+  first used: in a blob store that stored the same host file before, or in a
+  snapshot directory holding a copy of the host file system.
+
+    contentref = lind_blob_store.index_key("/etc/passwd")
+    contents = lind_blob_store.read_contents(contentref, store, "/mnt/snap")
+"""
+
+import os
+import errno
+import hashlib
+import tempfile
+import multiprocessing
+
+# Size of the chunks in which files are copied and hashed.
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# Name of the index of the host files stored, in the root of the store.
+INDEX_NAME = "index"
+
+# Name of the manifest file in trace bundles that reference a blob store.
+MANIFEST_NAME = "lind.blobs"
+
+
+
+class BlobStore(object):
+  """
+  A content-addressed store of file contents rooted at the directory root,
+  which is created if needed.
+  """
+
+  def __init__(self, root):
+    self.root = os.path.abspath(root)
+    if not os.path.isdir(self.root):
+      os.makedirs(self.root)
+
+    # maps (path, size, mtime, inode) of the host files stored to the digest
+    # of their contents.
+    self.index = {}
+    self._load_index()
+
+
+  def blob_path(self, digest):
+    return os.path.join(self.root, digest[:2], digest)
+
+
+  def has_blob(self, digest):
+    return os.path.exists(self.blob_path(digest))
+
+
+  def add_file(self, path):
+    """
+    Stores the contents of the host file at path, unless a blob with the same
+    contents is stored already. Returns a tuple (digest, size).
+    """
+    return self.add_files([path], processes=1)[path]
+
+
+  def add_files(self, paths, processes=None):
+    """
+    Stores the contents of the host files at paths, hashing and copying them
+    with a pool of processes worker processes (as many as there are cores if
+    None). Files that are in the index and did not change since are not read
+    again. Returns a dictionary that maps each path to a tuple (digest,
+    size).
+    """
+    blobs = {}
+    missing = []
+    for path in paths:
+      if path in blobs:
+        continue
+      key = index_key(path)
+      if key in self.index and self.has_blob(self.index[key]):
+        blobs[path] = (self.index[key], key[1])
+      else:
+        blobs[path] = None
+        missing.append(path)
+
+    if processes == None:
+      processes = multiprocessing.cpu_count()
+
+    jobs = [(self.root, path) for path in missing]
+    if processes == 1 or len(jobs) <= 1:
+      results = map(_store_file, jobs)
+    else:
+      pool = multiprocessing.Pool(processes)
+      try:
+        results = pool.map(_store_file, jobs, 1)
+      finally:
+        pool.terminate()
+        pool.join()
+
+    index_entries = []
+    for path, (key, digest) in zip(missing, results):
+      blobs[path] = (digest, key[1])
+      self.index[key] = digest
+      index_entries.append(_format_index_entry(key, digest))
+
+    # a single append, so that processes adding files to the same store do
+    # not interleave their entries.
+    if index_entries:
+      index_file = open(os.path.join(self.root, INDEX_NAME), "a")
+      index_file.write("".join(index_entries))
+      index_file.close()
+
+    return blobs
+
+
+  def lookup(self, key):
+    """
+    Returns the digest of the host file with the index key 
+    (path, size, mtime, inode), or None if it is not in the store.
+    """
+    digest = self.index.get(tuple(key))
+    if digest == None or not self.has_blob(digest):
+      return None
+    return digest
+
+
+  def read_blob(self, digest):
+    blob_file = open(self.blob_path(digest), "rb")
+    contents = blob_file.read()
+    blob_file.close()
+    return contents
+
+
+  def copy_blob(self, digest, target_path):
+    """
+    Copies the contents of a blob to target_path, chunk by chunk.
+    """
+    blob_file = open(self.blob_path(digest), "rb")
+    target_file = open(target_path, "wb")
+    _copy_chunks(blob_file, target_file)
+    target_file.close()
+    blob_file.close()
+
+
+  def _load_index(self):
+    index_path = os.path.join(self.root, INDEX_NAME)
+    if not os.path.exists(index_path):
+      return
+
+    index_file = open(index_path, "r")
+    for line in index_file:
+      # a line that is not complete was being written by another process.
+      if not line.endswith("\n"):
+        break
+      digest, size, mtime, inode, path = line[:-1].split("\t", 4)
+      self.index[(path, int(size), mtime, int(inode))] = digest
+    index_file.close()
+
+
+
+def write_manifest(manifest_path, manifest):
+  """
+  Writes a manifest, a dictionary that maps the names of lind fs data files
+  (eg linddata.7) to the tuple (digest, size) of the blob holding their
+  contents.
+  """
+  manifest_file = open(manifest_path, "w")
+  for data_name in sorted(manifest):
+    digest, size = manifest[data_name]
+    manifest_file.write(data_name + " " + digest + " " + str(size) + "\n")
+  manifest_file.close()
+
+
+
+def read_manifest(manifest_path):
+  manifest = {}
+  manifest_file = open(manifest_path, "r")
+  for line in manifest_file:
+    data_name, digest, size = line.split()
+    manifest[data_name] = (digest, int(size))
+  manifest_file.close()
+  return manifest
+
+
+
+def materialize_manifest(manifest_path, store, target_dir="."):
+  """
+  Writes the lind fs data files listed in the manifest at manifest_path to
+  target_dir, copying their contents from store.
+  """
+  manifest = read_manifest(manifest_path)
+  for data_name in manifest:
+    digest, size = manifest[data_name]
+    if not store.has_blob(digest):
+      raise Exception("Blob " + digest + " of " + data_name +
+                      " not found in the blob store " + store.root)
+    store.copy_blob(digest, os.path.join(target_dir, data_name))
+
+
+
+def read_contents(contentref, store=None, snapshot_dir=None):
+  """
+  Returns the contents of the host file that the content reference contentref
+  (see index_key) stands for. They are looked up in store first, and then in 
+  snapshot_dir, which holds a copy of the host file system (or is "/" for the
+  host file system itself). A file in snapshot_dir is only used if its size 
+  matches.
+  """
+  path, size = contentref[0], contentref[1]
+
+  if store != None:
+    digest = store.lookup(contentref)
+    if digest != None:
+      return store.read_blob(digest)
+
+  if snapshot_dir != None:
+    snapshot_path = os.path.join(snapshot_dir, path.lstrip("/"))
+    if os.path.isfile(snapshot_path) and os.path.getsize(snapshot_path) == size:
+      snapshot_file = open(snapshot_path, "rb")
+      contents = snapshot_file.read()
+      snapshot_file.close()
+      return contents
+
+  raise Exception("The contents of " + path + " were not found in the blob " +
+                  "store or the snapshot directory.")
+
+
+
+def index_key(path):
+  """
+  Returns the index key of the host file at path: a tuple (path, size, mtime,
+  inode). It is also used as the content reference of files whose contents
+  are not copied.
+  """
+  path = os.path.abspath(path)
+  stat_data = os.stat(path)
+  # repr keeps the full precision of float modification times.
+  return (path, stat_data.st_size, repr(stat_data.st_mtime), stat_data.st_ino)
+
+
+
+def _format_index_entry(key, digest):
+  path, size, mtime, inode = key
+  return "\t".join([digest, str(size), mtime, str(inode), path]) + "\n"
+
+
+
+def _store_file(job):
+  """
+  Run by the worker processes of add_files. Copies the host file into the
+  store root while hashing it, and returns its index key and digest.
+  """
+  root, path = job
+  key = index_key(path)
+
+  temp_fd, temp_path = tempfile.mkstemp(prefix=".blob.", dir=root)
+  temp_file = os.fdopen(temp_fd, "wb")
+  source_file = open(path, "rb")
+  digest = _copy_chunks(source_file, temp_file)
+  source_file.close()
+  temp_file.close()
+
+  blob_path = os.path.join(root, digest[:2], digest)
+  if os.path.exists(blob_path):
+    # the same contents are stored already.
+    os.remove(temp_path)
+    return key, digest
+
+  try:
+    os.mkdir(os.path.dirname(blob_path))
+  except OSError, err:
+    if err.errno != errno.EEXIST:
+      raise
+  # if another process stored the same contents in the meantime, its blob
+  # is replaced with an identical one.
+  os.rename(temp_path, blob_path)
+  os.chmod(blob_path, 0444)
+  return key, digest
+
+
+
+def _copy_chunks(source_file, target_file):
+  """
+  Copies source_file to target_file in chunks of BLOB_CHUNK_SIZE bytes, and
+  returns the sha256 digest of the contents copied.
+  """
+  content_hash = hashlib.sha256()
+  while True:
+    chunk = source_file.read(BLOB_CHUNK_SIZE)
+    if not chunk:
+      break
+    content_hash.update(chunk)
+    target_file.write(chunk)
+  return content_hash.hexdigest()
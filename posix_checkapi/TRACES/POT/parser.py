@@ -29,17 +29,29 @@
   The initial file system state is represented as a Lind FS. The latter is made 
   up of a lind.metadata file and a set of linddata.# files. Once these files are
   genereated, a trace bundle is constructed which consists of:
-    - the original trace file (strace or truss output file)
-    - a file containing the parsed trace (a list of all parsed actions pickled)
-    - the Lind FS files.
+    - the original trace file (strace or truss output file). Compressed 
+      traces are stored compressed, and traces read from a tar archive are 
+      stored gzip compressed.
+    - a file containing the parsed trace. In version 2 bundles (the default)
+      this is actions.chunks, which stores the actions in independently 
+      decodable chunks followed by an index (see trace_bundle.py). In version
+      1 bundles this is actions.pickle, a single pickled list of all actions.
+    - the Lind FS files. If a blob store is used, the contents of the files
+      are kept in the blob store, and the bundle holds the lind.blobs 
+      manifest instead of the Lind FS data files (see lind_blob_store.py).
+      Lazy bundles only hold the lind.metadata file, and the contents of the
+      files are read by the verifier when it needs them.
 """
 
 import os
 import sys
-import shutil
 import tarfile
 import cPickle
+import itertools
 
+import trace_bundle
+import trace_input
+import lind_blob_store
 import generate_lind_fs
 import parser_truss_calls
 import parser_strace_calls
@@ -58,21 +70,64 @@ B. Generates the Lind File System.
     c. If it did, generate that file in the Lind fs, ignore otherwise.
     d. Any previous Lind fs files are removed and overridden.
 C. Generates a trace bundle.
-    a. Serializes and stores the parsed trace actions.
+    a. Serializes and stores the parsed trace actions. Version 2 bundles write
+       the actions chunk by chunk while they are parsed, so the whole trace is
+       never held in memory.
     b. Generates a tarfile containing the original trace file, the serialized 
        parsed trace file and the Lind fs data and metadata files.
     c. Removes original trace file, serialized file and Lind fs files.
+
+The trace may be compressed (gz, bz2 or xz) or held in a tar archive, in which
+case member names the trace in the archive (see trace_input.py). It is 
+decompressed while it is parsed and is never extracted to disk.
+
+If processes is not 1, strace traces are parsed by that many worker processes
+(see parser_strace_calls.iter_trace_parallel). None uses as many workers as 
+there are cores. The actions are the same either way. Compressed traces and
+traces in tar archives are read as a stream, so they are always parsed by a 
+single process.
+
+If syscalls is given (eg "fs", "net" or "open,close"), only the actions of 
+the selected system calls are parsed and stored (see 
+parser_helper_calls.select_syscalls). If none of them takes a file path, no
+Lind fs is generated and the bundle holds no Lind fs files.
+
+If blob_store is the path of a blob store directory (see lind_blob_store.py),
+the contents of the Lind fs files are added to that store, and the bundle 
+only references them. Files already in the store are not stored again.
+
+If lazy is True, the contents of the Lind fs files are not read at all. The 
+Lind fs metadata references the host files instead, and the verifier reads 
+their contents from a blob store or a snapshot of the host file system, and 
+only if the trace uses them (see generate_lind_fs.iter_generate_fs).
 """ 
-def generate_trace_bundle(trace_path, parser=None):
+def generate_trace_bundle(trace_path, parser=None, 
+                          bundle_version=trace_bundle.BUNDLE_VERSION,
+                          processes=1, member=None, syscalls=None,
+                          blob_store=None, lazy=False):
+  if lazy and blob_store != None:
+    raise Exception("Lazy bundles do not copy the contents of the Lind fs " +
+                    "files, so they cannot be added to a blob store.")
+
+  # traces read from a tar archive are copied while they are read, so that 
+  # the bundle can include the original trace.
+  trace_copy_name = "original_trace.gz"
+  trace = trace_input.TraceInput(trace_path, member, trace_copy_name)
+
   if parser == None:
-    # parser was not given. try to infer from the file extension.
-    if trace_path.endswith(".strace"):
+    # parser was not given. try to infer from the file extension, which may be
+    # followed by "_full" (eg pidgin_ubuntu.strace_full).
+    extension = os.path.splitext(trace.name)[1]
+    if extension.endswith("_full"):
+      extension = extension[:-len("_full")]
+    if extension == ".strace":
       parser = "strace"
-    elif trace_path.endswith(".truss"):
+    elif extension == ".truss":
       parser = "truss"
-    elif trace_path.endswith(".dtrace"):
+    elif extension == ".dtrace":
       parser = "dtrace"
     else:
+      trace.close()
       raise Exception("Could not infer parser from the file extension")
   
   # dtrace traces are parsed the exact same way as strace traces.
@@ -80,38 +135,88 @@ def generate_trace_bundle(trace_path, parser=None):
     parser = "strace"
 
   assert(parser in ["strace", "truss"])
+  assert(bundle_version in [1, 2])
 
-  fh = open(trace_path, "r")
-  
-  # parse actions from file, using the correct parser
-  actions = None
-  if parser == "strace":
-    actions = parser_strace_calls.parse_trace(fh)
+  plain_trace = trace.compression == None and not trace.in_archive
+
+  # parse actions from file, using the correct parser. Actions are parsed 
+  # lazily and each one is handed to the lind fs generator as soon as it is
+  # parsed.
+  if parser == "strace" and processes != 1 and plain_trace:
+    pid_actions = parser_strace_calls.iter_trace_parallel(trace_path, processes,
+                                                          include_pids=True,
+                                                          syscalls=syscalls)
+  elif parser == "strace":
+    pid_actions = parser_strace_calls.iter_trace(trace, include_pids=True,
+                                                 syscalls=syscalls)
   elif parser == "truss":
-    actions = parser_truss_calls.parse_trace(fh)
+    pid_actions = parser_truss_calls.iter_trace(trace, include_pids=True,
+                                                syscalls=syscalls)
   else:
     raise Exception("Unknown parser when attempting to parse trace.")
-  
-  fh.close()
 
-  if DEBUG:
-    for action in actions:
-      print action
+  # the lind fs generator only deals with the actions. Split the pids off and 
+  # pair them up again with the actions coming out of the generator. Both 
+  # sides advance in lockstep, so tee only ever buffers a single entry.
+  pid_actions, pids = itertools.tee(pid_actions)
+  actions = (action for pid, action in pid_actions)
+  pids = (pid for pid, action in pids)
+
+  # generate the initial file system needed by the model. The execve line is
+  # the first line of the trace, which was read when the trace was opened.
+  if blob_store != None:
+    blob_store = lind_blob_store.BlobStore(blob_store)
+  actions = generate_lind_fs.iter_generate_fs(actions,
+                                              execve_line=trace.first_line,
+                                              syscalls=syscalls,
+                                              blob_store=blob_store,
+                                              lazy=lazy)
 
-  # generate the initial file system needed by the model.
-  generate_lind_fs.generate_fs(actions, trace_path)
+  if bundle_version == 2:
+    # store the actions and their pids in chunks as they stream out of the
+    # lind fs generator.
+    actions_name = trace_bundle.ACTIONS_CHUNKS_NAME
+    actions_file = open(actions_name, 'wb')
+    writer = trace_bundle.ChunkedActionsWriter(actions_file)
+    for action, pid in itertools.izip(actions, pids):
+      if DEBUG:
+        print action
+      writer.add(action, pid)
+    writer.close()
+    actions_file.close()
+
+  else:
+    # actions.pickle holds a single list, so collect all the actions first.
+    # Version 1 bundles do not record pids, so drain the pids as well to keep
+    # tee from buffering them.
+    actions = [action for action, pid in itertools.izip(actions, pids)]
+
+    if DEBUG:
+      for action in actions:
+        print action
   
-  # pickle the trace
-  pickle_name = "actions.pickle"
-  pickle_file = open(pickle_name, 'w')
-  cPickle.dump(actions, pickle_file)
-  pickle_file.close()
+    # pickle the trace
+    actions_name = trace_bundle.ACTIONS_PICKLE_NAME
+    actions_file = open(actions_name, 'w')
+    cPickle.dump(actions, actions_file)
+    actions_file.close()
+  
+  trace.close()
+
+  # unfinished system calls that were never resumed are left out of the 
+  # actions.
+  if parser == "strace" and parser_strace_calls.ORPHANED_SYSCALLS:
+    orphaned = parser_strace_calls.ORPHANED_SYSCALLS
+    print ("[warning] " + str(sum(orphaned.values())) + 
+           " unfinished system calls were never resumed: " +
+           ", ".join([name + " " + str(orphaned[name]) for name in orphaned]))
 
   # Now we have everything we need, create the trace bundle which will include 
   # the trace pickle and the lind fs files.
   
-  # first find a name for the bundle archive.
-  head, bundle_name = os.path.split(trace_path)
+  # first find a name for the bundle archive. It is named after the trace, 
+  # without any compression extension.
+  bundle_name = os.path.basename(trace.name)
   
   # if the bundle_name already exists, append a number.
   temp_count = ''
@@ -126,49 +231,97 @@ def generate_trace_bundle(trace_path, parser=None):
   # Create the bundle archive.
   tar = tarfile.open(bundle_name, "w")
   
-  # add the original trace file.
-  original_trace_name = "original_trace." + parser
-  # let's copy it locally and rename it first.
-  shutil.copyfile(trace_path, original_trace_name)
-  tar.add(original_trace_name)
-
-  # add the pickle file
-  tar.add(pickle_name)
+  # add the original trace file, renamed. Compressed traces keep their 
+  # compression extension.
+  original_trace_name = ("original_trace." + parser + 
+                         trace_input.original_trace_extension(trace))
+  if trace.in_archive:
+    tar.add(trace_copy_name, arcname=original_trace_name)
+  else:
+    tar.add(trace_path, arcname=original_trace_name)
+
+  # add the file holding the parsed actions
+  tar.add(actions_name)
   
-  # add the lind fs metadata file
-  if not os.path.exists("lind.metadata"):
-    raise Exception("Lind fs metadata file not found.")
-  tar.add("lind.metadata")
+  lind_fs = generate_lind_fs.needs_lind_fs(syscalls)
+  if lind_fs:
+    # add the lind fs metadata file
+    if not os.path.exists("lind.metadata"):
+      raise Exception("Lind fs metadata file not found.")
+    tar.add("lind.metadata")
   
-  # add the lind fs data files
-  for fname in os.listdir(os.getcwd()):
-    if fname.startswith("linddata."):
-      tar.add(fname)
+    # add the lind fs data files, or the manifest of their blobs.
+    for fname in os.listdir(os.getcwd()):
+      if fname.startswith("linddata."):
+        tar.add(fname)
+    if blob_store != None:
+      tar.add(lind_blob_store.MANIFEST_NAME)
   
   tar.close()
   
   # Finally, clean up all intermediate files
-  os.remove(original_trace_name)
-  os.remove(pickle_name)
-  os.remove("lind.metadata")
-  for fname in os.listdir(os.getcwd()):
-    if fname.startswith("linddata."):
-      os.remove(fname)
+  if trace.in_archive:
+    os.remove(trace_copy_name)
+  os.remove(actions_name)
+  if lind_fs:
+    os.remove("lind.metadata")
+    if blob_store != None:
+      os.remove(lind_blob_store.MANIFEST_NAME)
+    for fname in os.listdir(os.getcwd()):
+      if fname.startswith("linddata."):
+        os.remove(fname)
 
 
 
 
 
 if __name__ == "__main__":
-  if len(sys.argv) < 2 or len(sys.argv) > 3:
-    raise Exception("Incorrect number of command line arguments.\n" + 
-                    "Usage: python " + sys.argv[0] + 
-                    " trace_file [parser (strace/truss/dtrace)]")
+  usage = ("Usage: python " + sys.argv[0] + 
+           " [--processes=N] [--member=NAME] [--syscalls=fs|net|NAME,...]"
+           " [--blob-store=DIR] [--lazy] trace_file"
+           " [parser (strace/truss/dtrace)]")
+
+  # options start with '--', everything else is an argument.
+  options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+  arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+  # parse strace traces in parallel, using this many worker processes. 0 uses
+  # as many workers as there are cores.
+  processes = 1
+  # the name of the trace in a tar archive. By default the first file of the
+  # archive is used.
+  member = None
+  # parse only these system calls or classes of system calls. By default all
+  # the handled system calls are parsed.
+  syscalls = None
+  # keep the contents of the lind fs files in this blob store directory.
+  blob_store = None
+  # do not read the contents of the lind fs files, only reference them.
+  lazy = False
+  for option in options:
+    if option.startswith("--processes="):
+      processes = int(option[len("--processes="):]) or None
+    elif option.startswith("--member="):
+      member = option[len("--member="):]
+    elif option.startswith("--syscalls="):
+      syscalls = option[len("--syscalls="):]
+    elif option.startswith("--blob-store="):
+      blob_store = option[len("--blob-store="):]
+    elif option == "--lazy":
+      lazy = True
+    else:
+      raise Exception("Unknown option " + option + ". " + usage)
+
+  if len(arguments) < 1 or len(arguments) > 2:
+    raise Exception("Incorrect number of command line arguments.\n" + usage)
   
-  trace_path = sys.argv[1]
+  trace_path = arguments[0]
   
-  # if the parser was given explicitly as a third argument, use it
-  if len(sys.argv) == 3:
-    generate_trace_bundle(trace_path, sys.argv[2])
+  # if the parser was given explicitly as a second argument, use it
+  if len(arguments) == 2:
+    generate_trace_bundle(trace_path, arguments[1], processes=processes,
+                          member=member, syscalls=syscalls, 
+                          blob_store=blob_store, lazy=lazy)
   else:
-    generate_trace_bundle(trace_path)
+    generate_trace_bundle(trace_path, processes=processes, member=member,
+                          syscalls=syscalls, blob_store=blob_store, lazy=lazy)
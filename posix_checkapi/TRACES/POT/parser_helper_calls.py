@@ -20,181 +20,251 @@ Parsing proceeds in 4 steps.
      than to pass values to the system call.
   4. Form IR: Combines the system call name, the argument list and the return 
      value list to construct the Intermediate Representation.
+
+Everything that only depends on the syscall is worked out once for each 
+syscall in SYSCALL_PARSE_PLANS (see SyscallParsePlan), so this function just
+runs the parse plan of the syscall.
 """
 def parse_syscall(syscall_name, args, result):
-  if syscall_name not in HANDLED_SYSCALLS_INFO:
+  parse_plan = SYSCALL_PARSE_PLANS.get(syscall_name)
+  if parse_plan == None:
     return UNIMPLEMENTED_ERROR
 
-  ##########################
-  # 1. Initialization step #
-  ##########################
-  # get the expected arguments from the intermediate representation.
-  expected_args = list(HANDLED_SYSCALLS_INFO[syscall_name]['args'])
-  # get the expected return values from the intermediate representation.
-  expected_return = list(HANDLED_SYSCALLS_INFO[syscall_name]['return'])
-  # Initialize all arguments to Unknown()
-  args_list = []
-  for arg_index in range(len(expected_args)):
-    # call parse with no arguments which will return Unknown 
-    args_list.append(expected_args[arg_index].parse())
-  # Initialize all return values to Unknown()
-  return_list = []
-  for return_index in range(len(expected_return)):
-    return_list.append(expected_return[return_index].parse())
-  
-  ###################
-  # 2. Parsing step #
-  ###################
-  # Parse the individual arguments of the syscall.
-  # Length of args can change. If the syscall contains a string argument and 
-  # the string contained ", " the parser would have wrongly split the string.
-  index = 0
-  offset = 0
-  while index < len(args):
-    # Do we have more than the expected arguments?
-    if index >= len(expected_args):
-      raise Exception("Too many arguments found while parsing.")
-    
-    # get the expected type for the current argument.
-    # What is offset?
-    # If the syscall returned an error the value of structure variables will not
-    # be returned. Instead, where we expect the first value of the structure 
-    # we get the address of the structure and the remaining values are simply 
-    # not listed. Using offset we can skip these expected arguments since they
-    # are not provided.
-    expected_arg_type = expected_args[index + offset]
-    
-    # Skip all remaining arguments?
-    # this type is used to indicate that the remaining arguments
-    # should be skipped. This is useful in cases where a system call
-    # is partly supported.
-    # Consequently, the value of the remaining arguments will be the
-    # one given to them in the initialization step.
-    if isinstance(expected_arg_type, SkipRemaining):
-      break
-
-    # Did the argument contain ", "? A few types can contain a ", " string, in 
-    # which case the parser would have wrongly split these in two arguments.
-    if(isinstance(expected_arg_type, FFsid) or 
-       isinstance(expected_arg_type, StDev) or
-       isinstance(expected_arg_type, StSizeOrRdev) or
-       isinstance(expected_arg_type, TimeVal)):
-      if len(args) > len(expected_args):
-        args[index] += ", " + args[index+1]
-        args.pop(index+1)
-    
-    args_list[index+offset] = expected_arg_type.parse(args[index])
-    
-    # Did the syscall return an error?
-    # Deal with the fact that some structure values may not be provided. We can 
-    # detect when this happens by checking if the returned "parsed" value of 
-    # some expected types is Unknown. How do we deal with this? The values of
-    # the expected arguments are set to Unknown and the offset variable is set
-    # appropriately so that in the next iteration we parse the correct argument
-    # type.
-    # Firstly set the offset which indicates how many values after the current 
-    # value are missing.
-    # Then for each missing value, get its expected type. The final value will
-    # in any case be an Unknown object but getting the expected type helps in
-    # constructing a more informative Unknown object. Specifically we can run
-    # the parse function of this type with no arguments which will return an
-    # Unknown object with its expected_type and its given_value variables set
-    # appropriately.
-    if args_list[index+offset] == Unknown():
-      # set the offset value according to what the current type is.
-      if(isinstance(expected_arg_type, ZeroOrListOfFlags) and 
-         expected_arg_type.label_left == "sa_family="):
+  return parse_plan.parse(args, result)
+
+
+
+class SyscallParsePlan():
+  """
+  The parts of parsing a system call that do not depend on the trace, worked
+  out once from the expected arguments and return values of the system call.
+  """
+  def __init__(self, syscall_name, arg_types, return_types):
+    self.syscall_name = syscall_name
+    self.action_name = syscall_name + '_syscall'
+    self.arg_types = tuple(arg_types)
+    self.return_types = tuple(return_types)
+
+    # The value of each argument and return value that is not given. Calling
+    # parse with no arguments returns an Unknown object, and these are never 
+    # modified, so the same ones are used for all the actions.
+    self.arg_placeholders = []
+    for arg_type in self.arg_types:
+      self.arg_placeholders.append(arg_type.parse())
+    self.return_placeholders = []
+    for return_type in self.return_types:
+      self.return_placeholders.append(return_type.parse())
+
+    # For each expected argument:
+    # - whether it and all the remaining arguments are skipped. This is 
+    #   useful in cases where a system call is partly supported.
+    # - whether it can contain ", ", in which case the parser would have 
+    #   wrongly split it in two arguments.
+    # - how many values after it are missing if it is Unknown, or None if the 
+    #   number stays as it was. If the syscall returned an error, the values 
+    #   of structures are not provided. Instead, where we expect the first 
+    #   value of the structure we get the address of the structure and the 
+    #   remaining values are simply not listed.
+    # - whether it is the family of a socket address, which determines the
+    #   arguments that follow it.
+    self.skip_args = []
+    self.merge_args = []
+    self.missing_offsets = []
+    self.sock_family_args = []
+    # the indexes of the arguments that stay in the arguments tuple, and of
+    # the "output" arguments that are moved to the return tuple.
+    self.input_indexes = []
+    self.output_indexes = []
+
+    for index in range(len(self.arg_types)):
+      arg_type = self.arg_types[index]
+      self.skip_args.append(isinstance(arg_type, SkipRemaining))
+      self.merge_args.append(isinstance(arg_type, FFsid) or 
+                             isinstance(arg_type, StDev) or
+                             isinstance(arg_type, StSizeOrRdev) or
+                             isinstance(arg_type, TimeVal))
+
+      sock_family = (isinstance(arg_type, ZeroOrListOfFlags) and 
+                     arg_type.label_left == "sa_family=")
+      self.sock_family_args.append(sock_family)
+
+      missing_offset = None
+      if sock_family:
         if syscall_name == "recvmsg" or syscall_name == "sendmsg":
-          # six additional structure values follow SockFamily in
-          # recvmsg and in sendmsg. Hence six values are missing and
-          # the offset should be set to six.
-          offset = 6
+          # six additional structure values follow SockFamily in recvmsg and
+          # in sendmsg.
+          missing_offset = 6
         else:
-          # two additional structure values follow SockFamily. Hence
-          # two values are missing and the offset should be set to two.
-          offset = 2
-      elif(isinstance(expected_arg_type, Str) and 
-         expected_arg_type.label_left == "f_type="):
-        offset = 9
-      elif isinstance(expected_arg_type, StDev):
-        offset = 11
-      # For each missing argument, set its value to Unknown.
-      for missing_index in range(1, offset+1):
-        missing_arg_type = expected_args[index + missing_index]
-        args_list[index + missing_index] = missing_arg_type.parse()
-    
-    # adjust the expected arguments for sockaddr according to the sock_family
-    # The default expected values after a SockFamily are port and ip
-    if(isinstance(expected_arg_type, ZeroOrListOfFlags) and 
-       expected_arg_type.label_left == "sa_family=" and not
-       isinstance(args_list[index], Unknown)):
+          # two additional structure values follow SockFamily.
+          missing_offset = 2
+      elif isinstance(arg_type, Str) and arg_type.label_left == "f_type=":
+        missing_offset = 9
+      elif isinstance(arg_type, StDev):
+        missing_offset = 11
+      self.missing_offsets.append(missing_offset)
+
+      if arg_type.output:
+        self.output_indexes.append(index)
+      else:
+        self.input_indexes.append(index)
+
+    # the plans used once a socket family changes the expected arguments,
+    # keyed by the index of the family and the change.
+    self.family_plans = {}
+
+
+  def parse(self, args, result):
+    # 1. Initialization step.
+    args_list = list(self.arg_placeholders)
+    return_list = list(self.return_placeholders)
+
+    # 2. Parsing step.
+    # args is only copied if two of its items need to be joined.
+    given_args = args
+    # the plan of the expected arguments, which the socket family may change.
+    plan = self
+
+    index = 0
+    # how many expected arguments are skipped because their values are 
+    # missing.
+    offset = 0
+    while index < len(args):
+      # Do we have more than the expected arguments?
+      if index >= len(plan.arg_types):
+        raise Exception("Too many arguments found while parsing.")
+
+      arg_index = index + offset
+      if plan.skip_args[arg_index]:
+        break
+
+      if plan.merge_args[arg_index] and len(args) > len(plan.arg_types):
+        if args is given_args:
+          args = list(args)
+        args[index] += ", " + args[index+1]
+        args.pop(index+1)
+
+      value = plan.arg_types[arg_index].parse(args[index])
+      args_list[arg_index] = value
+
+      # Did the syscall return an error? Set the offset and set the missing 
+      # values to Unknown.
+      if isinstance(value, Unknown):
+        if plan.missing_offsets[arg_index] != None:
+          offset = plan.missing_offsets[arg_index]
+        for missing_index in range(index + 1, index + offset + 1):
+          args_list[missing_index] = plan.arg_placeholders[missing_index]
+
+      # adjust the expected arguments for sockaddr according to the 
+      # sock_family. The default expected values after a SockFamily are port 
+      # and ip.
+      if plan.sock_family_args[arg_index]:
+        family = args_list[index]
+        if not isinstance(family, Unknown):
+          netlink = "AF_NETLINK" in family
+          af_file = "AF_FILE" in family
+          if netlink or af_file:
+            plan = plan._get_family_plan(index, netlink, af_file)
+
+      index += 1
+
+    # parse the return values of the syscall
+    return_types = self.return_types
+    for index in range(len(result)):
+      # Do we have more than the expected return values?
+      if index >= len(return_types):
+        raise Exception("Too many return values found while parsing.")
+      return_list[index] = return_types[index].parse(result[index])
+
+    # 3. Rearranging step.
+    return_tuple = tuple(return_list)
+    args_tuple = tuple([args_list[index] for index in plan.input_indexes])
+    args_return_tuple = tuple([args_list[index] 
+                               for index in plan.output_indexes])
+
+    # if the system call returned an error, indicated by a -1, then
+    # skip the args_return_tuple
+    if return_tuple[0] != -1 and len(args_return_tuple) != 0:
+      # if the return_tuple is of format (value1, None) then replace
+      # None with the args_return_tuple. Otherwise if the second
+      # argument of the return value is not None, raise an Exception.
+      if len(return_tuple) == 2 and return_tuple[1] == None:
+        return_tuple = (return_tuple[0], args_return_tuple)
+      else:
+        raise Exception("Trying to add more return values in a " + 
+                        "system call which already has two return " + 
+                        "values. " + return_tuple)
+
+    # 4. Form IR step.
+    return (self.action_name, args_tuple, return_tuple)
+
+
+  def _get_family_plan(self, index, netlink, af_file):
+    """
+    Returns the plan of the expected arguments once the socket family at 
+    index turned out to be AF_NETLINK and/or AF_FILE.
+    """
+    key = (index, netlink, af_file)
+    if key not in self.family_plans:
+      arg_types = list(self.arg_types)
 
       # if the family is AF_NETLINK, we need pid and groups.
-      if "AF_NETLINK" in args_list[index]:
-        expected_args[index+1] = Int(label_left="pid=", output=True)
-        expected_args[index+2] = Int(label_left="groups=", 
-                                     label_right="}", output=True)
+      if netlink:
+        arg_types[index+1] = Int(label_left="pid=", output=True)
+        arg_types[index+2] = Int(label_left="groups=", label_right="}", 
+                                 output=True)
 
       # if the family is AF_FILE, we need path.
       # 14037 connect(4, {sa_family=AF_FILE, path="/var/run/nscd/socket"}, 110) 
       #                               = -1 ENOENT (No such file or directory)
-      if "AF_FILE" in args_list[index]:
+      if af_file:
         # set port to path instead and remove second expected arg
-        expected_args[index+1] = SockPath(label_right="}", output=True)
-        del(expected_args[index+2])
+        arg_types[index+1] = SockPath(label_right="}", output=True)
+        del(arg_types[index+2])
 
-    
-    index += 1
+      self.family_plans[key] = SyscallParsePlan(self.syscall_name, arg_types,
+                                                self.return_types)
 
-  # parse the return values of the syscall
-  for index in range(len(result)):
-    # Do we have more than the expected return values?
-    if index >= len(expected_return):
-      raise Exception("Too many return values found while parsing.")
-    expected_return_type = expected_return[index]
-    return_list[index] = expected_return_type.parse(result[index])
-  
-  #######################
-  # 3. Rearranging step #
-  #######################
-  # Some arguments are used to return a value rather than to pass
-  # a value to the syscall. These arguments are moved to the return
-  # part of the syscall. How do we know if a given argument should be
-  # moved to the return part? Each expected argument type has a
-  # variable called output, which if true, indicates just that.
-  return_tuple = ()
-  # add the expected return values to the return tuple.
-  for return_index in range(len(expected_return)):
-    return_tuple = return_tuple + (return_list[return_index],)
-  
-  args_tuple = ()
-  args_return_tuple = () # arguments to move in return tuple.
-  # if the expected argument is an "output" argument, append it to
-  # the return tuple, else append it in the arguments tuple.
-  for arg_index in range(len(expected_args)):
-    if expected_args[arg_index].output:
-      args_return_tuple = args_return_tuple + (args_list[arg_index],)
-    else:
-      args_tuple = args_tuple + (args_list[arg_index],)
-  
-  # if the system call returned an error, indicated by a -1, then
-  # skip the args_return_tuple
-  if return_tuple[0] != -1 and len(args_return_tuple) != 0:
-    # if the return_tuple is of format (value1, None) then replace
-    # None with the args_return_tuple. Otherwise if the second
-    # argument of the return value is not None, raise an Exception.
-    if len(return_tuple) == 2 and return_tuple[1] == None:
-      return_tuple = (return_tuple[0], args_return_tuple)
+    return self.family_plans[key]
+
+
+
+# The parse plan of each system call in HANDLED_SYSCALLS_INFO.
+SYSCALL_PARSE_PLANS = {}
+for _syscall_name in HANDLED_SYSCALLS_INFO:
+  SYSCALL_PARSE_PLANS[_syscall_name] = SyscallParsePlan(_syscall_name,
+      HANDLED_SYSCALLS_INFO[_syscall_name]['args'],
+      HANDLED_SYSCALLS_INFO[_syscall_name]['return'])
+
+
+"""
+Returns the set of system call names that selection stands for, so that the 
+parsers, generate_lind_fs and the verifier can be restricted to part of a 
+trace. selection is either a comma separated string or an iterable of system
+call names (eg "open", "socket") and classes of system calls (see 
+SYSCALL_CLASSES), eg "fs", "net,dup" or ["net"]. None is returned if selection 
+is None or covers all the handled system calls, meaning that nothing is left 
+out.
+"""
+def select_syscalls(selection):
+  if selection == None:
+    return None
+
+  if isinstance(selection, str):
+    selection = selection.split(",")
+
+  syscalls = set()
+  for name in selection:
+    name = name.strip()
+    if name in SYSCALL_CLASSES:
+      syscalls.update(SYSCALL_CLASSES[name])
+    elif name in HANDLED_SYSCALLS_INFO:
+      syscalls.add(name)
     else:
-      raise Exception("Trying to add more return values in a " + 
-                      "system call which already has two return " + 
-                      "values. " + return_tuple)
-  
-  ###################
-  # 4. Form IR step #
-  ###################
-  # form the intermediate representation.
-  return (syscall_name+'_syscall', args_tuple, return_tuple)
+      raise Exception("Unknown system call or class of system calls: " + name)
+
+  if syscalls.issuperset(HANDLED_SYSCALLS_INFO):
+    return None
+  return syscalls
 
 
 """
@@ -963,6 +963,27 @@ HANDLED_SYSCALLS_INFO = {
     'return': (IntOrQuestionOrListOfFlags(), NoneOrStr())
   }
 }
+
+"""
+Classes of handled system calls, used to parse or verify only part of a trace
+(see parser_helper_calls.select_syscalls). The system calls that work on any 
+kind of file descriptor belong to both the fs and the net class, and clone
+belongs to neither.
+"""
+FD_SYSCALLS = ["close", "dup", "dup2", "dup3", "fcntl", "read", "select", 
+               "write"]
+
+SYSCALL_CLASSES = {
+  "fs": FD_SYSCALLS + ["access", "chdir", "creat", "fstat", "fstatfs", 
+                       "getdents", "link", "lseek", "mkdir", "open", "rmdir", 
+                       "stat", "statfs", "symlink", "unlink"],
+  "net": FD_SYSCALLS + ["accept", "bind", "connect", "getpeername", 
+                        "getsockname", "getsockopt", "listen", "recv", 
+                        "recvfrom", "send", "sendto", "setsockopt", 
+                        "shutdown", "socket"],
+  "all": HANDLED_SYSCALLS_INFO.keys()
+}
+
 """
 TODO:
   deal with the second example.
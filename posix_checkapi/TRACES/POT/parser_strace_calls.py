@@ -11,16 +11,28 @@
 <Purpose>
   This is the parser that translates traces from strace ouput format to the 
   intermediate representation, as it is defined in the file 
-  parser_intermediate_representation.py. It provides a single public function 
-  which takes as argument an open file and returns a list containing all the 
-  trace actions parsed. The file must follow the strace output format. 
-  Example of using this module:
+  parser_intermediate_representation.py. It provides two public functions 
+  which take as argument an open file. iter_trace is a generator that yields 
+  the trace actions one at a time as they are parsed, and parse_trace returns 
+  a list containing all the trace actions parsed. The file must follow the 
+  strace output format. Example of using this module:
 
     import parser_strace_calls
     fh = open(TRACE_FILE_NAME, "r")
     actions = parser_strace_calls.parse_trace(fh)
 
-  The above code will return a list of actions. Each action of this list 
+  The above code will return a list of actions. For large traces, iterate over
+  parser_strace_calls.iter_trace(fh) instead, so that only the action currently
+  being processed needs to be kept in memory. iter_trace(fh, include_pids=True)
+  yields (pid, action) tuples instead, where pid is the process id strace 
+  printed for the system call, or None if the trace was not gathered with -f.
+  parse_trace_parallel(TRACE_FILE_NAME) and iter_trace_parallel take the path
+  of the trace file instead, and parse it using a pool of worker processes.
+  They return the same actions as their serial counterparts. All of them take
+  an optional syscalls argument, eg syscalls="net", which restricts the 
+  actions to some system calls or classes of system calls (see 
+  parser_helper_calls.select_syscalls). The lines of other system calls are 
+  dropped as soon as their system call name is read. Each action 
   represents a system call in its intermediate representation. The format of the
   intermediate representation is given below: 
   ('syscallName_syscall', (arg1, arg2, ...), (return1, return2))
@@ -50,14 +62,30 @@
 
 """
 
+import os
+import re
+import collections
+import multiprocessing
+
 from parser_helper_calls import *
 
 DEBUG = False
 
+# Size of the byte ranges that iter_trace_parallel hands to each worker.
+PARALLEL_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Matches the parts of a system call line that cannot be split on ", ": 
+# quoted strings (with escapes) and comments.
+STRACE_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|/\*.*?\*/')
+
 # This dictionary is used to keep track of which syscalls are skipped
 # while parsing, and how may times each syscall was skipped.
 SKIPPED_SYSCALLS = {}
 
+# This dictionary holds, for the last trace parsed to the end, the number of
+# unfinished syscalls of each name that were never resumed.
+ORPHANED_SYSCALLS = {}
+
 ###########
 # STRUCTS #
 ###########
@@ -87,15 +115,134 @@ class UnfinishedSyscall(object):
 
 
 
-def parse_trace(fh):
-  # this list will hold all the parsed syscalls
-  actions = []
+"""
+Parses all the actions of the trace file and returns them in a list. This is a
+thin wrapper over iter_trace.
+"""
+def parse_trace(fh, syscalls=None):
+  return list(iter_trace(fh, syscalls=syscalls))
 
-  # this list will hold all pending (i.e unfinished) syscalls
-  unfinished_syscalls = []
 
-  # process each line
-  for line in fh:
+"""
+Generator that parses the trace file line by line and yields each action as 
+soon as it is parsed. Lines are read lazily from fh, so consumers such as 
+generate_lind_fs.generate_fs or verify_posix.verify_trace can start working on
+the first actions before the rest of the trace is read.
+
+If include_pids is True, (pid, action) tuples are yielded instead of actions.
+If syscalls is given, only the actions of the selected system calls are 
+yielded (see parser_helper_calls.select_syscalls).
+"""
+def iter_trace(fh, include_pids=False, syscalls=None):
+  syscalls = select_syscalls(syscalls)
+
+  # this dictionary will hold all pending (i.e unfinished) syscalls
+  unfinished_syscalls = {}
+
+  for pid, action in _iter_lines(fh, unfinished_syscalls, syscalls=syscalls):
+    if include_pids:
+      yield (pid, action)
+    else:
+      yield action
+
+  _count_orphaned_syscalls(unfinished_syscalls)
+
+  # display all skipped and orphaned syscall names.
+  if(DEBUG):
+    _print_skipped_syscalls()
+
+
+"""
+Parses the trace file at trace_path using a pool of worker processes and 
+returns a list of all the actions parsed. This is a thin wrapper over 
+iter_trace_parallel.
+"""
+def parse_trace_parallel(trace_path, processes=None, syscalls=None):
+  return list(iter_trace_parallel(trace_path, processes, syscalls=syscalls))
+
+
+"""
+Generator that yields the same actions as iter_trace, but parses the trace 
+file at trace_path using a pool of worker processes. processes is the number 
+of workers; if None, as many workers as there are cores are used.
+
+The file is split at line boundaries into byte ranges of about 
+PARALLEL_CHUNK_SIZE bytes (and at least one per worker), and each worker 
+parses whole ranges. The halves of a system call that was unfinished in one 
+range and resumed in a later one cannot be joined by the workers. Instead, 
+they are returned to this process, which goes through the ranges in order,
+keeps the unfinished halves that are still pending at the end of each range,
+and joins them with the resumed halves of the following ranges, just like 
+iter_trace does. If a worker joined two halves that iter_trace would not have
+joined, because an earlier unfinished half of the same pid and system call is
+still pending, the range is parsed again in this process. The actions are
+yielded range by range, and only a few ranges per worker are parsed ahead.
+"""
+def iter_trace_parallel(trace_path, processes=None, include_pids=False,
+                        syscalls=None):
+  if processes == None:
+    processes = multiprocessing.cpu_count()
+
+  syscalls = select_syscalls(syscalls)
+  chunks = _split_trace(trace_path, processes)
+
+  if processes == 1 or len(chunks) <= 1:
+    fh = open(trace_path, "r")
+    for item in iter_trace(fh, include_pids, syscalls):
+      yield item
+    fh.close()
+    return
+
+  pool = multiprocessing.Pool(processes)
+  try:
+    # the unfinished syscalls pending at the end of the ranges stitched so far
+    unfinished_syscalls = {}
+    submitted = collections.deque()
+    next_chunk = 0
+    while next_chunk < len(chunks) or submitted:
+      while next_chunk < len(chunks) and len(submitted) < 2 * processes:
+        start, end = chunks[next_chunk]
+        result = pool.apply_async(_parse_trace_chunk, 
+                                  (trace_path, start, end, syscalls))
+        submitted.append((start, end, result))
+        next_chunk += 1
+
+      start, end, result = submitted.popleft()
+      pid_actions = _stitch_trace_chunk(trace_path, start, end, result.get(),
+                                        unfinished_syscalls, syscalls)
+      for pid, action in pid_actions:
+        if include_pids:
+          yield (pid, action)
+        else:
+          yield action
+  finally:
+    pool.terminate()
+    pool.join()
+
+  _count_orphaned_syscalls(unfinished_syscalls)
+
+  # display all skipped and orphaned syscall names.
+  if(DEBUG):
+    _print_skipped_syscalls()
+
+
+#####################
+# Helper Functions. #
+#####################
+def _iter_lines(lines, unfinished_syscalls, resume_events=None, 
+                syscalls=None):
+  """
+  Yields a (pid, action) tuple for each action parsed from lines. Unfinished
+  syscalls are saved in, and resumed from, the unfinished_syscalls 
+  dictionary (see _saveUnfinishedSyscall). If syscalls is a set of system 
+  call names, the lines of other system calls are skipped.
+
+  If resume_events is a list, a (pid, syscall_name, line) tuple is appended 
+  to it for every resumed line, where line is None if the first half was 
+  found. If it was not, the resumed line itself is yielded in place of an
+  action, so that it can be joined with a first half later.
+  """
+  for line in lines:
     line = line.strip()
     
     if DEBUG:
@@ -108,8 +255,13 @@ def parse_trace(fh):
     if line[:3] in ['+++', '---']:
       continue
 
+    # Skip the system calls that were not selected before doing any work on
+    # them, including both halves of unfinished system calls.
+    if syscalls != None and not _isSelectedSyscall(line, syscalls):
+      continue
+
     # Is the syscall unfinished?
-    if line.find("<unfinished ...>") != -1:
+    if "<unfinished ...>" in line:
       # Save the unfinished syscall and ignore lines that hold no
       # other information.
       if line != "<unfinished ...>":
@@ -117,132 +269,357 @@ def parse_trace(fh):
       continue
 
     # Is the syscall resuming?
-    if line.find("<... ") != -1 and line.find(" resumed>") != -1:
-      line = _resumeUnfinishedSyscall(line, unfinished_syscalls)
-      if line == -1: 
-        # unfinished syscall not found in unfinished_syscalls list
+    if "<... " in line and " resumed>" in line:
+      resumed_line = _resumeUnfinishedSyscall(line, unfinished_syscalls)
+      if resume_events != None:
+        pid, syscall_name = _resumedSyscallKey(line)
+        if resumed_line == -1:
+          resume_events.append((pid, syscall_name, line))
+          yield line
+          continue
+        resume_events.append((pid, syscall_name, None))
+
+      if resumed_line == -1: 
+        # unfinished syscall not found in unfinished_syscalls
         continue
+      line = resumed_line
 
-    # Ignore lines starting with Process:
-    if line.startswith("Process"):
-      continue
-    
-    # Ignore incomplete syscall lines without '(', ')', and '='
-    if line.find('(') == -1 or line.find(')') == -1 or line.find('=') == -1:
-      continue
-    
-    # Parse the syscall name.
-    if line[0] == '[':
-      # format: [pid 12345] syscall_name(...
-      syscall_name = line[line.find(']')+2:line.find('(')]
-    elif len(line[:line.find('(')].split(" ")) > 1:
-      # format: 12345 syscall_name(...
-      syscall_name = line[:line.find('(')].split(" ")[-1]
-    else:
-      # format: syscall_name(...
-      syscall_name = line[:line.find('(')]
+    pid_action = _parse_line(line)
+    if pid_action != None:
+      yield pid_action
 
-    # handle any 'syscall64' the exact same way as 'syscall'
-    # eg fstat64 will be treated as if it was fstat
-    if syscall_name.endswith('64'):
-      syscall_name = syscall_name[:syscall_name.rfind('64')]
-    
-    if syscall_name not in HANDLED_SYSCALLS_INFO:
-      # Keep track of how many times each syscall was skipped. These information 
-      # can be printed every time the parser is used to help identify which are
-      # the most important and most # frequently used syscalls. Subsequently, the
-      # parser can be extended to handle these.
-      if(syscall_name in SKIPPED_SYSCALLS):
-        SKIPPED_SYSCALLS[syscall_name] += 1
-      else:
-        SKIPPED_SYSCALLS[syscall_name] = 1
+
+def _split_trace(trace_path, processes):
+  """
+  Splits the trace file into byte ranges that start at the beginning of a 
+  line. Returns a list of (start, end) tuples.
+  """
+  size = os.path.getsize(trace_path)
+  chunk_count = max(processes, 
+                    (size + PARALLEL_CHUNK_SIZE - 1) // PARALLEL_CHUNK_SIZE)
+
+  fh = open(trace_path, "r")
+  boundaries = [0]
+  for index in range(1, chunk_count):
+    offset = size * index // chunk_count
+    if offset <= boundaries[-1]:
       continue
+    # move to the start of the line that follows offset - 1.
+    fh.seek(offset - 1)
+    fh.readline()
+    offset = fh.tell()
+    if boundaries[-1] < offset < size:
+      boundaries.append(offset)
+  fh.close()
+  boundaries.append(size)
 
-    # Get the parameters.
-    parameterChunk = line[line.find('(')+1:line.rfind('= ')].strip()
-    # Remove right bracket and split.
-    parameters = parameterChunk[:-1].split(", ")
-    
-    # if the syscall is getdents, keep only the first and last parameters. These
-    # are the file descriptor and the buffer size.
-    if syscall_name.startswith("getdents"):
-      parameters = [parameters[0], parameters[-1]]
-
-    # change number to flag in shutdown according to first letter of second 
-    # parameter
-    # 7169  shutdown(5, 0 /* receive */)          = 0
-    if syscall_name.startswith("shutdown"):
-      shutdown_flags = {0:'SHUT_RD', 1:'SHUT_WR', 2:'SHUT_RDWR'}
-      parameters[1] = shutdown_flags[int(parameters[1][0])]
-    
-    # system calls statfs64 or fstatfs64, sometimes include an 
-    # unnecessary numeric value as their second parameter. Remove it.
-    if syscall_name.startswith("statfs") or syscall_name.startswith("fstatfs"):
-      # 22480 statfs64("/selinux", 84, {f_type="EXT2_SUPER_MAGIC", 
-      # f_bsize=4096, f_blocks=4553183, f_bfree=741326, f_bavail=510030, 
-      # f_files=1158720, f_ffree=509885, f_fsid={-1853641883, 
-      # -1823071587}, f_namelen=255, f_frsize=4096}) = 0
-      if parameters[1].isdigit():
-        parameters.pop(1)
-
-    # TODO: add support for fcntl third parameter according to second parameter.
-    if syscall_name.startswith("fcntl"):
-      # keep only the first two paramenters
-      parameters = [parameters[0], parameters[1]]
-
-    # Fix errors from split on messages
-    mergeQuoteParameters(parameters)
-
-    # Get the return part.
-    straceReturn = line[line.rfind('=')+1:].strip()
-    if syscall_name.startswith("fcntl") and straceReturn.find("(flags ") != -1:
-      # handle fcntl return part. I.e use the set of flags instead
-      # of their hex representation.
-      # example:
-      # fcntl64(4, F_GETFL) = 0x402 (flags O_RDWR|O_APPEND)
-      # replace the hex part: 0x402 with the flags O_RDWR|O_APPEND
-      # get the part between '(flags' and ')'
-      straceReturn = straceReturn[straceReturn.find("(flags ")+7:
-                                  straceReturn.rfind(")")]
-      straceReturn = (straceReturn, None)
+  return zip(boundaries[:-1], boundaries[1:])
+
+
+def _read_trace_chunk(trace_path, start, end):
+  fh = open(trace_path, "r")
+  fh.seek(start)
+  data = fh.read(end - start)
+  fh.close()
+  return data.split("\n")
+
+
+def _parse_trace_chunk(trace_path, start, end, syscalls):
+  """
+  Run by the worker processes. Parses the lines of the trace file between the
+  byte offsets start and end, starting with no unfinished syscalls. Returns 
+  the items yielded by _iter_lines, the resume events, the unfinished 
+  syscalls that are still pending at the end of the range and the syscalls 
+  skipped.
+  """
+  SKIPPED_SYSCALLS.clear()
+  unfinished_syscalls = {}
+  resume_events = []
+  items = list(_iter_lines(_read_trace_chunk(trace_path, start, end), 
+                           unfinished_syscalls, resume_events, syscalls))
+  return items, resume_events, unfinished_syscalls, dict(SKIPPED_SYSCALLS)
+
+
+def _stitch_trace_chunk(trace_path, start, end, chunk_result, 
+                        unfinished_syscalls, syscalls):
+  """
+  Joins the resumed lines of a parsed range with the unfinished syscalls that
+  were pending at the end of the previous ranges, and returns the (pid, 
+  action) tuples of the range. unfinished_syscalls is updated to hold the 
+  unfinished syscalls pending at the end of the range.
+  """
+  items, resume_events, chunk_unfinished_syscalls, skipped = chunk_result
+
+  # replay the resumed lines of the range against the pending syscalls.
+  pending = {}
+  for key in unfinished_syscalls:
+    pending[key] = list(unfinished_syscalls[key])
+  joined_lines = []
+  for pid, syscall_name, line in resume_events:
+    if line == None:
+      # the worker found the first half in the range. This is only what 
+      # iter_trace does if no earlier first half is pending.
+      if (pid, syscall_name) in pending:
+        if DEBUG:
+          print "Parsing range " + str((start, end)) + " again.\n"
+        lines = _read_trace_chunk(trace_path, start, end)
+        return list(_iter_lines(lines, unfinished_syscalls, 
+                                syscalls=syscalls))
     else:
-      spaced_results = straceReturn.split(" ")
-      if len(spaced_results) > 1:
-        # keep only the first part.
-        straceReturn = straceReturn[:straceReturn.find(" ")]
-      try: 
-        straceReturn = int(straceReturn) # result can also be a '?'
-      except ValueError:
-        pass
-      # in case of an error include the error name as well.
-      if straceReturn == -1 and len(spaced_results) > 1:
-        straceReturn = (straceReturn, spaced_results[1])
-      else:
-        # if no error, use None as the second return value
-        straceReturn = (straceReturn, None)
-
-    action = parse_syscall(syscall_name, parameters, straceReturn)
-    
-    if action != UNIMPLEMENTED_ERROR:
-      actions.append(action)
+      joined_lines.append(_resumeUnfinishedSyscall(line, pending))
+
+  # the halves left from the earlier ranges are older, so they come first.
+  unfinished_syscalls.clear()
+  unfinished_syscalls.update(pending)
+  for key in chunk_unfinished_syscalls:
+    unfinished_syscalls.setdefault(key, []).extend(
+        chunk_unfinished_syscalls[key])
+  for syscall_name in skipped:
+    SKIPPED_SYSCALLS[syscall_name] = (SKIPPED_SYSCALLS.get(syscall_name, 0) + 
+                                      skipped[syscall_name])
+
+  # put the actions of the joined lines in place of the resumed lines.
+  pid_actions = []
+  joined_index = 0
+  for item in items:
+    if type(item) is str:
+      line = joined_lines[joined_index]
+      joined_index += 1
+      if line == -1:
+        # unfinished syscall not found in any range
+        continue
+      item = _parse_line(line)
+      if item == None:
+        continue
+    pid_actions.append(item)
+
+  return pid_actions
+
+
+def _count_orphaned_syscalls(unfinished_syscalls):
+  """
+  Counts the unfinished syscalls left pending at the end of the trace in 
+  ORPHANED_SYSCALLS.
+  """
+  ORPHANED_SYSCALLS.clear()
+  for pid, syscall_name in unfinished_syscalls:
+    ORPHANED_SYSCALLS[syscall_name] = (ORPHANED_SYSCALLS.get(syscall_name, 0) +
+        len(unfinished_syscalls[(pid, syscall_name)]))
+
+
+def _print_skipped_syscalls():
+  print "\nSkipped System Calls"
+  for skipped in SKIPPED_SYSCALLS:
+    print skipped + ": " + str(SKIPPED_SYSCALLS[skipped])
+
+  print "\nUnfinished System Calls Never Resumed"
+  for orphaned in ORPHANED_SYSCALLS:
+    print orphaned + ": " + str(ORPHANED_SYSCALLS[orphaned])
+
+
+def _parse_line(line):
+  """
+  Parses a complete system call line, with any unfinished and resumed halves
+  already joined. Returns a tuple (pid, action), or None if the line does not
+  hold a system call that the parser handles.
+  """
+  # Ignore lines starting with Process:
+  if line.startswith("Process"):
+    return None
   
-  # display all skipped syscall names.
-  if(DEBUG):
-    print "\nSkipped System Calls"
-    for skipped in SKIPPED_SYSCALLS:
-      print skipped + ": " + str(SKIPPED_SYSCALLS[skipped])
+  # Parse the pid and the syscall name.
+  head = _parse_syscall_head(line)
+  if head == None:
+    return None
+  pid, syscall_name, open_paren = head
+
+  # handle any 'syscall64' the exact same way as 'syscall'
+  # eg fstat64 will be treated as if it was fstat
+  if syscall_name.endswith('64'):
+    syscall_name = syscall_name[:syscall_name.rfind('64')]
   
-  return actions
+  if syscall_name not in HANDLED_SYSCALLS_INFO:
+    # Keep track of how many times each syscall was skipped. These information 
+    # can be printed every time the parser is used to help identify which are
+    # the most important and most # frequently used syscalls. Subsequently, the
+    # parser can be extended to handle these.
+    if(syscall_name in SKIPPED_SYSCALLS):
+      SKIPPED_SYSCALLS[syscall_name] += 1
+    else:
+      SKIPPED_SYSCALLS[syscall_name] = 1
+    return None
+
+  # Get the parameters and the return part. Incomplete syscall lines are
+  # ignored.
+  tokens = _tokenize_syscall_arguments(line, open_paren)
+  if tokens == None:
+    return None
+  parameters, straceReturn = tokens
+
+  # if the syscall is getdents, keep only the first and last parameters. These
+  # are the file descriptor and the buffer size.
+  if syscall_name.startswith("getdents"):
+    parameters = [parameters[0], parameters[-1]]
+
+  # change number to flag in shutdown according to first letter of second 
+  # parameter
+  # 7169  shutdown(5, 0 /* receive */)          = 0
+  if syscall_name.startswith("shutdown"):
+    shutdown_flags = {0:'SHUT_RD', 1:'SHUT_WR', 2:'SHUT_RDWR'}
+    parameters[1] = shutdown_flags[int(parameters[1][0])]
+  
+  # system calls statfs64 or fstatfs64, sometimes include an 
+  # unnecessary numeric value as their second parameter. Remove it.
+  if syscall_name.startswith("statfs") or syscall_name.startswith("fstatfs"):
+    # 22480 statfs64("/selinux", 84, {f_type="EXT2_SUPER_MAGIC", 
+    # f_bsize=4096, f_blocks=4553183, f_bfree=741326, f_bavail=510030, 
+    # f_files=1158720, f_ffree=509885, f_fsid={-1853641883, 
+    # -1823071587}, f_namelen=255, f_frsize=4096}) = 0
+    if parameters[1].isdigit():
+      parameters.pop(1)
+
+  # TODO: add support for fcntl third parameter according to second parameter.
+  if syscall_name.startswith("fcntl"):
+    # keep only the first two paramenters
+    parameters = [parameters[0], parameters[1]]
+
+  if syscall_name.startswith("fcntl") and straceReturn.find("(flags ") != -1:
+    # handle fcntl return part. I.e use the set of flags instead
+    # of their hex representation.
+    # example:
+    # fcntl64(4, F_GETFL) = 0x402 (flags O_RDWR|O_APPEND)
+    # replace the hex part: 0x402 with the flags O_RDWR|O_APPEND
+    # get the part between '(flags' and ')'
+    straceReturn = straceReturn[straceReturn.find("(flags ")+7:
+                                straceReturn.rfind(")")]
+    straceReturn = (straceReturn, None)
+  else:
+    spaced_results = straceReturn.split(" ")
+    if len(spaced_results) > 1:
+      # keep only the first part.
+      straceReturn = straceReturn[:straceReturn.find(" ")]
+    try: 
+      straceReturn = int(straceReturn) # result can also be a '?'
+    except ValueError:
+      pass
+    # in case of an error include the error name as well.
+    if straceReturn == -1 and len(spaced_results) > 1:
+      straceReturn = (straceReturn, spaced_results[1])
+    else:
+      # if no error, use None as the second return value
+      straceReturn = (straceReturn, None)
+
+  action = parse_syscall(syscall_name, parameters, straceReturn)
+  if action == UNIMPLEMENTED_ERROR:
+    return None
+
+  return pid, action
+
+
+def _parse_syscall_head(line):
+  """
+  Parses the part of a system call line before the parameters. Returns a 
+  tuple (pid, syscall_name, open_paren), where open_paren is the index of the
+  parenthesis that opens the parameters, or None if the line has no 
+  parameters. pid is None if the line has no pid.
+  """
+  open_paren = line.find('(')
+  if open_paren == -1:
+    return None
+
+  if line[0] == '[':
+    # format: [pid 12345] syscall_name(...
+    close_bracket = line.find(']', 0, open_paren)
+    pid = int(line[line.find(' ')+1:close_bracket])
+    syscall_name = line[close_bracket+2:open_paren]
+  else:
+    last_space = line.rfind(' ', 0, open_paren)
+    if last_space != -1:
+      # format: 12345 syscall_name(...
+      pid = int(line[:line.find(' ')])
+      syscall_name = line[last_space+1:open_paren]
+    else:
+      # format: syscall_name(...
+      pid = None
+      syscall_name = line[:open_paren]
+
+  return pid, syscall_name, open_paren
+
+
+def _tokenize_syscall_arguments(line, open_paren):
+  """
+  Splits the parameters and the return part of a system call line in a 
+  single pass, starting at the parenthesis that opens the parameters. Returns
+  a tuple (parameters, return_part), or None if the line is incomplete.
+
+  Parameters are separated by ", " outside quoted strings and comments, so 
+  strings that contain ", " are kept whole. The intermediate representation
+  expects the members of structures and arrays as separate parameters (eg 
+  "{sa_family=AF_INET" and "sin_port=htons(80)"), so ", " separates 
+  parameters inside brackets as well. Truncation markers such as "..." stay
+  part of the parameter they follow. Outside strings and comments, the first
+  " = " separates the parameters from the return part.
+  """
+  parameters = []
+  # the text of the parameter that a string or comment was part of.
+  current = ""
+  position = open_paren + 1
+  if '"' in line or '/*' in line:
+    for match in STRACE_TOKEN_RE.finditer(line, position):
+      if line.find(' = ', position, match.start()) != -1:
+        # the string or comment is part of the return part.
+        break
+      # split the text before the string or comment.
+      pieces = line[position:match.start()].split(", ")
+      pieces[0] = current + pieces[0]
+      current = pieces.pop() + match.group()
+      parameters.extend(pieces)
+      position = match.end()
+
+  equals = line.find(' = ', position)
+  if equals == -1:
+    return None
+  # remove the parenthesis that closes the parameters.
+  parameter_chunk = line[position:equals].rstrip()
+  if parameter_chunk[-1:] != ')':
+    return None
+
+  pieces = parameter_chunk[:-1].split(", ")
+  pieces[0] = current + pieces[0]
+  parameters.extend(pieces)
+  parameters[0] = parameters[0].lstrip()
+
+  return parameters, line[equals+3:].strip()
+
+
+def _isSelectedSyscall(line, syscalls):
+  """
+  Returns whether the line is (part of) one of the system calls in syscalls.
+  Only the system call name is looked at: the name before the parenthesis 
+  that opens the parameters, or the name of a resumed system call. Lines 
+  without a system call name are kept.
+  """
+  resumed = line.find("<... ")
+  if resumed != -1:
+    syscall_name = line[resumed+5:line.find(" ", resumed+5)]
+  else:
+    open_paren = line.find('(')
+    if open_paren == -1:
+      return True
+    syscall_name = line[line.rfind(' ', 0, open_paren)+1:open_paren]
+
+  # fstat64 is selected by fstat, like _parse_line treats it.
+  if syscall_name.endswith('64'):
+    syscall_name = syscall_name[:-2]
+  return syscall_name in syscalls
 
 
-#####################
-# Helper Functions. #
-#####################
 def _saveUnfinishedSyscall(line, unfinished_syscalls):
   """
-  Save unfinished system calls in unfinished_syscalls list until they
-  are resumed.
-  Each entry is defined by the pid and the system call name.
+  Save unfinished system calls in unfinished_syscalls until they are 
+  resumed. unfinished_syscalls is a dictionary keyed by the pid and the 
+  system call name, and each value is a list of the pending syscalls with
+  that key, oldest first.
   """
   try:
     # get pid and syscall name from format: [pid 12345] syscall_name(...
@@ -254,15 +631,17 @@ def _saveUnfinishedSyscall(line, unfinished_syscalls):
     syscall_name = line[line.find(" ")+1:line.find("(")].strip()
 
   if syscall_name in HANDLED_SYSCALLS_INFO:
-    unfinished_syscalls.append(UnfinishedSyscall(pid, syscall_name, line[:line.find("<unfinished ...>")].strip()))
+    unfinished_syscall = UnfinishedSyscall(pid, syscall_name, line[:line.find("<unfinished ...>")].strip())
+    key = (pid, syscall_name)
+    if key in unfinished_syscalls:
+      unfinished_syscalls[key].append(unfinished_syscall)
+    else:
+      unfinished_syscalls[key] = [unfinished_syscall]
     
 
-def _resumeUnfinishedSyscall(line, unfinished_syscalls):
+def _resumedSyscallKey(line):
   """
-  Resume a previously unfinished system call. Search for the  system
-  call in unfinished_syscalls based on the pid and the system call 
-  name, and if found merge current line (second half of system call)
-  with the first half previously saved.
+  Returns the pid and the system call name of a resumed line.
   """
   try:
     # parses format: [pid 12345] syscall_name(...
@@ -275,15 +654,22 @@ def _resumeUnfinishedSyscall(line, unfinished_syscalls):
       raise Exception("Failed to parse pid. Unexpected format.")
   
   syscall_name = line[line.find("<... ") + 5:line.find(" resumed>")]
+  return pid, syscall_name
+
+
+def _resumeUnfinishedSyscall(line, unfinished_syscalls):
+  """
+  Resume a previously unfinished system call. Search for the  system
+  call in unfinished_syscalls based on the pid and the system call 
+  name, and if found merge current line (second half of system call)
+  with the first half previously saved.
+  """
+  key = _resumedSyscallKey(line)
 
   # find unfinished system call
-  unfinished_syscalls_index = None
-  for index in range(0, len(unfinished_syscalls), 1):
-    if unfinished_syscalls[index].pid == pid and unfinished_syscalls[index].syscall_name == syscall_name:
-      unfinished_syscalls_index = index
-      break
+  pending_list = unfinished_syscalls.get(key)
 
-  if unfinished_syscalls_index == None:
+  if pending_list == None:
     if DEBUG:
       print "Pending syscall not found.\n"
     return -1
@@ -292,9 +678,11 @@ def _resumeUnfinishedSyscall(line, unfinished_syscalls):
     if second_half[0] != ')':
       second_half = " " + second_half
 
-    pending = unfinished_syscalls[unfinished_syscalls_index]
+    # resume the oldest pending syscall with this pid and name.
+    pending = pending_list.pop(0)
+    if len(pending_list) == 0:
+      del unfinished_syscalls[key]
     line = pending.firstHalf + second_half
-    unfinished_syscalls.pop(unfinished_syscalls_index)
 
     return line
 
@@ -9,7 +9,18 @@
   Savvas Savvides <savvas@nyu.edu>
 
 <Purpose>
-  
+  This is the parser that translates traces from truss output format to the 
+  intermediate representation, as it is defined in the file 
+  parser_intermediate_representation.py. Like parser_strace_calls, it provides
+  iter_trace, a generator that yields actions one at a time as they are parsed,
+  and parse_trace, which returns a list of all the actions parsed. 
+  iter_trace(fh, include_pids=True) yields (pid, action) tuples instead, where
+  pid is the process id truss printed for the system call, or None.
+
+    import parser_truss_calls
+    fh = open(TRACE_FILE_NAME, "r")
+    for action in parser_truss_calls.iter_trace(fh):
+      ...
 
 """
 
@@ -18,13 +29,36 @@ from parser_helper_calls import *
 
 DEBUG = False
 
+# The system calls that truss prints under a different name than the one used
+# in the intermediate representation (see _translate_truss_arguments).
+TRUSS_SYSCALL_NAMES = {"xstat": "stat", "fxstat": "fstat", 
+                       "so_socket": "socket", "statvfs": "statfs",
+                       "fstatvfs": "fstatfs"}
 
 
 
-def parse_trace(fh):
-  # this list will hold all the parsed syscalls
-  actions = []
-  
+"""
+Parses all the actions of the trace file and returns them in a list. This is a
+thin wrapper over iter_trace.
+"""
+def parse_trace(fh, syscalls=None):
+  return list(iter_trace(fh, syscalls=syscalls))
+
+
+"""
+Generator that parses the trace file and yields each action as soon as it is 
+parsed. Some truss system calls span multiple lines which are read from fh by
+_translate_truss_arguments, so fh must not be shared with other readers while
+the generator is in use.
+
+If include_pids is True, (pid, action) tuples are yielded instead of actions.
+If syscalls is given, only the actions of the selected system calls are 
+yielded (see parser_helper_calls.select_syscalls), and the lines of other 
+system calls are skipped as soon as their system call name is read.
+"""
+def iter_trace(fh, include_pids=False, syscalls=None):
+  syscalls = select_syscalls(syscalls)
+
   # process each line
   while True:
     line = fh.readline()
@@ -47,12 +81,23 @@ def parse_trace(fh):
     if line.find('(sleeping...)') != -1:
       continue
     
-    # Get the syscall name.
+    # Get the pid and the syscall name.
+    # 1648: bind(3, 0x080474F0, 16, SOV_SOCKBSD)    = 0
+    # 1815/1:   connect(5, 0x080474F0, 16, SOV_DEFAULT)   = 0
+    pid = None
     if len(line[:line.find('(')].split()) > 1:
       syscall_name = line[:line.find('(')].split()[-1]
+      try:
+        pid = int(line.split()[0].rstrip(':').split('/')[0])
+      except ValueError:
+        pass
     else:
       syscall_name = line[:line.find('(')]
 
+    # Skip the system calls that were not selected.
+    if syscalls != None and _translate_truss_name(syscall_name) not in syscalls:
+      continue
+
     # Get the syscall parameters.
     parameterChunk = line[line.find('(')+1:line.rfind(')')].strip()
     parameters = parameterChunk.split(", ")
@@ -98,15 +143,29 @@ def parse_trace(fh):
     action = parse_syscall(syscall_name, parameters, trussResult)
     
     if action != UNIMPLEMENTED_ERROR:
-      actions.append(action)
+      if include_pids:
+        yield (pid, action)
+      else:
+        yield action
   
   # display all skipped syscall_names.
   if(DEBUG):
     print "\nSkipped System Calls"
     for skipped in SKIPPED_SYSCALLS:
       print skipped + ": " + str(SKIPPED_SYSCALLS[skipped])
-  
-  return actions
+
+"""
+Returns the name the intermediate representation uses for the system call 
+that truss printed as syscall_name.
+"""
+def _translate_truss_name(syscall_name):
+  # same as in _translate_truss_arguments.
+  if syscall_name.endswith('64'):
+    syscall_name = syscall_name[:syscall_name.rfind('64')]
+  if syscall_name.endswith('4'):
+    syscall_name = syscall_name[:syscall_name.rfind('4')]
+  return TRUSS_SYSCALL_NAMES.get(syscall_name, syscall_name)
+
 
 """
 posix_intermediate_representation expects a slightly different argument format 
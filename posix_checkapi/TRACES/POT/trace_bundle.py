@@ -0,0 +1,263 @@
+"""
+<Program>
+  trace_bundle.py
+
+<Purpose>
+  Reads and writes the parsed actions stored inside a trace bundle.
+
+  Version 1 bundles store all the parsed actions as a single pickled list in the
+  "actions.pickle" member of the bundle. Loading such a bundle requires
+  unpickling the whole trace at once.
+
+  Version 2 bundles store the actions in the "actions.chunks" member instead.
+  This member holds a sequence of chunks, each one a pickled list of at most
+  CHUNK_SIZE consecutive actions immediately followed by a pickled list with
+  the pid of each of these actions (None where the pid is not known). The
+  chunks are followed by an index footer. Each chunk can be decoded 
+  independently of all the others. The layout of the member is:
+
+    CHUNKS_MAGIC
+    chunk 0 actions, chunk 0 pids
+    chunk 1 actions, chunk 1 pids
+    ...
+    index           (pickled list with one entry per chunk)
+    index offset    (8 bytes, little endian)
+    INDEX_MAGIC
+
+  Each index entry is a dictionary describing one chunk:
+
+    {'offset': 8,          # position of the chunk in the member
+     'length': 31237,      # size of the pickled chunk in bytes
+     'pids_length': 4102,  # size of the pickled pids that follow the chunk
+     'first_line': 4097,   # action number of the first action in the chunk
+     'count': 4096,        # number of actions in the chunk
+     'histogram': {'open_syscall': 312, 'read_syscall': 1290, ...}}
+
+  Action numbers start from 1 and are the same numbers verify_posix uses when
+  reporting errors. Using the index, a reader can stream the actions one chunk
+  at a time, jump straight to a range of actions, or hand whole chunks to
+  other workers.
+
+  Example of using this module:
+
+    fh = open("actions.chunks", "wb")
+    writer = trace_bundle.ChunkedActionsWriter(fh)
+    for action in actions:
+      writer.add(action)
+    writer.close()
+    fh.close()
+
+    reader = trace_bundle.ChunkedActionsReader(open("actions.chunks", "rb"))
+    for action in reader.iter_actions(first_line=100, last_line=200):
+      ...
+"""
+
+import struct
+import cPickle
+
+
+# Names of the bundle members that hold the parsed actions.
+ACTIONS_PICKLE_NAME = "actions.pickle"
+ACTIONS_CHUNKS_NAME = "actions.chunks"
+
+# The bundle format generated by default.
+BUNDLE_VERSION = 2
+
+# Number of actions stored in each chunk.
+CHUNK_SIZE = 4096
+
+CHUNKS_MAGIC = "CHKAPI2\n"
+INDEX_MAGIC = "CHKIDX2\n"
+_OFFSET_FORMAT = "<Q"
+_OFFSET_SIZE = struct.calcsize(_OFFSET_FORMAT)
+
+
+
+
+class ChunkedActionsWriter(object):
+  """
+  Writes actions to an open file in the chunked format. Actions are buffered
+  until CHUNK_SIZE of them are collected, so at most one chunk is kept in
+  memory at any time. close() must be called to write the index footer. It
+  does not close the underlying file.
+  """
+  def __init__(self, fh, chunk_size=CHUNK_SIZE):
+    if chunk_size < 1:
+      raise ValueError("Chunk size must be positive.")
+    self.fh = fh
+    self.chunk_size = chunk_size
+    self.index = []
+    self._pending = []
+    self._pending_pids = []
+    self._next_line = 1
+    self._offset = len(CHUNKS_MAGIC)
+    self.fh.write(CHUNKS_MAGIC)
+
+  def add(self, action, pid=None):
+    self._pending.append(action)
+    self._pending_pids.append(pid)
+    if len(self._pending) >= self.chunk_size:
+      self._flush()
+
+  def close(self):
+    self._flush()
+    index_data = cPickle.dumps(self.index, cPickle.HIGHEST_PROTOCOL)
+    self.fh.write(index_data)
+    self.fh.write(struct.pack(_OFFSET_FORMAT, self._offset))
+    self.fh.write(INDEX_MAGIC)
+
+  def _flush(self):
+    if not self._pending:
+      return
+
+    histogram = {}
+    for action in self._pending:
+      histogram[action[0]] = histogram.get(action[0], 0) + 1
+
+    data = cPickle.dumps(self._pending, cPickle.HIGHEST_PROTOCOL)
+    self.fh.write(data)
+    pids_data = cPickle.dumps(self._pending_pids, cPickle.HIGHEST_PROTOCOL)
+    self.fh.write(pids_data)
+
+    self.index.append({'offset': self._offset, 'length': len(data),
+                       'pids_length': len(pids_data),
+                       'first_line': self._next_line,
+                       'count': len(self._pending), 'histogram': histogram})
+
+    self._offset += len(data) + len(pids_data)
+    self._next_line += len(self._pending)
+    self._pending = []
+    self._pending_pids = []
+
+
+
+
+class ChunkedActionsReader(object):
+  """
+  Reads actions from an open, seekable file in the chunked format. Only the
+  index is read when the reader is created; chunks are read and decoded on
+  demand.
+  """
+  def __init__(self, fh):
+    self.fh = fh
+
+    fh.seek(0)
+    if fh.read(len(CHUNKS_MAGIC)) != CHUNKS_MAGIC:
+      raise Exception("Not a chunked actions file.")
+
+    # the footer is the index offset followed by INDEX_MAGIC
+    fh.seek(-(_OFFSET_SIZE + len(INDEX_MAGIC)), 2)
+    footer = fh.read(_OFFSET_SIZE + len(INDEX_MAGIC))
+    if footer[_OFFSET_SIZE:] != INDEX_MAGIC:
+      raise Exception("Chunked actions file is truncated or corrupted.")
+    index_offset = struct.unpack(_OFFSET_FORMAT, footer[:_OFFSET_SIZE])[0]
+
+    fh.seek(index_offset)
+    self.index = cPickle.loads(fh.read())
+
+  def __len__(self):
+    if not self.index:
+      return 0
+    return self.index[-1]['first_line'] + self.index[-1]['count'] - 1
+
+  def read_chunk(self, chunk_number):
+    """
+    Returns the list of actions stored in the given chunk.
+    """
+    entry = self.index[chunk_number]
+    self.fh.seek(entry['offset'])
+    return cPickle.loads(self.fh.read(entry['length']))
+
+  def read_chunk_pids(self, chunk_number):
+    """
+    Returns the list with the pid of each action stored in the given chunk.
+    """
+    entry = self.index[chunk_number]
+    self.fh.seek(entry['offset'] + entry['length'])
+    return cPickle.loads(self.fh.read(entry['pids_length']))
+
+  def histogram(self):
+    """
+    Returns the number of actions of each system call in the whole trace.
+    """
+    total = {}
+    for entry in self.index:
+      for syscall_name, count in entry['histogram'].iteritems():
+        total[syscall_name] = total.get(syscall_name, 0) + count
+    return total
+
+  def iter_actions(self, first_line=1, last_line=None, include_pids=False):
+    """
+    Yields the actions numbered first_line to last_line (inclusive). Chunks
+    that lie entirely outside the range are not read. If include_pids is True,
+    (pid, action) tuples are yielded instead.
+    """
+    for chunk_number in range(len(self.index)):
+      entry = self.index[chunk_number]
+      chunk_last_line = entry['first_line'] + entry['count'] - 1
+
+      if chunk_last_line < first_line:
+        continue
+      if last_line is not None and entry['first_line'] > last_line:
+        break
+
+      chunk = self.read_chunk(chunk_number)
+      start = max(first_line - entry['first_line'], 0)
+      stop = len(chunk)
+      if last_line is not None:
+        stop = min(last_line - entry['first_line'] + 1, stop)
+
+      if include_pids:
+        chunk = zip(self.read_chunk_pids(chunk_number), chunk)
+
+      for action in chunk[start:stop]:
+        yield action
+
+
+
+
+def write_actions(fh, actions, chunk_size=CHUNK_SIZE):
+  """
+  Writes all the actions of an iterable to fh in the chunked format.
+  """
+  writer = ChunkedActionsWriter(fh, chunk_size)
+  for action in actions:
+    writer.add(action)
+  writer.close()
+
+
+def get_bundle_version(bundle_tar):
+  """
+  Given an open trace bundle tarfile, returns the version of its format.
+  """
+  tar_files = bundle_tar.getnames()
+  if ACTIONS_CHUNKS_NAME in tar_files:
+    return 2
+  if ACTIONS_PICKLE_NAME in tar_files:
+    return 1
+  raise Exception("Trace actions not found in the tarfile.")
+
+
+def iter_bundle_actions(bundle_tar, first_line=1, last_line=None, 
+                        include_pids=False):
+  """
+  Returns an iterator over the actions numbered first_line to last_line 
+  (inclusive) of an open trace bundle tarfile of any version. Nothing is 
+  extracted to disk. Version 1 bundles are unpickled in full before the range
+  is applied. If include_pids is True, the iterator returns (pid, action) 
+  tuples. Version 1 bundles do not record pids, so pid is always None for them.
+  """
+  if get_bundle_version(bundle_tar) == 1:
+    pickle_file = bundle_tar.extractfile(ACTIONS_PICKLE_NAME)
+    actions = cPickle.load(pickle_file)
+    pickle_file.close()
+
+    if last_line is None:
+      last_line = len(actions)
+    actions = actions[first_line-1:last_line]
+    if include_pids:
+      return ((None, action) for action in actions)
+    return iter(actions)
+
+  reader = ChunkedActionsReader(bundle_tar.extractfile(ACTIONS_CHUNKS_NAME))
+  return reader.iter_actions(first_line, last_line, include_pids)
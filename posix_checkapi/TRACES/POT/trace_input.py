@@ -0,0 +1,269 @@
+"""
+<Program>
+  trace_input.py
+
+<Started>
+  October 2026
+
+<Purpose>
+  Reads trace files for the parsers. Besides plain trace files, it reads
+  traces compressed with gzip, bzip2 or xz and traces stored in tar archives
+  (compressed or not), such as the captures in program_traces. Compressed
+  data is decompressed while it is read, so traces never need to be
+  extracted to disk first.
+
+  The kind of file is inferred from its extension:
+
+    trace.strace                       plain trace
+    trace.strace.gz, .bz2, .xz         compressed trace
+    capture.tar, .tar.gz, .tgz,
+    .tar.bz2, .tbz2, .tar.xz, .txz     tar archive
+
+  Example of using this module:
+
+    import trace_input
+    import parser_strace_calls
+
+    trace = trace_input.TraceInput("amsn_ubuntu_strace.tar.gz")
+    for action in parser_strace_calls.iter_trace(trace):
+      ...
+    trace.close()
+
+  A TraceInput can be iterated over once, like an open file, and also
+  supports readline. The first line of the trace is read when it is opened
+  and is available as first_line, so that the execve line can be examined
+  without reading the trace a second time.
+
+  xz is decompressed with the lzma module if it is available (Python 3 or
+  backports.lzma), or else with the xz command.
+"""
+
+import bz2
+import gzip
+import zlib
+import tarfile
+import itertools
+import subprocess
+
+# Size of the blocks read from compressed traces.
+READ_SIZE = 1024 * 1024
+
+# Extensions of compressed traces and tar archives. Each entry holds the
+# extension, the compression and whether the file is a tar archive. Longer
+# extensions come first.
+TRACE_EXTENSIONS = [(".tar.gz", "gz", True), (".tgz", "gz", True),
+                    (".tar.bz2", "bz2", True), (".tbz2", "bz2", True),
+                    (".tar.xz", "xz", True), (".txz", "xz", True),
+                    (".tar", None, True),
+                    (".gz", "gz", False), (".bz2", "bz2", False),
+                    (".xz", "xz", False)]
+
+
+
+class TraceInput(object):
+  """
+  A trace file, read line by line.
+
+  trace_path is the path of a plain or compressed trace, or of a tar
+  archive. For tar archives, member is the name of the trace in the archive.
+  If it is not given, the first regular file of the archive is used. If
+  copy_path is given and the trace comes from a tar archive, a gzip
+  compressed copy of the trace is written there while the trace is read.
+
+  After opening:
+    name          the name of the trace: the member name for tar archives,
+                  and the file name without the compression extension for
+                  compressed traces.
+    compression   "gz", "bz2", "xz" or None.
+    in_archive    whether the trace comes from a tar archive.
+    first_line    the first line of the trace, or "" if it is empty.
+  """
+
+  def __init__(self, trace_path, member=None, copy_path=None):
+    self.path = trace_path
+    self.name = trace_path
+    self.compression = None
+    self.in_archive = False
+    for extension, compression, in_archive in TRACE_EXTENSIONS:
+      if trace_path.endswith(extension):
+        self.name = trace_path[:-len(extension)]
+        self.compression = compression
+        self.in_archive = in_archive
+        break
+
+    # the objects to close once the trace has been read.
+    self._files = []
+    self._process = None
+
+    if not self.in_archive and self.compression == None:
+      # plain trace. Its lines are read straight from the file.
+      fh = open(trace_path, "r")
+      self._files.append(fh)
+      self.first_line = fh.readline()
+      self._lines = itertools.chain([self.first_line], fh)
+      return
+
+    if self.in_archive:
+      chunks = self._open_member(member)
+      if copy_path != None:
+        copy_fh = gzip.open(copy_path, "wb", 1)
+        self._files.append(copy_fh)
+        chunks = _copy_chunks(chunks, copy_fh)
+    else:
+      chunks = self._open_compressed()
+
+    lines = _iter_chunk_lines(chunks)
+    self.first_line = next(lines, "")
+    self._lines = itertools.chain([self.first_line], lines)
+
+
+  def __iter__(self):
+    return self._lines
+
+
+  def readline(self):
+    return next(self._lines, "")
+
+
+  def close(self):
+    for fh in self._files:
+      fh.close()
+    self._files = []
+
+    if self._process != None:
+      self._process.stdout.close()
+      self._process.wait()
+      self._process = None
+
+
+  def _open_compressed(self):
+    """
+    Returns an iterator over the decompressed blocks of a compressed trace.
+    """
+    if self.compression == "xz":
+      xz_fh = self._open_xz()
+      return iter(lambda: xz_fh.read(READ_SIZE), "")
+
+    fh = open(self.path, "rb")
+    self._files.append(fh)
+    chunks = iter(lambda: fh.read(READ_SIZE), "")
+    if self.compression == "gz":
+      # 16 + MAX_WBITS expects a gzip header and trailer.
+      return _iter_decompressed(chunks,
+                                lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    return _iter_decompressed(chunks, bz2.BZ2Decompressor)
+
+
+  def _open_member(self, member):
+    """
+    Returns an iterator over the blocks of the trace in a tar archive. The
+    archive is read as a stream, so it is decompressed once, up to the end of
+    the trace.
+    """
+    if self.compression == None:
+      tar = tarfile.open(self.path, "r|")
+    elif self.compression == "xz":
+      # tarfile does not support xz in Python 2.
+      tar = tarfile.open(fileobj=self._open_xz(), mode="r|")
+    else:
+      tar = tarfile.open(self.path, "r|" + self.compression)
+    self._files.append(tar)
+
+    for tarinfo in tar:
+      if tarinfo.isfile() and (member == None or tarinfo.name == member):
+        self.name = tarinfo.name
+        member_fh = tar.extractfile(tarinfo)
+        return iter(lambda: member_fh.read(READ_SIZE), "")
+
+    if member == None:
+      raise Exception("No trace found in " + self.path)
+    raise Exception("Trace " + member + " not found in " + self.path)
+
+
+  def _open_xz(self):
+    """
+    Returns a file object with the decompressed contents of an xz file.
+    """
+    try:
+      import lzma
+    except ImportError:
+      try:
+        from backports import lzma
+      except ImportError:
+        lzma = None
+
+    if lzma != None:
+      xz_fh = lzma.LZMAFile(self.path, "rb")
+      self._files.append(xz_fh)
+      return xz_fh
+
+    self._process = subprocess.Popen(["xz", "--decompress", "--stdout",
+                                      self.path], stdout=subprocess.PIPE)
+    return self._process.stdout
+
+
+
+def original_trace_extension(trace):
+  """
+  Returns the extension that a copy of the original trace file needs:
+  ".gz" for the copies of traces in tar archives, the compression extension
+  for compressed traces and "" for plain traces.
+  """
+  if trace.in_archive:
+    return ".gz"
+  if trace.compression != None:
+    return "." + trace.compression
+  return ""
+
+
+
+def _iter_decompressed(chunks, new_decompressor):
+  """
+  Decompresses the blocks of a compressed file. A file may hold several
+  compressed streams one after the other (eg files written by pigz or
+  pbzip2).
+  """
+  decompressor = new_decompressor()
+  for chunk in chunks:
+    while chunk:
+      try:
+        data = decompressor.decompress(chunk)
+      except EOFError:
+        # the previous stream ended right at the end of the previous block.
+        decompressor = new_decompressor()
+        continue
+      if data:
+        yield data
+      chunk = decompressor.unused_data
+      if chunk:
+        decompressor = new_decompressor()
+
+  if hasattr(decompressor, "flush"):
+    data = decompressor.flush()
+    if data:
+      yield data
+
+
+
+def _copy_chunks(chunks, copy_fh):
+  for chunk in chunks:
+    copy_fh.write(chunk)
+    yield chunk
+
+
+
+def _iter_chunk_lines(chunks):
+  """
+  Splits blocks of data into lines, which end with "\\n" like the lines read
+  from a file.
+  """
+  rest = ""
+  for chunk in chunks:
+    lines = chunk.split("\n")
+    lines[0] = rest + lines[0]
+    rest = lines.pop()
+    for line in lines:
+      yield line + "\n"
+
+  if rest:
+    yield rest
@@ -0,0 +1,74 @@
+"""
+
+Test that the metadata of the model's file system is persisted as a snapshot
+plus a journal.  This program changes the file system, compacts the journal
+into a new generation and leaves a partly written record at its end.
+
+ut_lind_fs_journal_test.py restores the file system and checks it
+
+"""
+
+import os
+
+DIR_NAME = '/journaldir'
+FILE_NAME = DIR_NAME + '/file'
+LINK_NAME = DIR_NAME + '/link'
+UNLINKED_NAME = DIR_NAME + '/unlinked'
+AFTER_COMPACTION_NAME = '/aftercompaction'
+PARTIAL_NAME = '/partial'
+MESSAGE = 'hello journal!'
+
+
+
+if __name__ == '__main__':
+
+    from repyportability import *
+    _context = locals()
+    add_dy_support(_context)
+    dy_import_module_symbols("checkapi.repy")
+
+    _blank_fs_init()
+    journalname = _get_journal_filename(METADATAFILENAME, 0)
+
+    mkdir_syscall(DIR_NAME, ['S_IRWXU'])
+    assert(os.path.exists(journalname))
+
+    # the size change of a write is journaled by the next call that persists
+    myfd = open_syscall(FILE_NAME, ['O_CREAT', 'O_EXCL', 'O_RDWR'],
+                        ['S_IRWXU'])
+    assert(write_syscall(myfd, MESSAGE, len(MESSAGE)) == len(MESSAGE))
+    journalsize = os.path.getsize(journalname)
+    persist_metadata(METADATAFILENAME)
+    assert(os.path.getsize(journalname) > journalsize)
+    close_syscall(myfd)
+
+    link_syscall(FILE_NAME, LINK_NAME)
+
+    myfd = open_syscall(UNLINKED_NAME, ['O_CREAT', 'O_EXCL', 'O_RDWR'],
+                        ['S_IRWXU'])
+    close_syscall(myfd)
+    unlink_syscall(UNLINKED_NAME)
+
+    # grow the journal until it is compacted into the snapshot of generation
+    # 1, which removes the journal of generation 0.
+    count = 0
+    while metadatajournal['generation'] == 0:
+        mkdir_syscall('/compaction' + str(count), ['S_IRWXU'])
+        rmdir_syscall('/compaction' + str(count))
+        count += 1
+    assert(not os.path.exists(journalname))
+
+    journalname = _get_journal_filename(METADATAFILENAME, 1)
+    mkdir_syscall(AFTER_COMPACTION_NAME, ['S_IRWXU'])
+
+    # the record of the last mkdir is only partly written.
+    journalsize = os.path.getsize(journalname)
+    mkdir_syscall(PARTIAL_NAME, ['S_IRWXU'])
+    metadatajournal['fileobject'].close()
+    metadatajournal['fileobject'] = None
+    fh = open(journalname, 'rb')
+    journal = fh.read()
+    fh.close()
+    fh = open(journalname, 'wb')
+    fh.write(journal[:journalsize + (len(journal) - journalsize) // 2])
+    fh.close()
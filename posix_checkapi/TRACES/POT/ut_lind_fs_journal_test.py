@@ -0,0 +1,62 @@
+"""
+
+Test that the metadata of the model's file system is persisted as a snapshot
+plus a journal.  This program restores the file system from the snapshot of
+the newest generation and the records after it, and checks it.
+
+See ut_lind_fs_journal_setup.py for the changes made to the file system
+
+"""
+
+import os
+import sys
+from ut_lind_fs_journal_setup import *
+
+from repyportability import *
+_context = locals()
+add_dy_support(_context)
+dy_import_module_symbols("checkapi.repy")
+
+journalname = _get_journal_filename(METADATAFILENAME, 1)
+
+if not os.path.exists(journalname):
+  print "Must run ut_lind_fs_journal_setup.py first!!!"
+  sys.exit(1)
+
+restore_metadata(METADATAFILENAME)
+
+inodetable = filesystemmetadata['inodetable']
+rootdict = inodetable[ROOTDIRECTORYINODE]['filename_to_inode_dict']
+dirdict = inodetable[rootdict[DIR_NAME[1:]]]['filename_to_inode_dict']
+
+# mkdir, link and unlink were replayed...
+assert(dirdict['.'] == rootdict[DIR_NAME[1:]])
+assert(dirdict['..'] == ROOTDIRECTORYINODE)
+assert(dirdict['file'] == dirdict['link'])
+assert(inodetable[dirdict['file']]['linkcount'] == 2)
+assert('unlinked' not in dirdict)
+
+# ... and so was the size change of the write.
+assert(inodetable[dirdict['file']]['size'] == len(MESSAGE))
+
+# the directories made and removed to compact the journal are gone, and the
+# one made after the compaction is there.
+for name in rootdict:
+  assert(not name.startswith('compaction'))
+assert(AFTER_COMPACTION_NAME[1:] in rootdict)
+
+# the partly written record is left out, and the journal was compacted into
+# a new generation without it.
+assert(PARTIAL_NAME[1:] not in rootdict)
+assert(metadatajournal['generation'] == 2)
+assert(not os.path.exists(journalname))
+assert(os.path.exists(_get_journal_filename(METADATAFILENAME, 2)))
+
+# the restored file system keeps journaling.
+mkdir_syscall(PARTIAL_NAME, ['S_IRWXU'])
+assert(PARTIAL_NAME[1:] in rootdict)
+
+# remove the lind fs files.
+for fname in os.listdir(os.getcwd()):
+  if fname.startswith(METADATAFILENAME) or fname.startswith(FILEDATAPREFIX):
+    os.remove(fname)
@@ -0,0 +1,59 @@
+"""
+Test that iter_trace_parallel returns the same actions as iter_trace when the
+halves of unfinished system calls end up in different ranges of the trace,
+including ranges that have to be parsed again because an older unfinished
+half with the same pid and system call is still pending.
+
+"""
+
+import os
+import parser_strace_calls
+
+TRACE_FILENAME = "ut_parser_strace_chunks.strace"
+
+# parser_strace_calls parses a range again by reading it in this process.
+reparsed_ranges = []
+read_trace_chunk = parser_strace_calls._read_trace_chunk
+def _count_read_trace_chunk(trace_path, start, end):
+  reparsed_ranges.append((start, end))
+  return read_trace_chunk(trace_path, start, end)
+
+
+lines = []
+for index in range(40):
+  lines.extend([
+      '100 read(3, <unfinished ...>',
+      '101 dup(3 <unfinished ...>',
+      '102 write(1, "line %d\\n", 7) = 7' % index,
+      '101 <... dup resumed> ) = 4',
+      # another read of pid 100 is unfinished while the first one is pending.
+      '100 read(3, <unfinished ...>',
+      '102 close(5) = 0',
+      '100 <... read resumed> "abc", 10) = 3',
+      '101 close(4) = 0',
+      '100 <... read resumed> "de", 10) = 2'])
+
+fh = open(TRACE_FILENAME, "w")
+fh.write("\n".join(lines) + "\n")
+fh.close()
+
+fh = open(TRACE_FILENAME, "r")
+serial_actions = list(parser_strace_calls.iter_trace(fh, include_pids=True))
+fh.close()
+assert(len(serial_actions) == 40 * 6)
+
+parser_strace_calls._read_trace_chunk = _count_read_trace_chunk
+try:
+  for chunk_size in [37, 64, 100, 256, 1024, 4096]:
+    parser_strace_calls.PARALLEL_CHUNK_SIZE = chunk_size
+    for processes in [2, 3, 4]:
+      parallel_actions = list(parser_strace_calls.iter_trace_parallel(
+          TRACE_FILENAME, processes, include_pids=True))
+      assert(parallel_actions == serial_actions)
+finally:
+  parser_strace_calls._read_trace_chunk = read_trace_chunk
+
+# some of the ranges were parsed again.
+assert(len(reparsed_ranges) > 0)
+
+os.remove(TRACE_FILENAME)
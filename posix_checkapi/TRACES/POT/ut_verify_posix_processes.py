@@ -0,0 +1,50 @@
+"""
+Test that verify_trace_by_process verifies the actions of processes that do
+not share state in separate partitions, even when they use the same fd
+numbers, and that it finds the same errors as verifying the trace in a single
+process.
+
+"""
+
+import os
+import verify_posix
+
+LIBC = '/lib/libc.so'
+
+# the model file the processes read.
+verify_posix._blank_fs_init()
+verify_posix.mkdir_syscall('/lib', ['S_IRWXU'])
+fd = verify_posix.open_syscall(LIBC, ['O_CREAT', 'O_WRONLY'], ['S_IRWXU'])
+assert(verify_posix.write_syscall(fd, 'x' * 64, 64) == 64)
+verify_posix.close_syscall(fd)
+
+# the parent holds fd 3 while four children each open, read and close fd 4.
+pid_trace = [(100, ('open_syscall', (LIBC, ['O_RDONLY'], []), (3, None)))]
+for pid in [101, 102, 103, 104]:
+  pid_trace.append((pid, ('open_syscall', (LIBC, ['O_RDONLY'], []),
+                          (4, None))))
+  # the read of child 103 does not match the model.
+  read_retno = 10
+  if pid == 103:
+    read_retno = 9
+  pid_trace.append((pid, ('read_syscall', (4, 10), (read_retno, None))))
+  pid_trace.append((pid, ('close_syscall', (4,), (0, None))))
+pid_trace.append((100, ('read_syscall', (3, 10), (10, None))))
+pid_trace.append((100, ('close_syscall', (3,), (0, None))))
+
+partitions = verify_posix._partition_by_process(pid_trace)
+assert(len(partitions) == 5)
+
+# the workers of verify_trace_by_process are forked from this process, so
+# verify in parallel before the model state of this process changes.
+parallel_errors = verify_posix.verify_trace_by_process(pid_trace, 2)
+serial_errors = verify_posix.verify_pid_trace(pid_trace)
+
+assert(len(serial_errors) == 1)
+assert(serial_errors[0].startswith('9 ERROR: read_syscall'))
+assert(parallel_errors == serial_errors)
+
+# remove the lind fs files.
+for fname in os.listdir(os.getcwd()):
+  if fname.startswith('lind.metadata') or fname.startswith('linddata.'):
+    os.remove(fname)
@@ -0,0 +1,102 @@
+"""
+<Program>
+  benchmark_allocators.py
+
+<Purpose>
+  Stress benchmark for the allocators of the Lind model, which hand out the
+  lowest free fd, socket object id or port (see LowestFreeAllocator in
+  wrapped_lind_fs_calls.py). It opens the given number of descriptors and
+  then keeps closing a random one and opening a new one, timing the
+  allocator against the linear scan it replaced. The values both of them
+  hand out are checked to be the same.
+
+  Run it from the directory set up by setup.sh:
+
+    python benchmark_allocators.py [open descriptors] [iterations]
+"""
+
+import sys
+import time
+import random
+
+from repyportability import *
+_context = locals()
+add_dy_support(_context)
+
+dy_import_module_symbols("checkapi.repy")
+
+# the number of descriptors closed and opened again in each iteration.
+BATCH = 16
+
+
+
+def scan_allocate(values, inuse):
+  for value in values:
+    if value not in inuse:
+      return value
+  return None
+
+
+
+def churn(allocate, release, opened, iterations):
+  """
+  Opens opened values, and then keeps closing BATCH random values and 
+  opening as many again. One of the values closed is taken back directly, 
+  the way dup2 does. Returns the values handed out and the time taken.
+  """
+  inuse = {}
+  handedout = []
+  closeorder = random.Random(opened)
+
+  start = time.time()
+  for i in xrange(opened):
+    value = allocate(inuse)
+    inuse[value] = True
+  for i in xrange(iterations):
+    closed = closeorder.sample(inuse.keys(), BATCH)
+    for value in closed:
+      del inuse[value]
+      release(value)
+    inuse[closed[-1]] = True
+    for value in closed[:-1]:
+      value = allocate(inuse)
+      inuse[value] = True
+      handedout.append(value)
+  elapsed = time.time() - start
+
+  return handedout, elapsed
+
+
+
+if __name__ == "__main__":
+  opened = 10000
+  iterations = 1000
+  if len(sys.argv) > 1:
+    opened = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    iterations = int(sys.argv[2])
+
+  values = range(STARTINGFD, STARTINGFD + opened)
+
+  def allocate_scan(inuse):
+    return scan_allocate(values, inuse)
+  def release_scan(value):
+    pass
+  scanvalues, scantime = churn(allocate_scan, release_scan, opened, iterations)
+
+  allocators = []
+  def allocate_heap(inuse):
+    if not allocators:
+      allocators.append(LowestFreeAllocator(values, inuse))
+    return allocators[0].allocate()
+  def release_heap(value):
+    allocators[0].release(value)
+  heapvalues, heaptime = churn(allocate_heap, release_heap, opened, iterations)
+
+  assert(scanvalues == heapvalues)
+
+  calls = opened + iterations * (BATCH - 1)
+  print "%d open descriptors, %d close/open iterations" % (opened, iterations)
+  print "%-28s %8.3f usec/call" % ("linear scan", scantime * 1000000.0 / calls)
+  print "%-28s %8.3f usec/call" % ("LowestFreeAllocator",
+                                   heaptime * 1000000.0 / calls)
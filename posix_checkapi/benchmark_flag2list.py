@@ -0,0 +1,62 @@
+"""
+<Program>
+  benchmark_flag2list.py
+
+<Purpose>
+  Microbenchmark for the flag decoding done by fs_net_handler.repy. It times
+  flag2list on the kinds of arguments the model receives: lists of flags
+  (as produced by the parser), single numeric constants and numeric values
+  that do not match any constant. If the loaded fs_net_handler supports
+  namespaces, combinations of flags such as O_CREAT|O_TRUNC are timed as well.
+
+  Run it from the directory set up by setup.sh:
+
+    python benchmark_flag2list.py [iterations]
+"""
+
+import sys
+import time
+
+from repyportability import *
+_context = locals()
+add_dy_support(_context)
+
+dy_import_module_symbols("checkapi.repy")
+
+
+
+def time_calls(description, arguments, iterations):
+  start = time.time()
+  for i in xrange(iterations):
+    for argument in arguments:
+      flag2list(*argument)
+  elapsed = time.time() - start
+
+  calls = iterations * len(arguments)
+  print "%-28s %8.3f usec/call" % (description, elapsed * 1000000.0 / calls)
+
+
+
+if __name__ == "__main__":
+  iterations = 20000
+  if len(sys.argv) > 1:
+    iterations = int(sys.argv[1])
+
+  time_calls("list of flags",
+             [(['O_RDWR', 'O_CREAT'],), (['SOCK_STREAM'],), (['S_IRUSR'],)],
+             iterations)
+  time_calls("early constant",
+             [(SOCK_STREAM,), (AF_INET,), (IPPROTO_TCP,)], iterations)
+  time_calls("late constant",
+             [(F_GETLEASE,), (S_IFLNK,), (S_IFSOCK,)], iterations)
+  time_calls("unknown value", [(123456,), (0777777,)], iterations)
+
+  try:
+    flag2list(O_CREAT, 'open')
+  except TypeError:
+    print "namespaces are not supported by this fs_net_handler"
+  else:
+    time_calls("combined flags",
+               [(O_WRONLY | O_CREAT | O_TRUNC, 'open'),
+                (SOCK_STREAM | SOCK_NONBLOCK, 'socktype'),
+                (MSG_PEEK | MSG_WAITALL, 'msg')], iterations)
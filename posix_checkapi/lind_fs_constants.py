@@ -17,11 +17,7 @@ R_OK = 4
 O_RDONLY = 00
 O_WRONLY = 01
 O_RDWR = 02
-
-# we will use this to get the flags
-#O_RDWRFLAGS = O_RDONLY | O_WRONLY | O_RDWR
-# EG: added O_APPEND becasue I noticed that it's being returned in fcntl calls
-O_RDWRFLAGS = ['O_RDONLY', 'O_WRONLY', 'O_RDWR', 'O_APPEND']
+O_ACCMODE = 03
 
 O_CREAT = 0100
 O_EXCL = 0200
@@ -33,6 +29,11 @@ O_NONBLOCK = 04000
 O_SYNC = 010000
 # O_FSYNC=O_SYNC
 O_ASYNC = 020000
+O_CLOEXEC = 02000000
+
+# we will use this to get the flags
+# EG: added O_APPEND becasue I noticed that it's being returned in fcntl calls
+O_RDWRFLAGS = O_RDONLY | O_WRONLY | O_RDWR | O_APPEND
 
 S_IRWXA = 00777
 S_IRWXU = 00700
@@ -66,6 +67,7 @@ S_ISUID = 2048
 S_IREAD = 256
 S_ENFMT = 1024
 S_ISGID = 1024
+S_ISVTX = 512
 
 SEEK_SET = 0
 SEEK_CUR = 1
@@ -90,6 +92,10 @@ F_SETLEASE = 1024
 F_GETLEASE = 1025
 F_NOTIFY = 1026
 
+# for fcntl to manipulate file descriptor flags..   The model keeps them in
+# the 'fdflags' of fds, apart from the open flags.
+FD_CLOEXEC = 1
+
 # for the lock calls
 F_RDLCK = 0
 F_WRLCK = 1
@@ -158,31 +164,31 @@ DT_WHT = 14
 DEFAULT_METADATA_FILENAME = "lind.metadata"
 
 
-# some MACRO helpers...
+# some MACRO helpers...   Modes and flags are kept as numbers in the model.
 def IS_DIR(mode):
-  return 'S_IFDIR' in mode
+  return mode & S_FILETYPEFLAGS == S_IFDIR
 
 
 def IS_REG(mode):
-  return 'S_IFREG' in mode
+  return mode & S_FILETYPEFLAGS == S_IFREG
 
 
 def IS_CHR(mode):
-  return 'S_IFCHR' in mode
+  return mode & S_FILETYPEFLAGS == S_IFCHR
 
 
 def IS_SOCK(mode):
-  return 'S_IFSOCK' in mode
+  return mode & S_FILETYPEFLAGS == S_IFSOCK
 
 
 def IS_RDONLY(flags):
-  return 'O_RDONLY' in flags
+  return flags & O_ACCMODE == O_RDONLY
 
 
 def IS_WRONLY(flags):
-  return 'O_WRONLY' in flags
+  return flags & O_ACCMODE == O_WRONLY
 
 
 def IS_RDWR(flags):
-  return 'O_RDWR' in flags
+  return flags & O_ACCMODE == O_RDWR
 
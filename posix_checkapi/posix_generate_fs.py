@@ -7,6 +7,9 @@ from lind_fs_constants import *
 
 debug = False
 
+# Size of the chunks in which files are copied into the lind fs.
+LIND_COPY_CHUNK_SIZE = 1024 * 1024
+
 """
 This is the only public function of this module. It takes as argument
 a tuple of traces and and generates a lind fs based on the information
@@ -168,17 +171,20 @@ def _cp_file_into_lind(fullfilename, rootpath='.', createmissingdirs=True):
 
 
   # Okay, I have made the path now.   Only one thing remains, adding the file
-  posixfo = open(posixfn)
-  filecontents = posixfo.read()
-  posixfo.close()
 
   # make the new file, truncating any existing contents...
   lindfd = lind_test_server.open_syscall(normalizedlindfn, 
                 O_CREAT|O_EXCL|O_TRUNC|O_WRONLY, S_IRWXA)
 
-  # should write all at once...
-  datalen = lind_test_server.write_syscall(lindfd, filecontents)
-  assert(datalen == len(filecontents))
+  # copy the file chunk by chunk, so that it is never held in memory whole.
+  posixfo = open(posixfn)
+  while True:
+    filecontents = posixfo.read(LIND_COPY_CHUNK_SIZE)
+    if not filecontents:
+      break
+    datalen = lind_test_server.write_syscall(lindfd, filecontents)
+    assert(datalen == len(filecontents))
+  posixfo.close()
 
   lind_test_server.close_syscall(lindfd)
 
@@ -14,8 +14,14 @@
 
 """
 import os
-import tarfile
+import time
 import cPickle
+import tarfile
+import multiprocessing
+
+import trace_bundle
+import lind_blob_store
+import parser_helper_calls
 
 from repyportability import *
 _context = locals()
@@ -81,27 +87,116 @@ filepath_calls = ['statfs_syscall', 'access_syscall', 'link_syscall',
                   'mkdir_syscall', 'rmdir_syscall']
 
 
+# system calls that return a new file descriptor on success.
+fd_returning_calls = ['open_syscall', 'creat_syscall', 'socket_syscall', 
+                      'accept_syscall', 'dup_syscall', 'dup2_syscall']
+
+# system calls that change the file system state shared by all processes. 
+# open_syscall with O_CREAT or O_TRUNC and write_syscall on files also do.
+fs_modifying_calls = ['creat_syscall', 'link_syscall', 'unlink_syscall', 
+                      'chdir_syscall', 'mkdir_syscall', 'rmdir_syscall']
+
+
+# posix_fd_map and left_out_fds are keyed by (pid, implementation fd), since
+# different processes use the same fd numbers. fd_owners holds the pid that
+# last obtained each implementation fd. A process that uses an fd it did not
+# obtain itself (eg one inherited across fork) uses the one of that pid.
 posix_fd_map = {}
+fd_owners = {}
+# the implementation fds returned by the system calls left out by the
+# syscalls argument of verify_trace, until they are closed.
+left_out_fds = set()
 mycontext['posix_oracle'] = []
+# the model ignores the fds in ignore_fd. Implementation fds that are ignored
+# are mapped to negative numbers in ignore_fd, one per (pid, fd), so that they
+# are not ignored for the other processes.
+mycontext['last_ignored_fd'] = -1
+
+# the partitions verified by the worker processes of verify_trace_by_process.
+# Workers are forked from this process, so they inherit this list instead of
+# receiving the partitions through a pipe.
+_process_partitions = []
 
 DEBUG = False
 
+# verify_trace checkpoints its state every CHECKPOINT_ACTIONS actions or 
+# CHECKPOINT_SECONDS seconds, whichever comes first. The checkpoint of an
+# error file is kept next to it, in the error file name + CHECKPOINT_SUFFIX.
+CHECKPOINT_ACTIONS = 1000000
+CHECKPOINT_SECONDS = 300
+CHECKPOINT_SUFFIX = ".checkpoint"
+
 
 
-# Takes a list of actions in a trace and attempts to execute them in 
+# Takes an iterable of actions in a trace (a list, or a generator such as
+# parser_strace_calls.iter_trace) and attempts to execute them in
 # the posix model. We are also responsible for keeping track of
 # file-descriptor mappings since the implementation may use different
 # ones from us.
-def verify_trace(trace):
+#
+# first_line is the number of the first action in trace. It should be set when
+# verifying only part of a trace so that errors report the original numbers.
+#
+# If syscalls is given (eg "net"), only the actions of the selected system 
+# calls are verified (see parser_helper_calls.select_syscalls). Actions that
+# use a file descriptor the model does not know, because it was returned by a
+# system call that was left out, are ignored.
+#
+# If checkpoint_file is given, the state of the verification is written to it
+# from time to time (see _write_checkpoint), so that an interrupted 
+# verification can be resumed from there. errors holds the errors found 
+# before first_line when resuming.
+def verify_trace(trace, first_line=1, syscalls=None, checkpoint_file=None,
+                 errors=None):
+  numbered_trace = ((line_num, None, action) for line_num, action in 
+                    enumerate(trace, first_line))
+  return verify_numbered_trace(numbered_trace, syscalls, checkpoint_file, 
+                               errors)
+
+
+
+# Same as verify_trace, but takes an iterable of (pid, action) tuples, eg from
+# parser_strace_calls.iter_trace(fh, include_pids=True). The fds of each 
+# process are kept apart.
+def verify_pid_trace(pid_trace, first_line=1, syscalls=None, 
+                     checkpoint_file=None, errors=None):
+  numbered_trace = ((line_num, pid, action) for line_num, (pid, action) in 
+                    enumerate(pid_trace, first_line))
+  return verify_numbered_trace(numbered_trace, syscalls, checkpoint_file, 
+                               errors)
+
+
+
+# Same as verify_trace, but takes an iterable of (line_num, pid, action) 
+# tuples. pid is None if it is not known. The actions do not need to be 
+# consecutive.
+def verify_numbered_trace(numbered_trace, syscalls=None, checkpoint_file=None,
+                          errors=None):
+  syscalls = parser_helper_calls.select_syscalls(syscalls)
   
   # a list to hold all the errors occured during the verification step
-  ERRORS = []
-
-  # keep track of the number of actions read.
-  line_num = 0
-
-  for action in trace:
-    line_num += 1
+  if errors == None:
+    errors = []
+  ERRORS = errors
+
+  # the last action verified, and how many were verified since the last
+  # checkpoint was written and when.
+  last_line = None
+  checkpoint_actions = 0
+  checkpoint_time = time.time()
+
+  for line_num, pid, action in numbered_trace:
+
+    # every action before this one has been verified completely, so this is
+    # where a checkpoint can be taken.
+    if checkpoint_file != None:
+      if last_line != None and (checkpoint_actions >= CHECKPOINT_ACTIONS or
+          time.time() - checkpoint_time >= CHECKPOINT_SECONDS):
+        _write_checkpoint(checkpoint_file, last_line, syscalls, ERRORS)
+        checkpoint_actions = 0
+        checkpoint_time = time.time()
+      checkpoint_actions += 1
+      last_line = line_num
 
     if DEBUG:
       print str(line_num) + ": " + _short_string(action)
@@ -112,6 +207,28 @@ def verify_trace(trace):
     syscall_name, syscall_args, syscall_return = action
     syscall_retno, syscall_errno = syscall_return
 
+    if syscalls != None:
+      # skip the system calls that were not selected, but keep track of the
+      # fds they return.
+      if syscall_name[:-len("_syscall")] not in syscalls:
+        _track_left_out_fds(pid, syscall_name, syscall_args, syscall_retno)
+        continue
+
+      # the fds returned by the system calls left out are unknown to the 
+      # model.
+      if (syscall_name in fd_calls and 
+          _fd_key(pid, syscall_args[0]) in left_out_fds):
+        print "IGNORING:", _short_string(action), \
+              ", because its fd was returned by a system call left out"
+        if syscall_name == 'close_syscall':
+          left_out_fds.discard(_fd_key(pid, syscall_args[0]))
+        continue
+
+      # a selected system call may return the number of a left out fd that
+      # was closed without us seeing it.
+      if syscall_name in fd_returning_calls:
+        left_out_fds.discard((pid, syscall_retno))
+
     # if syscall_retno has an unexpected value print a warning and set
     # it to -1, indicating the action returned an error.
     if syscall_retno < -1:
@@ -130,16 +247,25 @@ def verify_trace(trace):
       continue
 
     # if the system call has a fd argument, replace the action fd
-    # with the model fd.
+    # with the model fd. Errors report the fds of the trace, since the model
+    # fds depend on the other processes verified along with this one.
+    trace_args = syscall_args
     if syscall_name in fd_calls:
       if syscall_name == "dup2_syscall":
         # dup2 has two file descriptors. Deal with both.
-        model_fd1 = _translate_fd(syscall_args[0])
-        model_fd2 = _translate_fd(syscall_args[1])
+        model_fd1 = _translate_fd(pid, syscall_args[0])
+        model_fd2 = posix_fd_map.get((pid, syscall_args[1]))
+        # if the new fd is not open in the model for this process, dup2 to a
+        # free model fd. Any other model fd may belong to another process.
+        if model_fd2 not in filedescriptortable:
+          # an ignored new fd is closed by dup2.
+          if model_fd2 in ignore_fd and syscall_retno != -1:
+            ignore_fd.remove(model_fd2)
+          model_fd2 = get_next_fd()
         # replace both fd with the new ones.
         syscall_args = (model_fd1, model_fd2)
       else:
-        model_fd = _translate_fd(syscall_args[0])
+        model_fd = _translate_fd(pid, syscall_args[0])
         # replace fd in args with the new one.
         syscall_args = (model_fd,) + syscall_args[1:]
       
@@ -147,6 +273,8 @@ def verify_trace(trace):
       action = (syscall_name, syscall_args, syscall_return)
     
     model_errno = None
+    # the model adds the implementation fds it starts to ignore to ignore_fd.
+    ignored_count = len(ignore_fd)
     try:
       mycontext['posix_oracle'].append((syscall_retno, syscall_errno))
       # Execute the system call using the model.
@@ -157,6 +285,7 @@ def verify_trace(trace):
     # note of it and continue
     except UnimplementedError, err:
       print 'UnimplmentedError Not Supported!', err, ' : ', action
+      _ignore_new_fds(pid, ignored_count)
       continue
 
     except SyscallError, err:
@@ -174,6 +303,7 @@ def verify_trace(trace):
     # information and continue
     except IgnoredFileDescriptorWarning, err:
       print "IGNORING: ", err[1]
+      _ignore_new_fds(pid, ignored_count)
       continue
 
 
@@ -204,14 +334,7 @@ def verify_trace(trace):
 
         # EG: I have no other option but to use the ignore_fd here, 
         # because the verifier only should check the return value
-        ignore_fd.append(syscall_retno)
-
-        #EG: remove any mapping between model and impl fd, even if the 
-        # syscalls fail
-        try:
-          posix_fd_map.remove(syscall_retno)
-        except:
-          pass
+        ignore_fd.append(_ignore_fd(pid, syscall_retno))
 
         continue
     
@@ -222,7 +345,8 @@ def verify_trace(trace):
     if (syscall_name in ['socket_syscall', 'open_syscall', 
         'creat_syscall', 'dup_syscall', 'dup2_syscall'] and 
         syscall_retno != -1):
-      posix_fd_map[syscall_retno] = model_retno
+      posix_fd_map[(pid, syscall_retno)] = model_retno
+      fd_owners[syscall_retno] = pid
       model_retno = syscall_retno
 
     # SS: Examle of accept action:
@@ -233,7 +357,8 @@ def verify_trace(trace):
       # check if ip addrs and ports match
       if (model_retno[0] == syscall_errno[2] and 
           model_retno[1] == syscall_errno[1]):
-        posix_fd_map[syscall_retno] = model_retno[2]
+        posix_fd_map[(pid, syscall_retno)] = model_retno[2]
+        fd_owners[syscall_retno] = pid
         model_retno = syscall_retno
         
 
@@ -283,11 +408,11 @@ def verify_trace(trace):
     
     elif syscall_retno != model_retno or syscall_errno != model_errno:
       print line_num, "ERROR:", syscall_name, \
-            _short_string(syscall_args), ' -> ', \
+            _short_string(trace_args), ' -> ', \
             _short_string((syscall_retno, syscall_errno)), "  ", \
             _short_string((model_retno, model_errno))
       ERRORS.append(str(line_num) + " ERROR: " + 
-                    syscall_name + _short_string(syscall_args) + ' -> ' + 
+                    syscall_name + _short_string(trace_args) + ' -> ' + 
                     _short_string((syscall_retno, syscall_errno)) + "  " + 
                     _short_string((model_retno, model_errno)))
 
@@ -302,6 +427,170 @@ def verify_trace(trace):
 
 
 
+# Verifies a trace gathered from several processes (eg with strace -f) using 
+# a pool of worker processes. pid_trace is an iterable of (pid, action) tuples.
+#
+# The fds of each process are kept apart (see posix_fd_map), but the model 
+# keeps a single current directory, file system and network state for the 
+# whole trace, and a process may use the fds of another one (eg after fork).
+# The actions are therefore partitioned by pid, and the partitions of any two
+# processes that share state are merged. Each remaining partition is verified
+# by a worker with its own copy of the model, and the errors of all partitions
+# are merged and ordered by line number. The result is the same ERRORS list 
+# verify_pid_trace returns for the whole trace. If everything ends up in a 
+# single partition the trace is simply verified in this process.
+#
+# All the actions are kept in memory while they are partitioned. syscalls 
+# restricts the actions verified like in verify_trace, and the actions left 
+# out do not affect the partitions.
+def verify_trace_by_process(pid_trace, processes=None, syscalls=None):
+  syscalls = parser_helper_calls.select_syscalls(syscalls)
+  partitions = _partition_by_process(pid_trace, syscalls)
+
+  # verified in this process, the actions must be in trace order again.
+  if len(partitions) <= 1 or processes == 1:
+    numbered_trace = [numbered_action for partition in partitions
+                      for numbered_action in partition]
+    numbered_trace.sort(key=lambda numbered_action: numbered_action[0])
+    return verify_numbered_trace(numbered_trace, syscalls)
+
+  # each worker handles a single partition and exits, so every partition is 
+  # verified with a model state that is fresh from this process.
+  _process_partitions[:] = partitions
+  pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+  try:
+    partition_errors = pool.map(_verify_partition, 
+                                [(partition_index, syscalls) for 
+                                 partition_index in range(len(partitions))], 1)
+  finally:
+    pool.close()
+    pool.join()
+    _process_partitions[:] = []
+
+  ERRORS = []
+  for errors in partition_errors:
+    ERRORS.extend(errors)
+
+  # every error starts with the line number of its action.
+  ERRORS.sort(key=lambda error: int(error[:error.find(" ")]))
+  return ERRORS
+
+
+
+def _verify_partition(partition_args):
+  partition_index, syscalls = partition_args
+  # the workers would all append to the same lind fs metadata journal.
+  metadatajournal['enabled'] = False
+  return verify_numbered_trace(_process_partitions[partition_index], syscalls)
+
+
+
+# Splits (pid, action) tuples into lists of (line_num, pid, action) tuples 
+# that can be verified independently of each other. Two processes end up in 
+# the same partition if:
+#   - one uses a file descriptor obtained by the other (eg after fork).
+#   - they both use the file system and some process changes it (creates,
+#     removes or writes files, or changes the current directory).
+#   - they both use the network.
+# The partitions are returned largest first. If syscalls is a set of system 
+# call names, the actions of other system calls are left out of the 
+# partitions, but keep their line numbers.
+def _partition_by_process(pid_trace, syscalls=None):
+  # union-find over the pids.
+  parent = {}
+  def find(pid):
+    parent.setdefault(pid, pid)
+    while parent[pid] != pid:
+      parent[pid] = parent[parent[pid]]
+      pid = parent[pid]
+    return pid
+  def union(pid1, pid2):
+    parent[find(pid1)] = find(pid2)
+
+  numbered_trace = []
+
+  # fds currently held by each pid, and the pid that last obtained each fd.
+  held_fds = {}
+  fd_owner = {}
+  # whether the fd of a pid refers to a file, keyed by (pid, fd).
+  fd_is_file = {}
+
+  fs_pids = set()
+  fs_modified = False
+  net_pids = set()
+
+  line_num = 0
+  for pid, action in pid_trace:
+    line_num += 1
+    if syscalls != None and action[0][:-len("_syscall")] not in syscalls:
+      continue
+    numbered_trace.append((line_num, pid, action))
+    find(pid)
+
+    syscall_name, syscall_args, syscall_return = action
+    syscall_retno = syscall_return[0]
+    pid_fds = held_fds.setdefault(pid, set())
+
+    # the (pid, fd) of the fd used by the action.
+    fd_key = None
+    if syscall_name in fd_calls:
+      fd = syscall_args[0]
+      fd_key = (pid, fd)
+      if fd not in pid_fds and fd_owner.get(fd, pid) != pid:
+        union(pid, fd_owner[fd])
+        fd_key = (fd_owner[fd], fd)
+
+    if syscall_name in net_syscall_map:
+      net_pids.add(pid)
+
+    if (syscall_name in filepath_calls or 
+        syscall_name in ['open_syscall', 'creat_syscall']):
+      fs_pids.add(pid)
+    if syscall_name in fs_modifying_calls:
+      fs_modified = True
+    if (syscall_name == 'open_syscall' and isinstance(syscall_args[1], list) and
+        ('O_CREAT' in syscall_args[1] or 'O_TRUNC' in syscall_args[1])):
+      fs_modified = True
+    if syscall_name == 'write_syscall' and fd_is_file.get(fd_key):
+      fs_pids.add(pid)
+      fs_modified = True
+
+    if syscall_retno == -1 or not isinstance(syscall_retno, (int, long)):
+      continue
+
+    # the action obtained a new fd.
+    if (syscall_name in fd_returning_calls or 
+        (syscall_name == 'fcntl_syscall' and 
+         isinstance(syscall_args[1], list) and 'F_DUPFD' in syscall_args[1])):
+      if syscall_name in ['open_syscall', 'creat_syscall']:
+        fd_is_file[(pid, syscall_retno)] = True
+      elif syscall_name in ['socket_syscall', 'accept_syscall']:
+        fd_is_file[(pid, syscall_retno)] = False
+      else:
+        fd_is_file[(pid, syscall_retno)] = fd_is_file.get(fd_key, False)
+
+      pid_fds.add(syscall_retno)
+      fd_owner[syscall_retno] = pid
+
+    elif syscall_name == 'close_syscall':
+      pid_fds.discard(syscall_args[0])
+
+  if fs_modified:
+    for pid in fs_pids:
+      union(pid, iter(fs_pids).next())
+  for pid in net_pids:
+    union(pid, iter(net_pids).next())
+
+  partitions = {}
+  for numbered_action in numbered_trace:
+    partitions.setdefault(find(numbered_action[1]), []).append(numbered_action)
+
+  return sorted(partitions.values(), key=len, reverse=True)
+
+
+
+
+
 ####################
 # Helper Functions #
 ####################
@@ -316,15 +605,150 @@ def _short_string(data, length=800):
   return data_short
 
 
-# Returns the corresponding fd that the model uses, if it's different
-# from what the implementations uses.
-def _translate_fd(impl_fd):
-  if impl_fd in posix_fd_map:
-    return posix_fd_map[impl_fd]
-  return impl_fd
+# Returns whether any of the selected system calls takes a file path, and so 
+# needs the lind fs.
+def _uses_file_paths(syscalls):
+  syscalls = parser_helper_calls.select_syscalls(syscalls)
+  if syscalls == None:
+    return True
+
+  for syscall_name in filepath_calls + ['open_syscall', 'creat_syscall']:
+    if syscall_name[:-len("_syscall")] in syscalls:
+      return True
+  return False
+
+
+# Writes a checkpoint of the verification after the action line_num to
+# checkpoint_file: the fd translation map, the oracle, the errors found so 
+# far, and the state of the lind fs, the network calls and the model.
+# The checkpoint is written to a temporary file first and then renamed, so
+# checkpoint_file always holds a complete checkpoint.
+def _write_checkpoint(checkpoint_file, line_num, syscalls, errors):
+  checkpoint = {'line_num': line_num,
+                'syscalls': syscalls,
+                'posix_fd_map': posix_fd_map,
+                'fd_owners': fd_owners,
+                'left_out_fds': left_out_fds,
+                'last_ignored_fd': mycontext['last_ignored_fd'],
+                'posix_oracle': mycontext['posix_oracle'],
+                'errors': errors,
+                'fs': checkpoint_fs_state(),
+                'net': checkpoint_net_state(),
+                'model': model_state_checkpoint()}
+
+  temp_file = checkpoint_file + ".tmp"
+  fh = open(temp_file, "wb")
+  cPickle.dump(checkpoint, fh, cPickle.HIGHEST_PROTOCOL)
+  fh.flush()
+  os.fsync(fh.fileno())
+  fh.close()
+  os.rename(temp_file, checkpoint_file)
+
 
+# Reads the checkpoint written to checkpoint_file by _write_checkpoint.
+def _read_checkpoint(checkpoint_file):
+  if not os.path.exists(checkpoint_file):
+    raise Exception("There is no checkpoint to resume from in " + 
+                    checkpoint_file + ".")
 
-def _unbundle_trace(bundle_name):
+  fh = open(checkpoint_file, "rb")
+  checkpoint = cPickle.load(fh)
+  fh.close()
+  return checkpoint
+
+
+# Puts the state saved in a checkpoint back and returns the errors found 
+# before it. The lind fs of the trace bundle must have been loaded already,
+# since the contents of the files that were never read are not in the
+# checkpoint.
+def _resume_checkpoint(checkpoint):
+  posix_fd_map.clear()
+  posix_fd_map.update(checkpoint['posix_fd_map'])
+  fd_owners.clear()
+  fd_owners.update(checkpoint['fd_owners'])
+  left_out_fds.clear()
+  left_out_fds.update(checkpoint['left_out_fds'])
+  mycontext['last_ignored_fd'] = checkpoint['last_ignored_fd']
+  mycontext['posix_oracle'][:] = checkpoint['posix_oracle']
+  model_state_resume(checkpoint['model'])
+  resume_fs_state(checkpoint['fs'])
+  resume_net_state(checkpoint['net'])
+  return checkpoint['errors']
+
+
+# Keeps left_out_fds up to date for an action of a system call that was left
+# out of the verification: the fds it returns are added, and an fd it closes
+# is removed.
+def _track_left_out_fds(pid, syscall_name, syscall_args, syscall_retno):
+  if syscall_name == 'close_syscall':
+    left_out_fds.discard(_fd_key(pid, syscall_args[0]))
+    return
+
+  if syscall_retno == -1 or not isinstance(syscall_retno, (int, long)):
+    return
+
+  if (syscall_name in fd_returning_calls or 
+      (syscall_name == 'fcntl_syscall' and 
+       isinstance(syscall_args[1], list) and 'F_DUPFD' in syscall_args[1])):
+    left_out_fds.add((pid, syscall_retno))
+    fd_owners[syscall_retno] = pid
+
+
+# Returns the (pid, fd) key of posix_fd_map and left_out_fds for the fd impl_fd
+# used by the process pid.
+def _fd_key(pid, impl_fd):
+  fd_key = (pid, impl_fd)
+  if fd_key in posix_fd_map or fd_key in left_out_fds:
+    return fd_key
+  # the process did not obtain this fd itself, eg it was inherited.
+  return (fd_owners.get(impl_fd, pid), impl_fd)
+
+
+# Returns the corresponding fd that the model uses, if it's different
+# from what the implementations uses.
+def _translate_fd(pid, impl_fd):
+  return posix_fd_map.get(_fd_key(pid, impl_fd), impl_fd)
+
+
+# Maps the fd impl_fd of the process pid to a new ignored fd and returns it.
+# The caller adds it to ignore_fd.
+def _ignore_fd(pid, impl_fd):
+  mycontext['last_ignored_fd'] -= 1
+  posix_fd_map[(pid, impl_fd)] = mycontext['last_ignored_fd']
+  fd_owners[impl_fd] = pid
+  return mycontext['last_ignored_fd']
+
+
+# Replaces the implementation fds the model added to ignore_fd since it held
+# ignored_count fds with ignored fds of the process pid.
+def _ignore_new_fds(pid, ignored_count):
+  for index in range(ignored_count, len(ignore_fd)):
+    ignore_fd[index] = _ignore_fd(pid, ignore_fd[index])
+
+
+# Extracts the lind fs files of the bundle and returns an iterator over the
+# actions numbered first_line to last_line (inclusive) of the trace. The actions
+# are read straight from the bundle without being extracted. In version 2 
+# bundles they are decoded one chunk at a time as the iterator is consumed, and
+# chunks outside the requested range are skipped. Version 1 bundles, which
+# hold a single actions.pickle, are loaded whole.
+#
+# If include_pids is True, the iterator returns (pid, action) tuples instead.
+# If syscalls leaves out all the system calls that take a file path (eg 
+# syscalls="net"), the bundle does not need to hold a lind fs.
+#
+# Bundles whose lind fs data files are kept in a blob store hold a lind.blobs
+# manifest instead, and the data files are copied from the blob store at the
+# path blob_store (see lind_blob_store.py).
+#
+# The lind fs is then loaded into the model, which only reads the data of a
+# file in when the trace first uses it. Lazy bundles hold no data files at 
+# all (see parser.py). The data of their files is read from the blob store, 
+# or else from snapshot_dir, a copy of the file system the trace was gathered
+# on.
+def _unbundle_trace(bundle_name, first_line=1, last_line=None, 
+                    include_pids=False, syscalls=None, blob_store=None,
+                    snapshot_dir=None):
   # first, check if the trace_bundle exists and is of the expected
   # format
   if not tarfile.is_tarfile(bundle_name):
@@ -336,29 +760,17 @@ def _unbundle_trace(bundle_name):
   bundle_tar = tarfile.open(bundle_name)
   tar_files = bundle_tar.getnames()
   
-  # there should be a file called "trace.pickle" containing the 
-  # serialized traces tuple
-  pickle_name = "actions.pickle"
-  if pickle_name in tar_files:
-    # extract the file
-    bundle_tar.extract(pickle_name)
-
-    # open the file and load its contents
-    pickle_file = open(pickle_name, 'r')
-    traces = cPickle.load(pickle_file)
-    pickle_file.close()
-
-    # remove the pickle file
-    os.remove(pickle_name)
-  else:
-    raise Exception("Trace pickle file not found in the tarfile.")
+  # there should be a file containing the serialized actions, either
+  # actions.chunks or actions.pickle.
+  traces = trace_bundle.iter_bundle_actions(bundle_tar, first_line, last_line,
+                                            include_pids)
 
   # extract the lind fs metadata file
   lind_meta = "lind.metadata"
   if lind_meta in tar_files:
     # extract the file
     bundle_tar.extract(lind_meta)
-  else:
+  elif _uses_file_paths(syscalls):
     raise Exception("Lind metadata file not found in the tarfile.")
 
   # exctract all the lind fs data files.
@@ -366,6 +778,30 @@ def _unbundle_trace(bundle_name):
     if fname.startswith("linddata."):
       bundle_tar.extract(fname)
 
+  if blob_store != None:
+    blob_store = lind_blob_store.BlobStore(blob_store)
+
+  if lind_blob_store.MANIFEST_NAME in tar_files:
+    if blob_store == None:
+      raise Exception("The lind fs files of the bundle are kept in a blob " +
+                      "store. Give its path with --blob-store=DIR.")
+    bundle_tar.extract(lind_blob_store.MANIFEST_NAME)
+    lind_blob_store.materialize_manifest(lind_blob_store.MANIFEST_NAME, 
+                                         blob_store)
+
+  # the journals of an earlier, interrupted verification would be replayed 
+  # on top of the extracted metadata.
+  for fname in os.listdir(os.getcwd()):
+    if fname.startswith(lind_meta + METADATAJOURNALSUFFIX):
+      os.remove(fname)
+
+  if lind_meta in tar_files:
+    content_reader = None
+    if blob_store != None or snapshot_dir != None:
+      content_reader = lambda contentref: lind_blob_store.read_contents(
+          contentref, blob_store, snapshot_dir)
+    load_fs(lind_meta, content_reader)
+
   return traces
 
 
@@ -375,22 +811,89 @@ def _unbundle_trace(bundle_name):
 
 
 if __name__ == "__main__":
+  usage = ("Usage: " + sys.argv[0] + 
+           " [--processes=N] [--syscalls=fs|net|NAME,...]" 
+           " [--blob-store=DIR] [--snapshot-dir=DIR]"
+           " [--checkpoint-actions=N] [--checkpoint-seconds=T] [--resume]"
+           " <trace bundle> <error file>")
+
+  # options start with '--', everything else is an argument.
+  options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+  arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+  # verify the actions of different processes in parallel, using this many
+  # worker processes. 0 uses as many workers as there are cores.
+  processes = None
+  # verify only these system calls or classes of system calls.
+  syscalls = None
+  # the blob store holding the lind fs files of the bundle, if any.
+  blob_store = None
+  # a copy of the file system the trace was gathered on, for lazy bundles.
+  snapshot_dir = None
+  # continue from the checkpoint of the error file, if verifying in a single
+  # process.
+  resume = False
+  for option in options:
+    if option.startswith("--processes="):
+      processes = int(option[len("--processes="):]) or None
+      if processes is None:
+        processes = multiprocessing.cpu_count()
+    elif option.startswith("--syscalls="):
+      syscalls = parser_helper_calls.select_syscalls(
+          option[len("--syscalls="):])
+    elif option.startswith("--blob-store="):
+      blob_store = option[len("--blob-store="):]
+    elif option.startswith("--snapshot-dir="):
+      snapshot_dir = option[len("--snapshot-dir="):]
+    elif option.startswith("--checkpoint-actions="):
+      CHECKPOINT_ACTIONS = int(option[len("--checkpoint-actions="):])
+    elif option.startswith("--checkpoint-seconds="):
+      CHECKPOINT_SECONDS = float(option[len("--checkpoint-seconds="):])
+    elif option == "--resume":
+      resume = True
+    else:
+      raise Exception("Unknown option " + option + ". " + usage)
+
   # we need exactly 2 arguments.
-  if len(sys.argv) != 3:
-    raise Exception("Too few command line arguments. Usage: " +
-                    sys.argv[0] + " <trace bundle> <error file>")
+  if len(arguments) != 2:
+    raise Exception("Too few command line arguments. " + usage)
   
   # add working directory to the path for module imports
   sys.path.append(os.path.dirname(__file__))
   
   # unbundle the trace bundle to get the traces.
-  bundle_name = sys.argv[1]
-  traces = _unbundle_trace(bundle_name)
+  bundle_name = arguments[0]
+  error_file = arguments[1]
+  checkpoint_file = error_file + CHECKPOINT_SUFFIX
 
   # run checkAPI
-  errors = verify_trace(traces)
-  
-  error_file = sys.argv[2]
+  if processes is None:
+    first_line = 1
+    checkpoint = None
+    if resume:
+      checkpoint = _read_checkpoint(checkpoint_file)
+      if checkpoint['syscalls'] != syscalls:
+        raise Exception("The checkpoint was taken verifying other system " +
+                        "calls. Resume with the same --syscalls option.")
+      first_line = checkpoint['line_num'] + 1
+      print "Resuming from action", first_line
+
+    traces = _unbundle_trace(bundle_name, first_line, include_pids=True,
+                             syscalls=syscalls, blob_store=blob_store, 
+                             snapshot_dir=snapshot_dir)
+    errors = None
+    if checkpoint != None:
+      errors = _resume_checkpoint(checkpoint)
+    errors = verify_pid_trace(traces, first_line, syscalls, checkpoint_file, 
+                              errors)
+  else:
+    if resume:
+      raise Exception("Only verifications in a single process can be " +
+                      "resumed. " + usage)
+    traces = _unbundle_trace(bundle_name, include_pids=True, 
+                             syscalls=syscalls, blob_store=blob_store,
+                             snapshot_dir=snapshot_dir)
+    errors = verify_trace_by_process(traces, processes, syscalls)
 
   # write all errors to the error file.
   fh = open(error_file, "w")
@@ -406,8 +909,16 @@ if __name__ == "__main__":
 
   print str(numLines) + " error(s)..."
 
+  # the verification is complete, so its checkpoint is not needed anymore.
+  if os.path.exists(checkpoint_file):
+    os.remove(checkpoint_file)
+
   # remove all lind fs files.
-  os.remove("lind.metadata")
+  if os.path.exists("lind.metadata"):
+    os.remove("lind.metadata")
+  if os.path.exists(lind_blob_store.MANIFEST_NAME):
+    os.remove(lind_blob_store.MANIFEST_NAME)
   for fname in os.listdir(os.getcwd()):
-    if fname.startswith("linddata."):
+    if (fname.startswith("linddata.") or 
+        fname.startswith("lind.metadata" + METADATAJOURNALSUFFIX)):
       os.remove(fname)
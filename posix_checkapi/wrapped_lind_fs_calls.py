@@ -87,12 +87,19 @@ dy_import_module_symbols("parser_intermediate_representation.py")
 #   7) Open file objects are kept in a separate table, the fileobjecttable that
 #      is keyed by inode.  This makes it easier to support multiple open file 
 #      descriptors that point to the same file. 
+#   8) The entries of directories that are read are kept in order in the 
+#      direntrytable, which is keyed by inode.   getdents and lseek use slots
+#      in it as the positions of directory file descriptors.
+#   9) The data of the files of a loaded file system is only read in when a
+#      call first uses it.   Files generated lazily have no data file at all.
+#      Their metadata holds a 'contentref' instead, which is handed to the
+#      contentreader given to load_fs to get the data.
 #
-# BUG: I created a table which allows one to look up an "inode"
-#      given a filename.   It will break certain things in certain weird corner
-#      cases with dir symlinks, permissions, etc.   However, it will make the
-#      code simpler and faster
-#   I called it: fastinodelookuptable = {}
+# Paths are looked up by walking the directories from the root, one
+#   filename_to_inode_dict lookup per path component (see _get_inode).   The
+#   directories form a trie of path components, so a lookup takes as many
+#   steps as the path is deep and the parent of a path is one step less.
+#   Normalized paths are cached (see _get_path_components).
 #
 #   As with Linux, etc. there is a 'current directory' that calls which take a 
 #      filename use as the first part of their path.   All other filenames that
@@ -151,6 +158,21 @@ dy_import_module_symbols("parser_intermediate_representation.py")
 #                       'dev_id':20,        # the device ID returned to stat
 #                       'inodetable': {...} # described above
 #
+# This dict is written to METADATAFILENAME when a file system is made.   After
+# that, only the changes made by each call are written out, to a journal 
+# that is kept next to it.   The journal of generation 0 starts from the 
+# metadata in METADATAFILENAME.   The journals of later generations start with
+# a record that holds all of the metadata (a snapshot), and the journal of the
+# previous generation is removed once that record is written.   The other 
+# records look like this:
+#
+# {'nextinode':1204,
+#  'inodes': {1201:{'size':0, ...}, # an inode's entry, without its 
+#                                   # filename_to_inode_dict...
+#             1170:None},           # ... or None if it was removed
+#  'direntries': [(10, 'foo', 1201),   # (dir inode, filename, inode) ...
+#                 (10, 'bar', None)]}  # ... or None if it was removed
+#
 
 # Store all of the information about the file system in a dict...
 # This should not be 0 because this is considered to be deleted
@@ -166,15 +188,45 @@ filesystemmetadata = {}
 filesystemmetadatalock = createlock()
 
 
-# fast lookup table...   (Should I deprecate this?)
-fastinodelookuptable = {}
+# the paths normalized most recently, split into their components.   Keyed 
+# by path for absolute paths and by (currentworkingdirectory, path) for 
+# relative ones.   Once the 'recent' generation holds PATH_CACHE_SIZE paths,
+# it becomes the 'old' one, and old paths that are used again move back, so
+# the paths used least recently are the ones dropped.
+PATH_CACHE_SIZE = 4096
+pathcache = {'recent':{}, 'old':{}}
 
 # contains open file descriptor information... (keyed by fd)
 filedescriptortable = {}
 
+# contains the set of fds open on each inode... (keyed by inode)   Sockets 
+# have no inode, so they are not in here.
+inodefdtable = {}
+
 # contains file objects... (keyed by inode)
 fileobjecttable = {}
 
+# contains the entries of directories in a fixed order (keyed by inode).   
+# Each value has a 'slots' list of entry names, in which removed entries 
+# leave a None tombstone behind, a 'slotofname' dict that maps each name to 
+# its slot, and the 'tombstones' count.   The position of a directory fd is a
+# slot number, so getdents and lseek neither skip nor repeat entries when
+# entries are added or removed in between.   A directory only gets an entry
+# here once it is read.
+direntrytable = {}
+
+# the metadata is persisted as a snapshot followed by a journal.   Every call
+# that changes the metadata appends a record of the inodes and directory 
+# entries it changed to the journal (see persist_metadata).   'inodes' and 
+# 'direntries' hold the changes that are not in the journal yet.   Once the
+# journal has grown bigger than the snapshot, the metadata is compacted into
+# a new snapshot, which starts the journal of the next 'generation'.
+METADATAJOURNALSUFFIX = '.journal.'
+JOURNAL_MINIMUM_SIZE = 65536
+metadatajournal = {'enabled':True, 'generation':0, 'fileobject':None, 
+                   'size':0, 'snapshotsize':0, 'inodes':set(), 
+                   'direntries':[]}
+
 # I use this so that I can assign to a global string (currentworkingdirectory)
 # without using global, which is blocked by RepyV2
 fs_calls_context = {}
@@ -202,19 +254,24 @@ class IgnoredFileDescriptorWarning(Warning):
 
 
 
-def load_fs(name=METADATAFILENAME):
+def load_fs(name=METADATAFILENAME, contentreader=None):
   """ Help to correcly load a filesystem, if one exists, otherwise
   make a new empty one.  To do this, check if metadata exists.
   If it doesnt, call _blank_fs_init, if it DOES exist call restore_metadata
 
   This is the best entry point for programs loading the file subsystem.
+
+  The files of a loaded filesystem are added to the model, but their data is
+  only read in when it is first used.   contentreader is called with the 
+  'contentref' of files that have no data file (see generate_lind_fs.py) 
+  and returns their data.
   """
   try:
     # lets see if the metadata file is already here?
     f = openfile(name, False)
   except FileNotFoundError, e:
     print "Note: No filesystem found, building a fresh one."
-    _blank_fs_init()
+    _blank_fs_init(name)
   else:
     f.close()
     try:
@@ -222,18 +279,64 @@ def load_fs(name=METADATAFILENAME):
     except (IndexError, KeyError), e:
       print "Error: Cannot reload filesystem.  Run lind_fsck for details."
       exitall(1)
+    _add_initial_files(contentreader)
+
+
+
+def _add_initial_files(contentreader):
+  # the data files that are around...
+  datafilenames = set(listfiles())
+
+  for inode in filesystemmetadata['inodetable']:
+    inodeentry = filesystemmetadata['inodetable'][inode]
+    if not IS_REG(inodeentry['mode']):
+      continue
+
+    if 'contentref' in inodeentry:
+      if contentreader == None:
+        raise Exception("The filesystem only references the data of its " +
+                        "files, and no contentreader was given to read it.")
+      loader = _contentref_loader(contentreader, inodeentry['contentref'])
+    elif FILEDATAPREFIX+str(inode) in datafilenames:
+      loader = _datafile_loader(FILEDATAPREFIX+str(inode))
+    else:
+      continue
+
+    model_state_add_initial_file(FILEDATAPREFIX+str(inode), 
+                                 inodeentry['size'], loader)
+
+
+
+def _contentref_loader(contentreader, contentref):
+  def loader():
+    return contentreader(contentref)
+  return loader
+
+
+
+def _datafile_loader(datafilename):
+  def loader():
+    datafo = openfile(datafilename, False)
+    data = datafo.readat(None, 0)
+    datafo.close()
+    return data
+  return loader
 
 
 
 # To have a simple, blank file system, simply run this block of code.
 # 
 
-def _blank_fs_init():
+def _blank_fs_init(metadatafilename=METADATAFILENAME):
 
-  # kill all left over data files...
-  # metadata will be killed on persist.
+  # stop writing to the journal of the old file system...
+  if metadatajournal['fileobject'] != None:
+    metadatajournal['fileobject'].close()
+
+  # kill all left over data files and journals...
   for filename in listfiles():
-    if filename.startswith(FILEDATAPREFIX):
+    if filename.startswith(FILEDATAPREFIX) or \
+        filename.startswith(metadatafilename + METADATAJOURNALSUFFIX):
       removefile(filename)
 
   # Now setup blank data structures
@@ -242,34 +345,73 @@ def _blank_fs_init():
   filesystemmetadata['inodetable'] = {}
   filesystemmetadata['inodetable'][ROOTDIRECTORYINODE] = {'size':0, 
             'uid':1000, 'gid':1000, 
-            #'mode':16877,  # DIR+rwxr-xr-x 
-            'mode':['S_IFDIR', 'S_IRWXU', 'S_IRGRP', 'S_IXGRP', 'S_IROTH', 'S_IXOTH'],
+            'mode':16877,  # DIR+rwxr-xr-x 
             'atime':1323630836, 'ctime':1323630836, 'mtime':1323630836,
             'linkcount':2,    # the number of dir entries...
             'filename_to_inode_dict': {'.':ROOTDIRECTORYINODE, 
             '..':ROOTDIRECTORYINODE}}
-    
-  fastinodelookuptable['/'] = ROOTDIRECTORYINODE
+
+  metadatajournal['generation'] = 0
+  metadatajournal['fileobject'] = None
+  metadatajournal['size'] = 0
+  metadatajournal['inodes'] = set()
+  metadatajournal['direntries'] = []
+
+  # the journal of generation 0 starts from this metadata...
+  if metadatajournal['enabled']:
+    metadatastring = serializedata(filesystemmetadata)
+    _remove_if_exists(metadatafilename)
+    metadatafo = openfile(metadatafilename,True)
+    metadatafo.writeat(metadatastring,0)
+    metadatafo.close()
+    metadatajournal['snapshotsize'] = len(metadatastring)
 
 
 
 
 # These are used to initialize and stop the system
 def persist_metadata(metadatafilename):
-  # JR: Ignoring persisting metadata to disk.
-  return
+  """
+  Appends a record of the inodes and directory entries changed since the 
+  last call to the journal.   Does nothing if nothing changed.
+  """
+  if not metadatajournal['enabled']:
+    return
+
+  if not metadatajournal['inodes'] and not metadatajournal['direntries']:
+    return
+
+  inodetable = filesystemmetadata['inodetable']
+
+  # the entries of directories are in 'direntries', so they are left out of
+  # the inodes...
+  changedinodes = {}
+  for inode in metadatajournal['inodes']:
+    if inode in inodetable:
+      inodeentry = inodetable[inode].copy()
+      inodeentry.pop('filename_to_inode_dict', None)
+      changedinodes[inode] = inodeentry
+    else:
+      changedinodes[inode] = None
 
-  metadatastring = serializedata(filesystemmetadata)
+  record = {'nextinode':filesystemmetadata['nextinode'], 
+            'inodes':changedinodes, 
+            'direntries':metadatajournal['direntries']}
 
-  
-  # open the file (clobber) and write out the information...
-  try:
-    removefile(metadatafilename)
-  except FileNotFoundError:
-    pass
-  metadatafo = openfile(metadatafilename,True)
-  metadatafo.writeat(metadatastring,0)
-  metadatafo.close()
+  metadatajournal['inodes'] = set()
+  metadatajournal['direntries'] = []
+
+  if metadatajournal['fileobject'] == None:
+    metadatajournal['fileobject'] = openfile(_get_journal_filename(
+        metadatafilename, metadatajournal['generation']), True)
+
+  metadatajournal['size'] += _write_journal_record(
+      metadatajournal['fileobject'], record, metadatajournal['size'])
+
+  # once replaying the journal costs more than reading a snapshot, compact it
+  if metadatajournal['size'] > max(metadatajournal['snapshotsize'], 
+                                   JOURNAL_MINIMUM_SIZE):
+    _compact_metadata(metadatafilename)
 
 
 
@@ -285,53 +427,234 @@ def restore_metadata(metadatafilename):
 
   # get the dict we want
   desiredmetadata = deserializedata(metadatastring)
+  snapshotsize = len(metadatastring)
+
+  # find the newest journal.   A generation whose snapshot was not written
+  # completely is skipped, since the journal before it is still around then.
+  journalprefix = metadatafilename + METADATAJOURNALSUFFIX
+  generations = []
+  for filename in listfiles():
+    if filename.startswith(journalprefix) and \
+        filename[len(journalprefix):].isdigit():
+      generations.append(int(filename[len(journalprefix):]))
+  generations.sort(reverse=True)
+
+  generation = 0
+  records, recordends, journalsize = [], [], 0
+  for journalgeneration in generations:
+    records, recordends, journalsize = _read_journal(
+        _get_journal_filename(metadatafilename, journalgeneration))
+    if journalgeneration == 0 or (records and 'inodetable' in records[0]):
+      generation = journalgeneration
+      break
+    records, recordends, journalsize = [], [], 0
+
+  if generation > 0:
+    desiredmetadata = records.pop(0)
+    snapshotsize = recordends[0]
 
   # I need to put things in the dict, but it's not a global...   so instead
   # add them one at a time.   It should be empty to start with
   for item in desiredmetadata:
     filesystemmetadata[item] = desiredmetadata[item]
 
+  # the model keeps modes as numbers.   Metadata that lists the flags of 
+  # modes instead is converted.
+  for inode in filesystemmetadata['inodetable']:
+    inodeentry = filesystemmetadata['inodetable'][inode]
+    inodeentry['mode'] = list2flag(inodeentry['mode'])
 
-  # I need to rebuild the fastinodelookuptable. let's do this!
-  _rebuild_fastinodelookuptable()
+  for record in records:
+    _replay_journal_record(record)
 
+  metadatajournal['generation'] = generation
+  metadatajournal['fileobject'] = None
+  metadatajournal['size'] = 0
+  if recordends:
+    metadatajournal['size'] = recordends[-1]
+  metadatajournal['snapshotsize'] = snapshotsize
+  metadatajournal['inodes'] = set()
+  metadatajournal['direntries'] = []
 
+  # a record that was only partly written would be in the way of the next 
+  # one, so start a new generation without it.
+  if metadatajournal['enabled'] and metadatajournal['size'] < journalsize:
+    _compact_metadata(metadatafilename)
 
-# I'm already added.
-def _recursive_rebuild_fastinodelookuptable_helper(path, inode):
-  
-  # for each entry in my table...
-  for entryname,entryinode in filesystemmetadata['inodetable'][inode]['filename_to_inode_dict'].iteritems():
-    
-    # if it's . or .. skip it.
-    if entryname == '.' or entryname == '..':
+
+
+# private helper that marks an inode as changed, so that its entry (or its 
+# removal) is in the next journal record.
+def _journal_inode(inode):
+  metadatajournal['inodes'].add(inode)
+
+
+
+# private helper that writes the metadata as a snapshot that starts the 
+# journal of the next generation, and removes the old journal.
+def _compact_metadata(metadatafilename):
+  newgeneration = metadatajournal['generation'] + 1
+  newjournalfilename = _get_journal_filename(metadatafilename, newgeneration)
+
+  _remove_if_exists(newjournalfilename)
+  newjournalfo = openfile(newjournalfilename, True)
+  snapshotsize = _write_journal_record(newjournalfo, filesystemmetadata, 0)
+
+  # the snapshot is written, so the old journal is not needed anymore
+  if metadatajournal['fileobject'] != None:
+    metadatajournal['fileobject'].close()
+  _remove_if_exists(_get_journal_filename(metadatafilename, 
+                                          metadatajournal['generation']))
+
+  metadatajournal['generation'] = newgeneration
+  metadatajournal['fileobject'] = newjournalfo
+  metadatajournal['size'] = snapshotsize
+  metadatajournal['snapshotsize'] = snapshotsize
+
+
+
+def _get_journal_filename(metadatafilename, generation):
+  return metadatafilename + METADATAJOURNALSUFFIX + str(generation)
+
+
+
+# private helper that writes a record at position in a journal and returns
+# its length.   Each record is its length on a line of its own, followed by 
+# the serialized record.
+def _write_journal_record(journalfo, record, position):
+  recordstring = serializedata(record)
+  recordstring = str(len(recordstring)) + '\n' + recordstring
+  journalfo.writeat(recordstring, position)
+  return len(recordstring)
+
+
+
+# private helper that returns the records of a journal, the position each
+# of them ends at, and the size of the journal.   Reading stops at a record
+# that was only partly written.
+def _read_journal(journalfilename):
+  journalfo = openfile(journalfilename, False)
+  journalstring = journalfo.readat(None, 0)
+  journalfo.close()
+
+  records = []
+  recordends = []
+  position = 0
+  while True:
+    lengthend = journalstring.find('\n', position)
+    if lengthend == -1 or not journalstring[position:lengthend].isdigit():
+      break
+
+    recordend = lengthend + 1 + int(journalstring[position:lengthend])
+    if recordend > len(journalstring):
+      break
+
+    try:
+      records.append(deserializedata(journalstring[lengthend+1:recordend]))
+    except (ValueError, TypeError, IndexError):
+      break
+
+    recordends.append(recordend)
+    position = recordend
+
+  return records, recordends, len(journalstring)
+
+
+
+# private helper that applies the changes of a journal record to the metadata
+def _replay_journal_record(record):
+  inodetable = filesystemmetadata['inodetable']
+  filesystemmetadata['nextinode'] = record['nextinode']
+
+  for inode in record['inodes']:
+    inodeentry = record['inodes'][inode]
+
+    if inodeentry == None:
+      if inode in inodetable:
+        del inodetable[inode]
       continue
 
-    # always add it...
-    entrypurepathname = _get_absolute_path(path+'/'+entryname)
-    fastinodelookuptable[entrypurepathname] = entryinode
+    # the entries of a directory are kept, or start out empty for a new one
+    if inode in inodetable and 'filename_to_inode_dict' in inodetable[inode]:
+      inodeentry['filename_to_inode_dict'] = inodetable[inode]['filename_to_inode_dict']
+    elif IS_DIR(inodeentry['mode']):
+      inodeentry['filename_to_inode_dict'] = {}
+    inodetable[inode] = inodeentry
 
-    # and recurse if a directory...
-    if 'filename_to_inode_dict' in filesystemmetadata['inodetable'][entryinode]:
-      _recursive_rebuild_fastinodelookuptable_helper(entrypurepathname,entryinode)
-    
+  for dirinode, entryname, entryinode in record['direntries']:
+    if dirinode not in inodetable:
+      continue
+    filenametoinodedict = inodetable[dirinode]['filename_to_inode_dict']
+    if entryinode == None:
+      filenametoinodedict.pop(entryname, None)
+    else:
+      filenametoinodedict[entryname] = entryinode
 
-def _rebuild_fastinodelookuptable():
-  # first, empty it...
-  for item in fastinodelookuptable:
-    del fastinodelookuptable[item]
 
-  # now let's go through and add items...
-  
-  # I need to add the root.   
-  fastinodelookuptable['/'] = ROOTDIRECTORYINODE
-  # let's recursively do the rest...
-  
-  _recursive_rebuild_fastinodelookuptable_helper('/', ROOTDIRECTORYINODE)
+
+def _remove_if_exists(filename):
+  try:
+    removefile(filename)
+  except FileNotFoundError:
+    pass
+
+
+
+# These are used to checkpoint the state of the calls (eg in verify_posix) and
+# to resume from it later.   The state is made of built-in types only, and is
+# not copied, so it must be saved before the next call.   Dup'ed fds share 
+# their entry, so each entry is listed once in 'fdentries' and 'fds' maps 
+# the fds to them.   The locks of the entries are left out.
+def checkpoint_fs_state():
+  fdentries = []
+  fdentryindex = {}
+  fds = {}
+  for fd in filedescriptortable:
+    fdentry = filedescriptortable[fd]
+    if id(fdentry) not in fdentryindex:
+      fdentryindex[id(fdentry)] = len(fdentries)
+      fdentrycopy = fdentry.copy()
+      fdentrycopy.pop('lock', None)
+      fdentries.append(fdentrycopy)
+    fds[fd] = fdentryindex[id(fdentry)]
+
+  return {'metadata':filesystemmetadata, 
+          'fdentries':fdentries, 
+          'fds':fds,
+          'fileobjecttable':fileobjecttable,
+          'direntrytable':direntrytable,
+          'currentworkingdirectory':fs_calls_context['currentworkingdirectory'],
+          'ignore_fd':ignore_fd}
 
 
 
+def resume_fs_state(state, metadatafilename=METADATAFILENAME):
+  filesystemmetadata.clear()
+  filesystemmetadata.update(state['metadata'])
 
+  filedescriptortable.clear()
+  inodefdtable.clear()
+  fdallocator.reset()
+  for fdentry in state['fdentries']:
+    fdentry['lock'] = createlock()
+  for fd in state['fds']:
+    _add_fd(fd, state['fdentries'][state['fds'][fd]])
+
+  fileobjecttable.clear()
+  fileobjecttable.update(state['fileobjecttable'])
+  direntrytable.clear()
+  direntrytable.update(state['direntrytable'])
+
+  pathcache['recent'] = {}
+  pathcache['old'] = {}
+  fs_calls_context['currentworkingdirectory'] = state['currentworkingdirectory']
+  ignore_fd[:] = state['ignore_fd']
+
+  # the journal starts over from the resumed metadata
+  metadatajournal['inodes'] = set()
+  metadatajournal['direntries'] = []
+  if metadatajournal['enabled'] and filesystemmetadata:
+    _compact_metadata(metadatafilename)
 
 
 
@@ -343,69 +666,126 @@ def _rebuild_fastinodelookuptable():
 
 
 # private helper function that converts a relative path or a path with things
-# like foo/../bar to a normal path.
-def _get_absolute_path(path):
+# like foo/../bar to the components of a normal path.   ('foo', 'bar') stands
+# for '/foo/bar'.   Paths normalized recently are found in the pathcache.
+def _get_path_components(path):
 
-  # If it's a relative path, prepend the CWD...
-  if path[0] != '/':
-    path = fs_calls_context['currentworkingdirectory'] + '/' + path
+  # If it's a relative path, it depends on the CWD...
+  if path[0] == '/':
+    cachekey = path
+  else:
+    cachekey = (fs_calls_context['currentworkingdirectory'], path)
+
+  recentpaths = pathcache['recent']
+  if cachekey in recentpaths:
+    return recentpaths[cachekey]
 
+  if cachekey in pathcache['old']:
+    pathcomponents = pathcache['old'][cachekey]
+  else:
+    pathcomponents = _normalize_path(path)
 
-  # now I'll split on '/'.   This gives a list like: ['','foo','bar'] for 
-  # '/foo/bar'
-  pathlist = path.split('/')
+  # start a new generation if this one is full...
+  if len(recentpaths) >= PATH_CACHE_SIZE:
+    pathcache['old'] = recentpaths
+    recentpaths = {}
+    pathcache['recent'] = recentpaths
 
-  # let's remove the leading ''
-  assert(pathlist[0] == '')
-  pathlist = pathlist[1:]
+  recentpaths[cachekey] = pathcomponents
+  return pathcomponents
 
-  # Now, let's remove any '.' entries...
-  while True:
-    try:
-      pathlist.remove('.')
-    except ValueError:
-      break
 
-  # Also remove any '' entries...
-  while True:
-    try:
-      pathlist.remove('')
-    except ValueError:
-      break
 
-  # NOTE: This makes '/foo/bar/' -> '/foo/bar'.   I think this is okay.
-  
-  # for a '..' entry, remove the previous entry (if one exists).   This will
-  # only work if we go left to right.
-  position = 0
-  while position < len(pathlist):
-    if pathlist[position] == '..':
-      # if there is a parent, remove it and this entry.  
-      if position > 0:
-        del pathlist[position]
-        del pathlist[position-1]
-
-        # go back one position and continue...
-        position = position -1
-        continue
+def _normalize_path(path):
 
-      else:
-        # I'm at the beginning.   Remove this, but no need to adjust position
-        del pathlist[position]
-        continue
+  # If it's a relative path, prepend the CWD...
+  if path[0] != '/':
+    path = fs_calls_context['currentworkingdirectory'] + '/' + path
 
-    else:
-      # it's a normal entry...   move along...
-      position = position + 1
+  # go through the entries left to right in a single pass.   '.' and '' 
+  # entries are skipped, so '/foo/bar/' -> '/foo/bar'.   I think this is okay.
+  # A '..' entry removes the previous entry (if one exists).
+  pathlist = []
+  for entry in path.split('/'):
+    if entry == '' or entry == '.':
+      continue
+    if entry == '..':
+      if pathlist:
+        pathlist.pop()
+      continue
+    pathlist.append(entry)
 
+  return tuple(pathlist)
 
-  # now let's join the pathlist!
-  return '/'+'/'.join(pathlist)
 
 
-# private helper function
-def _get_absolute_parent_path(path):
-  return _get_absolute_path(path+'/..')
+# private helper function that converts a relative path or a path with things
+# like foo/../bar to a normal path.
+def _get_absolute_path(path):
+  return '/'+'/'.join(_get_path_components(path))
+
+
+
+# private helper function that returns the inode of the path with the given
+# components, or None if there is no such path.   It walks the directories 
+# from the root, one lookup per component.
+def _get_inode(pathcomponents):
+  inodetable = filesystemmetadata['inodetable']
+  inode = ROOTDIRECTORYINODE
+  for entryname in pathcomponents:
+    if 'filename_to_inode_dict' not in inodetable[inode]:
+      return None
+    if entryname not in inodetable[inode]['filename_to_inode_dict']:
+      return None
+    inode = inodetable[inode]['filename_to_inode_dict'][entryname]
+  return inode
+
+
+
+# private helper function that returns the direntrytable entry of a 
+# directory, building it in the current order of the directory if needed.
+def _get_direntries(dirinode):
+  if dirinode not in direntrytable:
+    slots = filesystemmetadata['inodetable'][dirinode]['filename_to_inode_dict'].keys()
+    slotofname = {}
+    for slot in range(len(slots)):
+      slotofname[slots[slot]] = slot
+    direntrytable[dirinode] = {'slots':slots, 'slotofname':slotofname, 
+                               'tombstones':0}
+  return direntrytable[dirinode]
+
+
+
+# private helper functions that add and remove directory entries, keeping 
+# the direntrytable up to date.   The change and the directory's inode (whose
+# link count changes with it) go in the next journal record.
+def _add_direntry(dirinode, entryname, entryinode):
+  filesystemmetadata['inodetable'][dirinode]['filename_to_inode_dict'][entryname] = entryinode
+  metadatajournal['direntries'].append((dirinode, entryname, entryinode))
+  _journal_inode(dirinode)
+
+  if dirinode in direntrytable:
+    direntries = direntrytable[dirinode]
+    direntries['slotofname'][entryname] = len(direntries['slots'])
+    direntries['slots'].append(entryname)
+
+
+def _remove_direntry(dirinode, entryname):
+  del filesystemmetadata['inodetable'][dirinode]['filename_to_inode_dict'][entryname]
+  metadatajournal['direntries'].append((dirinode, entryname, None))
+  _journal_inode(dirinode)
+
+  if dirinode in direntrytable:
+    direntries = direntrytable[dirinode]
+    direntries['slots'][direntries['slotofname'].pop(entryname)] = None
+    direntries['tombstones'] += 1
+
+    # once most slots are tombstones, drop the order so that it is rebuilt
+    # without them, unless the directory is open, since that would move the
+    # positions of its fds.
+    if direntries['tombstones'] > len(direntries['slotofname']) and \
+        dirinode not in inodefdtable:
+      del direntrytable[dirinode]
   
 
 
@@ -501,13 +881,11 @@ def statfs_syscall(path):
 
   # ... but always release it...
   try:
-    truepath = _get_absolute_path(path)
+    thisinode = _get_inode(_get_path_components(path))
 
     # is the path there?
-    if truepath not in fastinodelookuptable:
+    if thisinode == None:
       raise SyscallError("statfs_syscall","ENOENT","The path does not exist.")
-
-    thisinode = fastinodelookuptable[truepath]
       
     return _istatfs_helper(thisinode)
 
@@ -531,7 +909,7 @@ def access_syscall(path, amode):
   """
     See: http://linux.die.net/man/2/access
   """
-  amode = flag2list(amode)
+  amode = flag2list(amode, 'access')
   
   # lock to prevent things from changing while we look this up...
   filesystemmetadatalock.acquire(True)
@@ -540,21 +918,19 @@ def access_syscall(path, amode):
   try:
 
     # get the actual name.   Remove things like '../foo'
-    truepath = _get_absolute_path(path)
+    thisinode = _get_inode(_get_path_components(path))
 
-    if truepath not in fastinodelookuptable:
+    if thisinode == None:
       raise SyscallError("access_syscall","ENOENT","A directory in the path does not exist or file not found.")
 
-    # BUG: This code should really walk the directories instead of using this 
-    # table...   This will have to be fixed for symlinks to work.
-    thisinode = fastinodelookuptable[truepath]
+    # BUG: This will have to be fixed for symlinks to work.
 
 
     # BUG: This should take the UID / GID of the requestor in mind
 
     # if all of the bits for this file are set as requested, then indicate
     # success (return 0)
-    if filesystemmetadata['inodetable'][thisinode]['mode'] == amode:
+    if flag2list(filesystemmetadata['inodetable'][thisinode]['mode'], 'mode') == amode:
       return 0
 
     raise SyscallError("access_syscall","EACESS","The requested access is denied.")
@@ -587,7 +963,7 @@ def chdir_syscall(path):
   truepath = _get_absolute_path(path)
 
   # If it doesn't exist...
-  if truepath not in fastinodelookuptable:
+  if _get_inode(_get_path_components(path)) == None:
     raise SyscallError("chdir_syscall","ENOENT","A directory in the path does not exist.")
 
   # let's update and return success (0)
@@ -620,21 +996,20 @@ def mkdir_syscall(path, mode):
 
   # ... but always release it...
   try:
-    truepath = _get_absolute_path(path)
+    pathcomponents = _get_path_components(path)
 
     # is the path there?
-    if truepath in fastinodelookuptable:
+    if _get_inode(pathcomponents) != None:
       raise SyscallError("mkdir_syscall","EEXIST","The path exists.")
 
       
     # okay, it doesn't exist (great!).   Does it's parent exist and is it a 
     # dir?
-    trueparentpath = _get_absolute_parent_path(path)
+    parentinode = _get_inode(pathcomponents[:-1])
 
-    if trueparentpath not in fastinodelookuptable:
+    if parentinode == None:
       raise SyscallError("mkdir_syscall","ENOENT","Path does not exist.")
 
-    parentinode = fastinodelookuptable[trueparentpath]
     if not IS_DIR(filesystemmetadata['inodetable'][parentinode]['mode']):
       raise SyscallError("mkdir_syscall","ENOTDIR","Path's parent is not a directory.")
 
@@ -645,31 +1020,30 @@ def mkdir_syscall(path, mode):
     assert('S_IRWXA' not in mode)
 
     # okay, great!!!   We're ready to go!   Let's make the new directory...
-    dirname = truepath.split('/')[-1]
+    dirname = pathcomponents[-1]
 
     # first, make the new directory...
     newinode = filesystemmetadata['nextinode']
     filesystemmetadata['nextinode'] += 1
 
     newinodeentry = {'size':0, 'uid':1000, 'gid':1000, 
-            'mode':mode + ['S_IFDIR'],  # DIR+rwxr-xr-x
+            'mode':list2flag(mode) | S_IFDIR,  # DIR+rwxr-xr-x
             # BUG: I'm listing some arbitrary time values.  I could keep a time
             # counter too.
             'atime':1323630836, 'ctime':1323630836, 'mtime':1323630836,
             'linkcount':2,    # the number of dir entries...
-            'filename_to_inode_dict': {'.':newinode, '..':parentinode}}
+            'filename_to_inode_dict': {}}
     
     # ... and put it in the table..
     filesystemmetadata['inodetable'][newinode] = newinodeentry
+    _add_direntry(newinode, '.', newinode)
+    _add_direntry(newinode, '..', parentinode)
 
 
-    filesystemmetadata['inodetable'][parentinode]['filename_to_inode_dict'][dirname] = newinode
+    _add_direntry(parentinode, dirname, newinode)
     # increment the link count on the dir...
     filesystemmetadata['inodetable'][parentinode]['linkcount'] += 1
 
-    # finally, update the fastinodelookuptable and return success!!!
-    fastinodelookuptable[truepath] = newinode
-    
     return 0
 
   finally:
@@ -694,17 +1068,16 @@ def rmdir_syscall(path):
 
   # ... but always release it...
   try:
-    truepath = _get_absolute_path(path)
+    pathcomponents = _get_path_components(path)
 
     # Is it the root?
-    if truepath == '/':
+    if pathcomponents == ():
       raise SyscallError("rmdir_syscall","EINVAL","Cannot remove the root directory.")
       
     # is the path there?
-    if truepath not in fastinodelookuptable:
+    thisinode = _get_inode(pathcomponents)
+    if thisinode == None:
       raise SyscallError("rmdir_syscall","EEXIST","The path does not exist.")
-
-    thisinode = fastinodelookuptable[truepath]
       
     # okay, is it a directory?
     if not IS_DIR(filesystemmetadata['inodetable'][thisinode]['mode']):
@@ -717,25 +1090,24 @@ def rmdir_syscall(path):
     # TODO: I should check permissions...
 
 
-    trueparentpath = _get_absolute_parent_path(path)
-    parentinode = fastinodelookuptable[trueparentpath]
+    parentinode = _get_inode(pathcomponents[:-1])
 
 
     # remove the entry from the inode table...
     del filesystemmetadata['inodetable'][thisinode]
+    _journal_inode(thisinode)
+    if thisinode in direntrytable:
+      del direntrytable[thisinode]
 
 
     # We're ready to go!   Let's clean up the file entry
-    dirname = truepath.split('/')[-1]
+    dirname = pathcomponents[-1]
     # remove the entry from the parent...
 
-    del filesystemmetadata['inodetable'][parentinode]['filename_to_inode_dict'][dirname]
+    _remove_direntry(parentinode, dirname)
     # decrement the link count on the dir...
     filesystemmetadata['inodetable'][parentinode]['linkcount'] -= 1
 
-    # finally, clean up the fastinodelookuptable and return success!!!
-    del fastinodelookuptable[truepath]
-    
     return 0
 
   finally:
@@ -763,13 +1135,12 @@ def link_syscall(oldpath, newpath):
 
   # ... but always release it...
   try:
-    trueoldpath = _get_absolute_path(oldpath)
+    oldinode = _get_inode(_get_path_components(oldpath))
 
     # is the old path there?
-    if trueoldpath not in fastinodelookuptable:
+    if oldinode == None:
       raise SyscallError("link_syscall","ENOENT","Old path does not exist.")
 
-    oldinode = fastinodelookuptable[trueoldpath]
     # is oldpath a directory?
     if IS_DIR(filesystemmetadata['inodetable'][oldinode]['mode']):
       raise SyscallError("link_syscall","EPERM","Old path is a directory.")
@@ -778,20 +1149,19 @@ def link_syscall(oldpath, newpath):
 
     # okay, the old path info seems fine...
       
-    truenewpath = _get_absolute_path(newpath)
+    newpathcomponents = _get_path_components(newpath)
 
     # does the newpath exist?   It shouldn't
-    if truenewpath in fastinodelookuptable:
+    if _get_inode(newpathcomponents) != None:
       raise SyscallError("link_syscall","EEXIST","newpath already exists.")
       
     # okay, it doesn't exist (great!).   Does it's parent exist and is it a 
     # dir?
-    truenewparentpath = _get_absolute_parent_path(newpath)
+    newparentinode = _get_inode(newpathcomponents[:-1])
 
-    if truenewparentpath not in fastinodelookuptable:
+    if newparentinode == None:
       raise SyscallError("link_syscall","ENOENT","New path does not exist.")
 
-    newparentinode = fastinodelookuptable[truenewparentpath]
     if not IS_DIR(filesystemmetadata['inodetable'][newparentinode]['mode']):
       raise SyscallError("link_syscall","ENOTDIR","New path's parent is not a directory.")
 
@@ -801,18 +1171,16 @@ def link_syscall(oldpath, newpath):
 
 
     # okay, great!!!   We're ready to go!   Let's make the file...
-    newfilename = truenewpath.split('/')[-1]
+    newfilename = newpathcomponents[-1]
     # first, make the directory entry...
-    filesystemmetadata['inodetable'][newparentinode]['filename_to_inode_dict'][newfilename] = oldinode
+    _add_direntry(newparentinode, newfilename, oldinode)
     # increment the link count on the dir...
     filesystemmetadata['inodetable'][newparentinode]['linkcount'] += 1
 
     # ... and the file itself
     filesystemmetadata['inodetable'][oldinode]['linkcount'] += 1
+    _journal_inode(oldinode)
 
-    # finally, update the fastinodelookuptable and return success!!!
-    fastinodelookuptable[truenewpath] = oldinode
-    
     return 0
 
   finally:
@@ -838,13 +1206,12 @@ def unlink_syscall(path):
 
   # ... but always release it...
   try:
-    truepath = _get_absolute_path(path)
+    pathcomponents = _get_path_components(path)
+    thisinode = _get_inode(pathcomponents)
 
     # is the path there?
-    if truepath not in fastinodelookuptable:
+    if thisinode == None:
       raise SyscallError("unlink_syscall","ENOENT","The path does not exist.")
-
-    thisinode = fastinodelookuptable[truepath]
       
     # okay, is it a directory?
     if IS_DIR(filesystemmetadata['inodetable'][thisinode]['mode']):
@@ -853,26 +1220,23 @@ def unlink_syscall(path):
     # TODO: I should check permissions...
 
 
-    trueparentpath = _get_absolute_parent_path(path)
-    parentinode = fastinodelookuptable[trueparentpath]
+    parentinode = _get_inode(pathcomponents[:-1])
 
 
 
 
     # We're ready to go!   Let's clean up the file entry
-    dirname = truepath.split('/')[-1]
+    dirname = pathcomponents[-1]
     # remove the entry from the parent...
 
-    del filesystemmetadata['inodetable'][parentinode]['filename_to_inode_dict'][dirname]
+    _remove_direntry(parentinode, dirname)
     # decrement the link count on the dir...
     filesystemmetadata['inodetable'][parentinode]['linkcount'] -= 1
 
-    # clean up the fastinodelookuptable
-    del fastinodelookuptable[truepath]
-
 
     # decrement the link count...
     filesystemmetadata['inodetable'][thisinode]['linkcount'] -= 1
+    _journal_inode(thisinode)
 
     # If zero, remove the entry from the inode table
     if filesystemmetadata['inodetable'][thisinode]['linkcount'] == 0:
@@ -905,13 +1269,11 @@ def stat_syscall(path):
 
   # ... but always release it...
   try:
-    truepath = _get_absolute_path(path)
+    thisinode = _get_inode(_get_path_components(path))
 
     # is the path there?
-    if truepath not in fastinodelookuptable:
+    if thisinode == None:
       raise SyscallError("stat_syscall","ENOENT","The path does not exist.")
-
-    thisinode = fastinodelookuptable[truepath]
      
     #EG: TODO: what about character files? /dev/null, /dev/random, etc. CheckAPI doesn't care, right?
 
@@ -958,7 +1320,7 @@ def _istat_helper(inode):
 
   return (filesystemmetadata['dev_id'],          # st_dev
           inode,                                 # inode
-          filesystemmetadata['inodetable'][inode]['mode'],
+          flag2list(filesystemmetadata['inodetable'][inode]['mode'], 'mode'),
           filesystemmetadata['inodetable'][inode]['linkcount'],
           filesystemmetadata['inodetable'][inode]['uid'],
           filesystemmetadata['inodetable'][inode]['gid'],
@@ -982,16 +1344,106 @@ def _istat_helper(inode):
 ##### OPEN  #####
 
 
+class LowestFreeAllocator(object):
+  """
+  Finds the lowest of a sorted list of values (eg fd numbers) that is not in
+  use, without scanning the values in use.   inuse is the table that holds
+  the values in use (eg filedescriptortable).   The values above every value
+  handed out so far are free, and the values below them that are released
+  are kept in a heap.   Values may be taken without the allocator (eg by 
+  dup2).   They are dropped from the heap once they reach its top.
+
+  Like the scans this replaces, allocate only finds the value.   It is in 
+  use once the caller adds it to inuse, and release must be called once it 
+  is removed from inuse again.
+  """
+
+  def __init__(self, values, inuse):
+    self.values = values
+    self.valueset = set(values)
+    self.inuse = inuse
+    # the index of the lowest value that was never handed out...
+    self.nextindex = 0
+    # a heap of the values below it that were released...
+    self.released = []
+
+
+  def allocate(self):
+    """ Returns the lowest value not in use, or None if all of them are. """
+    released = self.released
+    while released and released[0] in self.inuse:
+      self._heap_pop()
+
+    while self.nextindex < len(self.values) and \
+        self.values[self.nextindex] in self.inuse:
+      self.nextindex += 1
+
+    if released:
+      return released[0]
+    if self.nextindex < len(self.values):
+      return self.values[self.nextindex]
+    return None
+
+
+  def reset(self):
+    """ Forgets the values handed out, eg after inuse was replaced. """
+    self.nextindex = 0
+    del self.released[:]
+
+
+  def release(self, value):
+    # the values from nextindex on are known to be free already...
+    if value in self.valueset and (self.nextindex == len(self.values) or 
+        value < self.values[self.nextindex]):
+      self._heap_push(value)
+
+
+  def _heap_push(self, value):
+    heap = self.released
+    heap.append(value)
+    position = len(heap) - 1
+    while position > 0:
+      parent = (position - 1) / 2
+      if heap[parent] <= value:
+        break
+      heap[position] = heap[parent]
+      position = parent
+    heap[position] = value
+
+
+  def _heap_pop(self):
+    heap = self.released
+    last = heap.pop()
+    if not heap:
+      return
+    position = 0
+    while True:
+      child = 2 * position + 1
+      if child >= len(heap):
+        break
+      if child + 1 < len(heap) and heap[child + 1] < heap[child]:
+        child += 1
+      if last <= heap[child]:
+        break
+      heap[position] = heap[child]
+      position = child
+    heap[position] = last
+
+
+
 STARTINGFD = 10
 MAXFD = 1024
 
+# finds the lowest free file descriptor...
+fdallocator = LowestFreeAllocator(range(STARTINGFD, MAXFD), filedescriptortable)
+
 # get the next free file descriptor
 def get_next_fd():
   # let's get the next available fd number.   The standard says we need to 
   # return the lowest open fd number.
-  for fd in range(STARTINGFD, MAXFD):
-    if not fd in filedescriptortable:
-      return fd
+  fd = fdallocator.allocate()
+  if fd != None:
+    return fd
 
   raise SyscallError("open_syscall","EMFILE","The maximum number of files are open.")
   
@@ -1005,7 +1457,8 @@ def open_syscall(path, flags, mode):
   if isinstance(mode, Unknown):
     mode = []
 
-  flags = flag2list(flags)
+  # the flags are kept as a number...
+  flags = list2flag(flags)
   mode = flag2list(mode)
       
   # in an abundance of caution, lock...   I think this should only be needed
@@ -1018,28 +1471,28 @@ def open_syscall(path, flags, mode):
     if path == '':
       raise SyscallError("open_syscall","ENOENT","The file does not exist.")
 
-    truepath = _get_absolute_path(path)
+    pathcomponents = _get_path_components(path)
+    inode = _get_inode(pathcomponents)
 
     # is the file missing?
-    if truepath not in fastinodelookuptable:
+    if inode == None:
 
       # did they use O_CREAT?
-      if not 'O_CREAT' in flags:
+      if not flags & O_CREAT:
         raise SyscallError("open_syscall","ENOENT","The file does not exist.")
       
       # okay, it doesn't exist (great!).   Does it's parent exist and is it a 
       # dir?
-      trueparentpath = _get_absolute_parent_path(path)
+      parentinode = _get_inode(pathcomponents[:-1])
  
-      if trueparentpath not in fastinodelookuptable:
+      if parentinode == None:
         raise SyscallError("open_syscall","ENOENT","Path does not exist.")
 
-      parentinode = fastinodelookuptable[trueparentpath]
       if not IS_DIR(filesystemmetadata['inodetable'][parentinode]['mode']):
         raise SyscallError("open_syscall","ENOTDIR","Path's parent is not a directory.")
 
       # okay, great!!!   We're ready to go!   Let's make the new file...
-      filename = truepath.split('/')[-1]
+      filename = pathcomponents[-1]
 
       # first, make the new file's entry...
       newinode = filesystemmetadata['nextinode']
@@ -1050,7 +1503,7 @@ def open_syscall(path, flags, mode):
       assert('S_IRWXA' not in mode)
 
       newinodeentry = {'size':0, 'uid':1000, 'gid':1000, 
-            'mode': mode + ['S_IFREG'], # FILE + their entries
+            'mode': list2flag(mode) | S_IFREG, # FILE + their entries
             # BUG: I'm listing some arbitrary time values.  I could keep a time
             # counter too.
             'atime':1323630836, 'ctime':1323630836, 'mtime':1323630836,
@@ -1058,15 +1511,13 @@ def open_syscall(path, flags, mode):
 
       # ... and put it in the table..
       filesystemmetadata['inodetable'][newinode] = newinodeentry
+      _journal_inode(newinode)
 
       # let's make the parent point to it...
-      filesystemmetadata['inodetable'][parentinode]['filename_to_inode_dict'][filename] = newinode
+      _add_direntry(parentinode, filename, newinode)
       # ... and increment the link count on the dir...
       filesystemmetadata['inodetable'][parentinode]['linkcount'] += 1
 
-      # finally, update the fastinodelookuptable
-      fastinodelookuptable[truepath] = newinode
-
       # this file must not exist or it's an internal error!!!
       fd = model_openfile('MainThread', FILEDATAPREFIX+str(newinode),True)
       model_file_close('MainThread', fd)
@@ -1075,19 +1526,18 @@ def open_syscall(path, flags, mode):
     # if the file did exist, were we told to create with exclusion?
     else:
       # did they use O_CREAT and O_EXCL?
-      if 'O_CREAT' in flags and 'O_EXCL' in flags:
+      if flags & O_CREAT and flags & O_EXCL:
         raise SyscallError("open_syscall","EEXIST","The file exists.")
 
       # This file should be removed.   If O_RDONLY is set, the behavior
       # is undefined, so this is okay, I guess...
-      if 'O_TRUNC' in flags:
-        inode = fastinodelookuptable[truepath]
-
+      if flags & O_TRUNC:
         # if it exists, close the existing file object so I can remove it...
         if inode in fileobjecttable:
           fileobjecttable[inode].close()
           # reset the size to 0
           filesystemmetadata['inodetable'][inode]['size'] = 0
+          _journal_inode(inode)
 
         # remove the file...
         model_removefile('MainThread', FILEDATAPREFIX+str(inode))
@@ -1101,7 +1551,7 @@ def open_syscall(path, flags, mode):
     # At this point, the file will exist... 
 
     # Let's find the inode
-    inode = fastinodelookuptable[truepath]
+    inode = _get_inode(pathcomponents)
 
     
     # get the next fd so we can use it...
@@ -1119,7 +1569,7 @@ def open_syscall(path, flags, mode):
 
     # I'm going to assume that if you use O_APPEND I only need to 
     # start the pointer in the right place.
-    if 'O_APPEND' in flags:
+    if flags & O_APPEND:
       position = filesystemmetadata['inodetable'][inode]['size']
     else:
       # else, let's start at the beginning
@@ -1128,9 +1578,14 @@ def open_syscall(path, flags, mode):
 
     # TODO handle read / write locking, etc.
 
+    # O_CLOEXEC sets the close-on-exec fd flag...
+    fdflags = 0
+    if flags & O_CLOEXEC:
+      fdflags = FD_CLOEXEC
+
     # Add the entry to the table!
 
-    filedescriptortable[thisfd] = {'position':position, 'inode':inode, 'lock':createlock(), 'flags':[element for element in flags if element in O_RDWRFLAGS]}
+    _add_fd(thisfd, {'position':position, 'inode':inode, 'lock':createlock(), 'flags':flags & O_RDWRFLAGS, 'fdflags':fdflags})
 
 
     # Done!   Let's return the file descriptor.
@@ -1178,7 +1633,7 @@ def lseek_syscall(fd, offset, whence):
   """
   # TODO: offset should be an integer!!!!
   #offset = flag2list(offset)
-  whence = flag2list(whence)
+  whence = flag2list(whence, 'seek')
 
   if fd in ignore_fd:
     raise IgnoredFileDescriptorWarning("lseek_syscall", "The file descriptor is ignored.") 
@@ -1206,8 +1661,9 @@ def lseek_syscall(fd, offset, whence):
       filesize = filesystemmetadata['inodetable'][inode]['size']
 
     elif IS_DIR(filesystemmetadata['inodetable'][inode]['mode']):
-      # if a directory, let's use the number of entries
-      filesize = len(filesystemmetadata['inodetable'][inode]['filename_to_inode_dict'])
+      # if a directory, let's use the number of entry slots, which getdents
+      # uses as positions
+      filesize = len(_get_direntries(inode)['slots'])
 
     else:
       # otherwise we don't know
@@ -1372,8 +1828,11 @@ def write_syscall(fd, data, count):
     filedescriptortable[fd]['position'] += len(data)
 
     # update the file size if we've extended it
+    # (write does not hold the metadata lock, so the new size is journaled 
+    # by the next call that persists the metadata)
     if filedescriptortable[fd]['position'] > filesize:
       filesystemmetadata['inodetable'][inode]['size'] = filedescriptortable[fd]['position']
+      _journal_inode(inode)
       
     # we always write it all, so just return the length of what we were passed.
     # We do not mention whether we write blank data (if position is after the 
@@ -1394,11 +1853,33 @@ def write_syscall(fd, data, count):
 
 # private helper.   Get the fds for an inode (or [] if none)
 def _lookup_fds_by_inode(inode):
-  returnedfdlist = []
-  for fd in filedescriptortable:
-    if not IS_SOCK_DESC(fd) and filedescriptortable[fd]['inode'] == inode:
-      returnedfdlist.append(fd)
-  return returnedfdlist
+  if inode not in inodefdtable:
+    return []
+  return list(inodefdtable[inode])
+
+
+
+# private helpers that add and remove fds, keeping the inodefdtable up to 
+# date and releasing the fd numbers.
+def _add_fd(fd, fdentry):
+  filedescriptortable[fd] = fdentry
+
+  if 'inode' in fdentry:
+    if fdentry['inode'] not in inodefdtable:
+      inodefdtable[fdentry['inode']] = set([])
+    inodefdtable[fdentry['inode']].add(fd)
+
+
+def _remove_fd(fd):
+  fdentry = filedescriptortable[fd]
+
+  if 'inode' in fdentry:
+    inodefdtable[fdentry['inode']].discard(fd)
+    if not inodefdtable[fdentry['inode']]:
+      del inodefdtable[fdentry['inode']]
+
+  del filedescriptortable[fd]
+  fdallocator.release(fd)
 
 
 # is this file descriptor a socket? 
@@ -1485,7 +1966,7 @@ def close_syscall(fd):
     #JR: Ignore locking in model.
     # ... release the lock
     #filedescriptortable[fd]['lock'].release()
-    del filedescriptortable[fd]
+    _remove_fd(fd)
 
 
 
@@ -1515,13 +1996,14 @@ def _dup2_helper(oldfd,newfd):
   if newfd in filedescriptortable:
     # should not result in an error.   This only occurs on a bad fd 
     _close_helper(newfd)
+    _remove_fd(newfd)
 
 
   # Okay, we need the new and old to point to the same thing.
   # NOTE: I am not making a copy here!!!   They intentionally both
   # refer to the same instance because manipulating the position, etc.
   # impacts both.
-  filedescriptortable[newfd] = filedescriptortable[oldfd]
+  _add_fd(newfd, filedescriptortable[oldfd])
 
   return newfd
 
@@ -1623,7 +2105,7 @@ def fcntl_syscall(fd, cmd, *args):
   if isinstance(args[0], Unknown):
     args = []
 
-  cmd = flag2list(cmd)
+  cmd = flag2list(cmd, 'fcntl')
   args = flag2list(args)
 
 
@@ -1652,25 +2134,25 @@ def fcntl_syscall(fd, cmd, *args):
         raise SyscallError("fcntl_syscall", "EINVAL", "Argument is more than\
 	          maximun allowable value.")
 
-      return int('FD_CLOEXEC' in filedescriptortable[fd]['flags'])
+      return int(filedescriptortable[fd]['fdflags'] & FD_CLOEXEC != 0)
 
 
     # set the flags... (but this is just CLO_EXEC, so ignore...)
     elif 'F_SETFD' in cmd:
       assert(len(args) == 1)
-      filedescriptortable[fd]['flags'].append(args[0])
+      filedescriptortable[fd]['fdflags'] = list2flag(args[0])
       return 0
 
     # if we're getting the flags, return them...
     elif 'F_GETFL' in cmd:
       assert(len(args) == 0)
-      return filedescriptortable[fd]['flags']
+      return _fd_flags_to_list(filedescriptortable[fd])
 
     # set the flags...
     elif 'F_SETFL' in cmd:
       assert(len(args) == 1)
       assert(type(args[0]) == int or type(args[0]) == long or type(args[0]) == str)
-      filedescriptortable[fd]['flags'] = args[0]
+      filedescriptortable[fd]['flags'] = list2flag(args[0])
       return 0
 
     # This is saying we'll get signals for this.   Let's punt this...
@@ -1697,7 +2179,7 @@ def fcntl_syscall(fd, cmd, *args):
     # EM: Ignore locking in model.
     # ... release the lock
     #filedescriptortable[fd]['lock'].release()
-    del filedescriptortable[fd]
+    _remove_fd(fd)
 
 
 
@@ -1707,6 +2189,19 @@ def fcntl_syscall(fd, cmd, *args):
 
 
 
+# private helper that lists the flags of a fd the way the parser does.   
+# O_RDONLY is 0, so it is added for files.
+def _fd_flags_to_list(fdentry):
+  flaglist = flag2list(fdentry['flags'], 'open')
+  if 'inode' in fdentry and IS_RDONLY(fdentry['flags']) and \
+      type(flaglist) is list:
+    flaglist = ['O_RDONLY'] + flaglist
+  return flaglist
+
+
+
+
+
 ##### GETDENTS  #####
 # EG: TOSEE there is a discrpancy between what real execution and model return
 # for now any errors in this syscall are justified
@@ -1752,10 +2247,20 @@ def getdents_syscall(fd,quantity):
     bufferedquantity = 0
 
     # let's move the position forward...
-    startposition = filedescriptortable[fd]['position']
+    position = filedescriptortable[fd]['position']
+    slots = _get_direntries(inode)['slots']
+    filenametoinodedict = filesystemmetadata['inodetable'][inode]['filename_to_inode_dict']
 
     # return tuple with inode, name, type tuples...
-    for entryname,entryinode in list(filesystemmetadata['inodetable'][inode]['filename_to_inode_dict'].iteritems())[startposition:]:
+    while position < len(slots):
+      entryname = slots[position]
+
+      # skip the entries that were removed...
+      if entryname == None:
+        position += 1
+        continue
+
+      entryinode = filenametoinodedict[entryname]
 
       # getdents returns the mode also (at least on Linux)...
       entrytype = get_direnttype_from_mode(filesystemmetadata['inodetable'][entryinode]['mode'])
@@ -1771,10 +2276,11 @@ def getdents_syscall(fd,quantity):
         break
 
       returninodefntuplelist.append((entryinode,entryname,entrytype))
+      position += 1
 
 
-    # and move the position along.   Go no further than the end...
-    filedescriptortable[fd]['position'] = min(startposition+quantity, len(filesystemmetadata['inodetable'][inode]['filename_to_inode_dict']))
+    # and move the position along, past the entries returned.
+    filedescriptortable[fd]['position'] = position
     
     return returninodefntuplelist
 
@@ -101,12 +101,22 @@ usedtcpportsset = set([])
 usabletcpportsset = getresources()[0]['connport'].copy()
 
 
+# these find the lowest unused port (see LowestFreeAllocator)...
+def _new_port_allocator(usableportsset, usedportsset):
+  usableports = list(usableportsset)
+  usableports.sort()
+  return LowestFreeAllocator(usableports, usedportsset)
+
+udpportallocator = _new_port_allocator(usableudpportsset, usedudpportsset)
+tcpportallocator = _new_port_allocator(usabletcpportsset, usedtcpportsset)
+
+
 # We need a helper that gets an available port...
-# Get the first unused port and return it...
+# Get the lowest unused port and return it...
 def _get_available_udp_port():
-  for port in usableudpportsset:
-    if port not in usedudpportsset:
-      return port
+  port = udpportallocator.allocate()
+  if port != None:
+    return port
   
   # this is probably the closest syscall.   No buffer space available...
   raise SyscallError("_get_available_udp_port","ENOBUFS","No UDP port available")
@@ -115,9 +125,9 @@ def _get_available_udp_port():
 
 # A verbatim copy of the above...   It's so simple, I guess it's okay to do so
 def _get_available_tcp_port():
-  for port in usabletcpportsset:
-    if port not in usedtcpportsset:
-      return port
+  port = tcpportallocator.allocate()
+  if port != None:
+    return port
   
   # this is probably the closest syscall.   No buffer space available...
   raise SyscallError("_get_available_tcp_port","ENOBUFS","No TCP port available")
@@ -127,11 +137,13 @@ def _get_available_tcp_port():
 STARTINGSOCKOBJID = 0
 MAXSOCKOBJID = 1024
 
+socketobjidallocator = LowestFreeAllocator(range(STARTINGSOCKOBJID,MAXSOCKOBJID), socketobjecttable)
+
 # get an available socket object ID...
 def _get_next_socketobjid():
-  for sockobjid in range(STARTINGSOCKOBJID,MAXSOCKOBJID):
-    if not sockobjid in socketobjecttable:
-      return sockobjid
+  sockobjid = socketobjidallocator.allocate()
+  if sockobjid != None:
+    return sockobjid
 
   raise SyscallError("_get_next_socketobjid","ENOBUFS","Insufficient buffer space is available to create a new socketobjid")
 
@@ -142,6 +154,29 @@ def _insert_into_socketobjecttable(socketobj):
 
 
 
+# These are used to checkpoint the state of the network calls and to resume 
+# from it, like checkpoint_fs_state and resume_fs_state do for the file 
+# system calls (which also keep the fds of sockets).
+def checkpoint_net_state():
+  return {'socketobjecttable':socketobjecttable,
+          'usedudpports':usedudpportsset,
+          'usedtcpports':usedtcpportsset}
+
+
+def resume_net_state(state):
+  socketobjecttable.clear()
+  socketobjecttable.update(state['socketobjecttable'])
+  usedudpportsset.clear()
+  usedudpportsset.update(state['usedudpports'])
+  usedtcpportsset.clear()
+  usedtcpportsset.update(state['usedtcpports'])
+
+  socketobjidallocator.reset()
+  udpportallocator.reset()
+  tcpportallocator.reset()
+
+
+
 #################### The actual system calls...   #############################
 
 
@@ -152,19 +187,19 @@ def _insert_into_socketobjecttable(socketobj):
 # A private helper that initializes a socket given validated arguments.
 def _socket_initializer(domain,socktype,protocol, blocking=False, cloexec=False):
   # get a file descriptor
-  flags = []
+  flags = 0
   if blocking:
-    flags.append('O_NONBLOCK')
+    flags |= O_NONBLOCK
+  fdflags = 0
   if cloexec:
-    flags.append('O_CLOEXEC')
+    fdflags |= FD_CLOEXEC
 
   newfd = get_next_fd()
 
   # NOTE: I'm intentionally omitting the 'inode' field.  This will make most
   # of the calls I did not change break.
   filedescriptortable[newfd] = {
-      #'mode':S_IFSOCK|0666, # set rw-rw-rw- perms too. This is what POSIX does.
-      'mode': ['S_IFSOCK', 'S_IRUSR', 'S_IWUSR', 'S_IRGRP', 'S_IWGRP', 'S_IROTH', 'S_IWOTH'],
+      'mode':S_IFSOCK|0666, # set rw-rw-rw- perms too. This is what POSIX does.
       'domain':domain,
       'type':socktype,      # I'm using this name because it's used by POSIX.
       'protocol':protocol,
@@ -175,6 +210,7 @@ def _socket_initializer(domain,socktype,protocol, blocking=False, cloexec=False)
       'state':NOTCONNECTED, # we start without any connection
       'lock':createlock(),
       'flags':flags,
+      'fdflags':fdflags,
       'errno':0
 # We don't set the ip / ports or socketobjectid because they are unknown now.
   }
@@ -190,9 +226,9 @@ def socket_syscall(domain, socktype, protocol):
   """
   # this code is basically one huge case statement by domain
 
-  domain = flag2list(domain)
-  socktype = flag2list(socktype)
-  protocol = flag2list(protocol)
+  domain = flag2list(domain, 'domain')
+  socktype = flag2list(socktype, 'socktype')
+  protocol = flag2list(protocol, 'protocol')
 
 
   blocking = int('SOCK_NONBLOCK' in socktype) # check the non-blocking flag
@@ -442,7 +478,7 @@ def sendto_syscall(fd, message, length, flags, domain, remoteport, remoteip, add
   """ 
     http://linux.die.net/man/2/sendto
   """
-  flags = flag2list(flags)
+  flags = flag2list(flags, 'msg')
 
   # Specify all non-deterministic errors that could occur.
   sendto_nondeter_errors = ['ENETUNREACH']
@@ -539,7 +575,7 @@ def send_syscall(fd, message, msg_len, flags):
   send_nondeter_errors = ["EWOULDBLOCK","EPIPE","EBADF","EBADR","ENOLINK","EBADFD",
                           "ENETRESET","ECONNRESET","WSAEBADF","WSAENOTSOCK",
                           "WSAECONNRESET","EAGAIN"]
-  flags = flag2list(flags)
+  flags = flag2list(flags, 'msg')
 
   if fd in ignore_fd:
     return IgnoredFileDescriptorWarning("send_syscall", "The file descriptor is ignored.") 
@@ -622,7 +658,7 @@ def recvfrom_syscall(fd, buf_len, flags):
   """ 
     http://linux.die.net/man/2/recvfrom
   """
-  flags = flag2list(flags)
+  flags = flag2list(flags, 'msg')
 
   if fd in ignore_fd:
     return IgnoredFileDescriptorWarning("recvfrom_syscall", "The file descriptor is ignored.") 
@@ -720,7 +756,7 @@ def recv_syscall(fd, length, flags):
   """ 
     http://linux.die.net/man/2/recv
   """
-  flags = flag2list(flags)
+  flags = flag2list(flags, 'msg')
 
   if fd in ignore_fd:
     return IgnoredFileDescriptorWarning("recvfrom_syscall", "The file descriptor is ignored.") 
@@ -1202,6 +1238,7 @@ def close_network_fd(fd):
       raise UnimplementedError("Unable to close non-udp/tcp sockets.")
 
     del socketobjecttable[filedescriptortable[fd]['socketobjectid']]
+    socketobjidallocator.release(filedescriptortable[fd]['socketobjectid'])
     del filedescriptortable[fd]['socketobjectid']
       
   filedescriptortable[fd]['state'] = NOTCONNECTED
@@ -1216,7 +1253,7 @@ def setshutdown_syscall(fd, how):
   """ 
     http://linux.die.net/man/2/shutdown
   """
-  how = flag2list(how)
+  how = flag2list(how, 'shutdown')
 
   if fd in ignore_fd:
     return IgnoredFileDescriptorWarning("setshutdown_syscall", "The file descriptor is ignored.") 
@@ -0,0 +1,85 @@
+#!/bin/bash
+# Used to benchmark the actions sent from the CheckAPI interposition to the
+# verification process. Prints the actions per second and the bytes per
+# action logged by the verification process for each workload.
+
+# Command to run for seclayer
+SEC_CMD="python repy.py restrictions.full"
+CHECKAPIVERIFY="python repy.py restrictions.full dylink.repy check_api_verify.repy"
+
+# Output of the verification process
+VERIFY_LOG="checkapi_wire_verify.log"
+
+
+# Prints the wire statistics of the last verification process.
+print_statistics()
+{
+    # Wait for the verification process to finish
+    wait $VERIFY_PID
+    grep -E "Actions Received|Bytes Received|Bytes per Action|Actions per Second" $VERIFY_LOG
+    echo "-------------------------------------------------------"
+    echo
+}
+
+# Starts the verification process and waits for it to listen.
+start_verification()
+{
+    # Kill all python instances
+    killall -9 python Python >/dev/null 2>&1
+
+    echo "Lanuch Verification  Command: $CHECKAPIVERIFY"
+    $CHECKAPIVERIFY > $VERIFY_LOG 2>&1 &
+    VERIFY_PID=$!
+
+    # Wait for Verification process start
+    sleep 2
+}
+
+
+echo
+echo "##############################"
+echo "richards test"
+echo "##############################"
+echo
+
+SERVER="dylink.repy check_api.repy richards.repy 30"
+start_verification
+echo "Lanuch Interposition Command: $SEC_CMD $SERVER"
+$SEC_CMD $SERVER > /dev/null
+print_statistics
+
+
+for TEST in allpairsping webserver
+do
+    echo
+    echo "##############################"
+    echo "$TEST test"
+    echo "##############################"
+    echo
+
+    if [ $TEST = "allpairsping" ]
+    then
+        SERVER="dylink.repy check_api.repy librepy.repy allpairspingv2.repy 12345"
+    else
+        SERVER="dylink.repy check_api.repy librepy.repy webserver-listfiles.repy"
+    fi
+
+    start_verification
+    echo "Lanuch Interposition Command: $SEC_CMD $SERVER"
+    $SEC_CMD $SERVER > /dev/null &
+    PID=$!
+
+    # Wait for Interpostion process start
+    sleep 10
+
+    # Start Test Script
+    ./test_fetch2.sh
+
+    # Test fininshed. Kill Interposition process, which closes the socket of
+    # the verification process.
+    kill -9 $PID
+    wait $PID 2>/dev/null
+    print_statistics
+done
+
+rm -f $VERIFY_LOG